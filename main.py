@@ -1,15 +1,14 @@
-from random import random, randint
 from math import sin, cos, pi
-from time import sleep
-from colorsys import rgb_to_hsv, hsv_to_rgb
 
 import pygame
 from pygame.locals import Rect
 
 import sparticles
 from svector import SVector2 as Vector
-from scircles import PhysicWorld as World
-from sparticles import Particle
+from scircles import PhysicWorld
+from srandom import SPAWN
+from srender import Renderer
+from sstepper import Stepper
 
 pygame.init()
 pygame.font.init()
@@ -24,7 +23,19 @@ screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
 
 W, H = screen.get_size()
 SCALE = 40
-world = World(W, H, SCALE)
+# Seed of the simulation, None for a different run every time
+SEED = None
+# Set to True to run the simulation on the NumPy array backend (sarrays)
+ARRAY_BACKEND = False
+if ARRAY_BACKEND:
+    from sarrays import ArrayParticleWorld
+World = ArrayParticleWorld if ARRAY_BACKEND else PhysicWorld
+world = World(W, H, SCALE, SEED, rules=sparticles.RuleSet.load())
+# Set to True to apply the attractions and repulsions of forces.csv (sforces)
+FORCES = False
+if FORCES:
+    import sforces
+    world.forces = sforces.ForceField.load(rules=world.rules)
 
 min_vel = 50
 max_vel = 100
@@ -33,25 +44,31 @@ background_color = [0, 0, 15]
 
 #n_objs = 2
 n_objs = int(W * H * volume_density)
+spawn = world.rng.stream(SPAWN)
+symbols = []
+positions = []
+velocities = []
 for i in range(n_objs):
-    angle = random()*pi*2.0
-    speed = min_vel + random() * (max_vel - min_vel)
+    angle = spawn.random()*pi*2.0
+    speed = min_vel + spawn.random() * (max_vel - min_vel)
     velocity = Vector(cos(angle), sin(angle)) * speed
     maxx = W
     maxy = H
     minx = 0
     miny = 0
-    newpos = Vector(minx+random()*(maxx-minx), miny+random()*(maxy-miny))
-    symbol = ['Re', 'Gr', 'Bl'][randint(0, 2)]
-    part = sparticles.create_particle(symbol, world, newpos)
-    part.velocity = velocity
+    newpos = Vector(minx+spawn.random()*(maxx-minx), miny+spawn.random()*(maxy-miny))
+    symbols.append(['Re', 'Gr', 'Bl'][spawn.randint(0, 2)])
+    positions.append(newpos)
+    velocities.append(velocity)
+sparticles.spawn_many(world, symbols, positions, velocities)
 
 def draw_grid():
     global world, screen
-    for x in range(len(world.grid)):
-        for y in range(len(world.grid[x])):
+    grid = world.index.grid
+    for x in range(len(grid)):
+        for y in range(len(grid[x])):
             color = [0, 0, 0]
-            if len(world.grid[x][y]) > 0:
+            if len(grid[x][y]) > 0:
                 color[0] = 100
             sx = x * world.scale
             ex = (x + 1) * world.scale
@@ -59,32 +76,19 @@ def draw_grid():
             ey = world.H - y * world.scale
             pygame.draw.rect(screen, color, Rect(sx, sy, ex-sx, ey-sy))
 
-def draw_object(particle : Particle):
-    global screen, W, H, symbol_font
-    mopos = particle.position.as_list()
-    mopos[1] = H - mopos[1]
-    pygame.draw.circle(screen, particle.color, mopos, particle.radius)
-    # draw text
-    h, s, v = rgb_to_hsv(particle.color[0], particle.color[1], particle.color[2])
-    nh = (h + 0.5) % 1
-    ns = s
-    nv = 100
-    brightness = sum(particle.color)
-    text = symbol_font.render(particle.symbol, True, hsv_to_rgb(nh, ns, nv))
-    text_rect = text.get_rect(center=(particle.position.x, H - particle.position.y))
-    screen.blit(text, text_rect)
+renderer = Renderer(screen, symbol_font)
 
 screen.fill(background_color)
 pygame.display.flip()
 
-t = 0
 delta = 0.01
+stepper = Stepper(world, delta)
+stepper.paused = True
+stepper.start()
+clock = pygame.time.Clock()
+drawn_frame = -1
 running = True
-step_by_step = True
-continuous_step = False
-fast_forward = False
 while running:
-    step = False
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             running = False
@@ -92,38 +96,32 @@ while running:
             if event.key == pygame.K_ESCAPE:
                 running = False
             if event.key == pygame.K_COMMA:
-                step = True
-                fast_forward = True
+                stepper.step()
+                stepper.fast_forward = True
             if event.key == pygame.K_SPACE:
-                step_by_step = not step_by_step
+                stepper.paused = not stepper.paused
             if event.key == pygame.K_PERIOD:
-                continuous_step = True
+                stepper.hold = True
+            if event.key == pygame.K_l:
+                renderer.labels = not renderer.labels
         if event.type == pygame.KEYUP:
             if event.key == pygame.K_PERIOD:
-                continuous_step = False
+                stepper.hold = False
             if event.key == pygame.K_COMMA:
-                fast_forward = False
-    if step_by_step and not step and not continuous_step:
-        continue
-    world.simulate(delta)
-    #draw_grid()
-    screen.fill(background_color)
-    ie = 0
-    te = 0
-    for object in world.objects:
-        draw_object(object)
-        ie += object.internal_energy
-        te += object.total_energy()
-    for object in world.new_objects:
-        draw_object(object)
-        ie += object.internal_energy
-        te += object.total_energy()
-    
-    ie_surface = main_font.render(f'IE: {round(ie)}', False, (255, 255, 255))
-    te_surface = main_font.render(f'TE: {round(te)}', False, (255, 255, 255))
-    screen.blit(ie_surface, (10, 10))
-    screen.blit(te_surface, (10, 40))
-    pygame.display.flip()
-    t += delta
-    if not fast_forward:
-        sleep(delta)
+                stepper.fast_forward = False
+    # The simulation runs on its own thread, draw its latest frame when there is a new one
+    snapshot = stepper.snapshot()
+    if snapshot.frame != drawn_frame and renderer.should_draw():
+        drawn_frame = snapshot.frame
+        #draw_grid()
+        screen.fill(background_color)
+        renderer.draw_particles(snapshot.particles)
+        ie_surface = main_font.render(f'IE: {round(snapshot.internal_energy)}', False, (255, 255, 255))
+        te_surface = main_font.render(f'TE: {round(snapshot.total_energy)}', False, (255, 255, 255))
+        time_surface = main_font.render(f'Sim: {snapshot.step_time * 1000:.1f} ms  Draw: {renderer.draw_time * 1000:.1f} ms', False, (255, 255, 255))
+        screen.blit(ie_surface, (10, 10))
+        screen.blit(te_surface, (10, 40))
+        screen.blit(time_surface, (10, 70))
+        pygame.display.flip()
+    clock.tick(60)
+stepper.stop()
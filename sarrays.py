@@ -0,0 +1,506 @@
+from __future__ import annotations
+from typing import List, Dict, Tuple, Optional, Iterable, Any
+from itertools import chain
+
+import numpy as np
+
+from svector import SVector2 as Vector
+from svarray import SVector2Array
+from sgridspace import WObject
+from scircles import PhysicWorld, SCircle, REACTION, SPLIT
+import sparticles
+import srandom
+
+# Cell offsets that visit every neighbouring pair of cells exactly once
+HALF_NEIGHBOURS : List[Tuple[int, int]] = [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]
+
+class RowVector(Vector):
+    """Position or velocity read from the columns of an array backed object.
+
+    It is a copy, but its in place variants (iadd, isub, imul) write the result back to the
+    object, like they change the vector of an SCircle. Setting x or y doesn't."""
+    __slots__ = ("owner", "column")
+
+    def __init__(self, owner : WObject, column : str):
+        row = getattr(owner.world, column)[owner.slot]
+        Vector.__init__(self, float(row[0]), float(row[1]))
+        self.owner : WObject = owner
+        self.column : str = column
+
+    def store(self) -> RowVector:
+        getattr(self.owner.world, self.column)[self.owner.slot] = (self.x, self.y)
+        return self
+
+    def iadd(self, other : Vector) -> RowVector:
+        Vector.iadd(self, other)
+        return self.store()
+
+    def isub(self, other : Vector) -> RowVector:
+        Vector.isub(self, other)
+        return self.store()
+
+    def imul(self, other : float) -> RowVector:
+        Vector.imul(self, other)
+        return self.store()
+
+class ArrayBody:
+    """Mixin that turns a world object into a thin view over the columns of an ArrayPhysicWorld.
+
+    Every attribute that lives in the world storage is read from and written to its slot,
+    so code written against SCircle/Particle keeps working unchanged."""
+    __slots__ = ()
+
+    @property
+    def position(self) -> Vector:
+        return RowVector(self, "pos")
+
+    @position.setter
+    def position(self, value : Vector):
+        self.world.pos[self.slot] = (value.x, value.y)
+
+    @property
+    def velocity(self) -> Vector:
+        return RowVector(self, "vel")
+
+    @velocity.setter
+    def velocity(self, value : Vector):
+        self.world.vel[self.slot] = (value.x, value.y)
+
+    @property
+    def mass(self) -> float:
+        return float(self.world.mass[self.slot])
+
+    @mass.setter
+    def mass(self, value : float):
+        self.world.mass[self.slot] = value
+
+    @property
+    def radius(self) -> float:
+        return float(self.world.radius[self.slot])
+
+    @radius.setter
+    def radius(self, value : float):
+        self.world.radius[self.slot] = value
+
+    @property
+    def internal_energy(self) -> float:
+        return float(self.world.energy[self.slot])
+
+    @internal_energy.setter
+    def internal_energy(self, value : float):
+        self.world.energy[self.slot] = value
+
+    def update_grid(self):
+        super().update_grid()
+        l = self.limits
+        self.world.lims[self.slot] = (l.minX, l.maxX, l.minY, l.maxY)
+
+    def remove(self):
+        super().remove()
+        self.world.active[self.slot] = False
+        self.world.live[self.slot] = False
+
+def grid_pairs(pos : np.ndarray, size : float) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the index pairs (a, b) of the points of pos lying in the same or in
+    neighbouring cells of a grid of the given cell size, each pair once.
+
+    Every pair of points closer than size is among them."""
+    empty = np.zeros(0, np.int64)
+    if len(pos) < 2:
+        return empty, empty
+    cells = np.floor(pos / size).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    rows = int(cells[:, 1].max()) + 2
+    keys = cells[:, 0] * rows + cells[:, 1]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    firsts : List[np.ndarray] = []
+    seconds : List[np.ndarray] = []
+    for dx, dy in HALF_NEIGHBOURS:
+        near = keys + dx * rows + dy
+        start = np.searchsorted(sorted_keys, near, "left")
+        counts = np.searchsorted(sorted_keys, near, "right") - start
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        a = np.repeat(np.arange(len(pos)), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        b = order[np.repeat(start, counts) + offsets]
+        if dx == 0 and dy == 0:
+            keep = a < b
+            a, b = a[keep], b[keep]
+        firsts.append(a)
+        seconds.append(b)
+    if not firsts:
+        return empty, empty
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+views : Dict[type, type] = {}
+
+def view_type(cls : type) -> type:
+    """Returns (and caches) the array backed version of a world object class."""
+    view = views.get(cls)
+    if view is None:
+        view = type(cls.__name__, (ArrayBody, cls), {"__slots__": ()})
+        views[cls] = view
+    return view
+
+class ArrayPhysicWorld(PhysicWorld):
+    """PhysicWorld that keeps its objects state in contiguous NumPy columns.
+
+    Integration, wall bounces, broad phase and the elastic response of SCircle.collide
+    run as batch operations over the columns. Objects are views over their slot."""
+    columns : List[Tuple[str, tuple, type]] = [
+        ("pos", (2,), np.float64),
+        ("vel", (2,), np.float64),
+        ("mass", (), np.float64),
+        ("radius", (), np.float64),
+        ("energy", (), np.float64),
+        ("species", (), np.int32),
+        # WObject.uid, keys the batched random draws
+        ("uid", (), np.int64),
+        # Simulated: moved and bounced off the walls. Set once the object left new_objects,
+        # cleared while it sleeps
+        ("active", (), np.bool_),
+        # Frames spent at rest, see PhysicWorld.sleep_frames
+        ("idle", (), np.int32),
+        # Not dead. Pending objects already take part in collisions, like on the object path
+        ("live", (), np.bool_),
+        ("lims", (4,), np.int64),
+    ]
+
+    def __init__(self, width: float, height: float, scale: float, seed : Optional[int] = None, index : Optional[Any] = None,
+                 rules : Optional[sparticles.RuleSet] = None):
+        PhysicWorld.__init__(self, width, height, scale, seed, index, rules)
+        # Contacts found by sim_collisions, bounced by resolve_events
+        self.bounces : Tuple[np.ndarray, np.ndarray] = (np.zeros(0, np.int64), np.zeros(0, np.int64))
+        self.size : int = 0
+        self.capacity : int = 0
+        self.owners : List[Optional[WObject]] = []
+        self.free : List[int] = []
+        for name, shape, dtype in self.columns:
+            setattr(self, name, np.zeros((0,) + shape, dtype))
+        self.grow(64)
+
+    def grow(self, capacity : int):
+        """Resizes every column to hold at least capacity slots."""
+        for name, shape, dtype in self.columns:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + shape, dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.owners.extend([None] * (capacity - self.capacity))
+        self.capacity = capacity
+
+    def register(self, obj : WObject):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.size == self.capacity:
+                self.grow(self.capacity * 2)
+            slot = self.size
+            self.size += 1
+        obj.__class__ = view_type(type(obj))
+        obj.slot = slot
+        self.owners[slot] = obj
+        for name, shape, dtype in self.columns:
+            getattr(self, name)[slot] = 0
+        self.live[slot] = True
+        self.uid[slot] = obj.uid
+
+    def bind(self, obj : WObject):
+        """Called once for every object that joins the simulation."""
+        pass
+
+    def add_objects(self):
+        for o in self.new_objects:
+            if not o.dead:
+                self.active[o.slot] = True
+                self.bind(o)
+        PhysicWorld.add_objects(self)
+
+    def clear_objects(self):
+        for o in self.dying:
+            self.owners[o.slot] = None
+            self.free.append(o.slot)
+        PhysicWorld.clear_objects(self)
+        if len(self.free) > max(self.size // 2, 64):
+            self.compact()
+
+    def compact(self):
+        """Moves every object to the front of the storage, in slot order, so batch
+        operations stop scanning the slots freed by dead objects."""
+        owners = self.owners
+        keep = np.array([slot for slot in range(self.size) if owners[slot] is not None], np.int64)
+        n = len(keep)
+        for name, shape, dtype in self.columns:
+            column = getattr(self, name)
+            column[:n] = column[keep]
+        kept = [owners[slot] for slot in keep.tolist()]
+        for slot, obj in enumerate(kept):
+            obj.slot = slot
+        self.owners = kept + [None] * (self.capacity - n)
+        self.size = n
+        self.free = []
+
+    def remove_many(self, objs : Iterable[WObject]):
+        objs = [o for o in objs if not o.dead]
+        PhysicWorld.remove_many(self, objs)
+        slots = np.fromiter((o.slot for o in objs), np.int64, len(objs))
+        self.active[slots] = False
+        self.live[slots] = False
+
+    def rebuild_grid(self, objs : Optional[Iterable[WObject]] = None, limits : Optional[Iterable[Tuple[int, int, int, int]]] = None, clear : bool = True):
+        objs = list(chain(self.objects, self.new_objects) if objs is None else objs)
+        PhysicWorld.rebuild_grid(self, objs, limits, clear)
+        for o in objs:
+            if not o.dead:
+                l = o.limits
+                self.lims[o.slot] = (l.minX, l.maxX, l.minY, l.maxY)
+
+    def positions(self) -> SVector2Array:
+        """Returns the positions of every slot, as a view. Inactive slots hold garbage."""
+        return SVector2Array(self.pos[:self.size])
+
+    def velocities(self) -> SVector2Array:
+        """Returns the velocities of every slot, as a view. Inactive slots hold garbage."""
+        return SVector2Array(self.vel[:self.size])
+
+    def active_slots(self) -> np.ndarray:
+        return np.flatnonzero(self.active[:self.size])
+
+    def broad_slots(self) -> np.ndarray:
+        """Returns the slots that take part in the broad phase."""
+        return np.flatnonzero(self.live[:self.size])
+
+    def wake(self, obj : WObject):
+        PhysicWorld.wake(self, obj)
+        self.active[obj.slot] = True
+        self.idle[obj.slot] = 0
+
+    def sleep(self, obj : WObject):
+        del self.awake[obj]
+        self.sleeping[obj] = None
+        self.active[obj.slot] = False
+        self.vel[obj.slot] = 0.0
+
+    def restless(self, slots : np.ndarray) -> np.ndarray:
+        """Batched SCircle.can_sleep, True for the slots that can not sleep."""
+        return np.zeros(len(slots), np.bool_)
+
+    def settle_slots(self, a : np.ndarray, b : np.ndarray):
+        """Batched PhysicWorld.settle, for the contacts (a, b) of this step."""
+        sleeping = self.sleeping
+        if sleeping:
+            for slot in np.concatenate((a, b))[~self.active[np.concatenate((a, b))]]:
+                obj = self.owners[slot]
+                if obj in sleeping:
+                    self.wake(obj)
+        if not self.sleep_frames:
+            return
+        slots = self.active_slots()
+        vel = self.vel[slots]
+        still = (vel * vel).sum(axis=1) <= self.sleep_speed * self.sleep_speed
+        still &= ~self.restless(slots)
+        idle = self.idle
+        idle[slots] = np.where(still, idle[slots] + 1, 0)
+        idle[a] = 0
+        idle[b] = 0
+        for slot in slots[idle[slots] >= self.sleep_frames]:
+            obj = self.owners[slot]
+            if not obj.dead:
+                self.sleep(obj)
+
+    def sync_grid(self, slots : np.ndarray):
+        """Updates the grid registration of the given slots whose cell range changed."""
+        pos = self.pos[slots]
+        rad = self.radius[slots]
+        lims = np.empty((len(slots), 4), np.int64)
+        lims[:, 0] = np.floor((pos[:, 0] - rad) / self.scale)
+        lims[:, 1] = np.floor((pos[:, 0] + rad) / self.scale)
+        lims[:, 2] = np.floor((pos[:, 1] - rad) / self.scale)
+        lims[:, 3] = np.floor((pos[:, 1] + rad) / self.scale)
+        changed = (lims != self.lims[slots]).any(axis=1)
+        for slot in slots[changed]:
+            self.owners[slot].update_grid()
+
+    def sim_move(self, delta : float):
+        slots = self.active_slots()
+        travel = np.hypot(self.vel[slots, 0], self.vel[slots, 1]) * delta
+        fast = travel > self.max_travel * np.minimum(self.radius[slots], self.scale)
+        fast_slots = slots[fast]
+        fast_slots = fast_slots[np.argsort(self.uid[fast_slots], kind="stable")]
+        slots = slots[~fast]
+        self.pos[slots] += self.vel[slots] * delta
+        self.version += 1
+        self.sync_grid(slots)
+        # Few fast objects, substepped and swept one by one through their views, oldest first
+        for slot in fast_slots:
+            obj = self.owners[slot]
+            if not obj.dead:
+                SCircle.sim_move(obj, delta)
+
+    def sim_wall_bounce(self):
+        n = self.size
+        act = self.active[:n]
+        pos = self.pos[:n]
+        vel = self.vel[:n]
+        rad = self.radius[:n]
+        over_x = pos[:, 0] + rad > self.W
+        flip_x = act & ((over_x & (vel[:, 0] > 0)) | (~over_x & (pos[:, 0] - rad < 0) & (vel[:, 0] < 0)))
+        over_y = pos[:, 1] + rad > self.H
+        flip_y = act & ((over_y & (vel[:, 1] > 0)) | (~over_y & (pos[:, 1] - rad < 0) & (vel[:, 1] < 0)))
+        vel[flip_x, 0] *= -1
+        vel[flip_y, 1] *= -1
+
+    def contact_pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the slots of every pair of live objects that strictly overlap.
+
+        Each contact is reported once, as (a, b) with a older (lower uid) than b, sorted by
+        uid like on the object path, so the order doesn't depend on the slots."""
+        slots = self.broad_slots()
+        empty = np.zeros(0, np.int64)
+        self.pair_tests = 0
+        if len(slots) < 2:
+            return empty, empty
+        pos = self.pos[slots]
+        rad = self.radius[slots]
+        a, b = grid_pairs(pos, max(self.scale, 2.0 * float(rad.max())))
+        self.pair_tests = len(a)
+        d = pos[b] - pos[a]
+        reach = rad[a] + rad[b]
+        hit = (d * d).sum(axis=1) < reach * reach
+        a, b = slots[a[hit]], slots[b[hit]]
+        uid = self.uid
+        older = uid[a] < uid[b]
+        first = np.where(older, a, b)
+        second = np.where(older, b, a)
+        order = np.lexsort((uid[second], uid[first]))
+        return first[order], second[order]
+
+    def bounce_pairs(self, a : np.ndarray, b : np.ndarray):
+        """Applies the elastic response of SCircle.collide to every (a, b) pair.
+
+        Pairs are resolved in rounds in which no object appears twice, so every exchange
+        sees the velocities left by the previous ones, just like the object path."""
+        first = np.empty(self.size, np.int64)
+        while len(a):
+            order = np.arange(len(a))
+            first[a] = len(a)
+            first[b] = len(a)
+            np.minimum.at(first, a, order)
+            np.minimum.at(first, b, order)
+            now = (first[a] == order) & (first[b] == order)
+            self.bounce_batch(a[now], b[now])
+            a, b = a[~now], b[~now]
+
+    def bounce_batch(self, a : np.ndarray, b : np.ndarray):
+        """Applies the elastic response to pairs that share no object."""
+        d = self.pos[b] - self.pos[a]
+        invel = (d * (self.vel[a] - self.vel[b])).sum(axis=1)
+        m1 = self.mass[a]
+        m2 = self.mass[b]
+        total = m1 + m2
+        sqrdist = (d * d).sum(axis=1)
+        ok = (invel >= 0) & (sqrdist > 0) & (total > 0)
+        a, b, d = a[ok], b[ok], d[ok]
+        m1, m2, total = m1[ok], m2[ok], total[ok]
+        approach = d * (invel[ok] / sqrdist[ok])[:, None]
+        self.vel[a] += approach * (-2.0 * m2 / total)[:, None]
+        self.vel[b] += approach * (2.0 * m1 / total)[:, None]
+
+    def sim_collisions(self):
+        a, b = self.contact_pairs()
+        self.collision_pairs = len(a)
+        self.settle_slots(a, b)
+        self.bounces = (a, b)
+
+    def resolve_events(self):
+        PhysicWorld.resolve_events(self)
+        a, b = self.bounces
+        if len(a):
+            self.bounces = (a[:0], b[:0])
+            alive = self.live[a] & self.live[b]
+            self.bounce_pairs(a[alive], b[alive])
+
+class ArrayParticleWorld(ArrayPhysicWorld):
+    """ArrayPhysicWorld that applies the CSV driven rules of sparticles in batch.
+
+    Reactions and splits are rare, they are queued as events and resolved by Particle.
+    Within a step, every reaction is applied before the bounces, then the collision splits."""
+    def __init__(self, width: float, height: float, scale: float, seed : Optional[int] = None, index : Optional[Any] = None,
+                 rules : Optional[sparticles.RuleSet] = None):
+        ArrayPhysicWorld.__init__(self, width, height, scale, seed, index, rules)
+        rules = sparticles.rules_of(self)
+        blueprints = rules.species
+        self.blueprints : List[sparticles.ParticleBlueprint] = blueprints
+        self.max_energy : np.ndarray = np.array([b.max_energy for b in blueprints], np.float64)
+        self.stability : np.ndarray = np.array([b.stability for b in blueprints], np.float64)
+        self.coll_stability : np.ndarray = np.array([b.coll_stability for b in blueprints], np.float64)
+        self.solid : np.ndarray = np.array([b.solid for b in blueprints], np.bool_)
+        self.reactions : np.ndarray = np.array(rules.reaction_table, np.int32).reshape(len(blueprints), len(blueprints))
+        # Split products of species s are split_products[split_start[s]:split_start[s] + split_count[s]]
+        self.split_count : np.ndarray = np.array([len(p) for p in rules.split_table], np.int32)
+        self.split_start : np.ndarray = np.concatenate(([0], np.cumsum(self.split_count)[:-1])).astype(np.int32)
+        self.split_products : np.ndarray = np.array([pair for p in rules.split_table for pair in p], np.int32).reshape(-1, 2)
+
+    def bind(self, obj : WObject):
+        self.species[obj.slot] = obj.blueprint.id
+
+    def broad_slots(self) -> np.ndarray:
+        n = self.size
+        return np.flatnonzero(self.live[:n] & self.solid[self.species[:n]])
+
+    def restless(self, slots : np.ndarray) -> np.ndarray:
+        return self.energy[slots] > self.max_energy[self.species[slots]]
+
+    def sim_move(self, delta : float):
+        slots = self.active_slots()
+        species = self.species[slots]
+        draws = self.rng.uniforms(self.uid[slots], self.frame, srandom.STABILITY)
+        unstable = (self.energy[slots] > self.max_energy[species]) & (draws > self.stability[species])
+        unstable &= self.split_count[species] > 0
+        unstable_slots = slots[unstable]
+        for slot in unstable_slots[np.argsort(self.uid[unstable_slots], kind="stable")]:
+            self.emit(SPLIT, self.owners[slot])
+        ArrayPhysicWorld.sim_move(self, delta)
+
+    def sim_collisions(self):
+        # Objects born during this step collide already, they need their species
+        for o in self.new_objects:
+            if not o.dead:
+                self.bind(o)
+        a, b = self.contact_pairs()
+        self.collision_pairs = len(a)
+        self.settle_slots(a, b)
+        sa, sb = self.species[a], self.species[b]
+        products = self.reactions[sa, sb]
+        react = products >= 0
+        owners = self.owners
+        blueprints = self.blueprints
+        for x, y, p in zip(a[react].tolist(), b[react].tolist(), products[react].tolist()):
+            self.emit(REACTION, owners[x], owners[y], blueprints[p])
+        self.bounces = (a[~react], b[~react])
+
+    def resolve_events(self):
+        # 1- Reactions, and the splits of sim_move
+        PhysicWorld.resolve_events(self)
+        a, b = self.bounces
+        if not len(a):
+            return
+        self.bounces = (a[:0], b[:0])
+        alive = self.live[a] & self.live[b]
+        a, b = a[alive], b[alive]
+        # 2- Elastic response
+        self.bounce_pairs(a, b)
+        # 3- The heavier partner of each bounce may break apart
+        ma, mb = self.mass[a], self.mass[b]
+        unequal = ma != mb
+        heavy = np.where(ma > mb, a, b)[unequal]
+        light = np.where(ma > mb, b, a)[unequal]
+        heavy_species = self.species[heavy]
+        draws = self.rng.uniforms(self.uid[heavy], self.uid[light], self.frame, srandom.COLLISION)
+        broken = (draws > self.coll_stability[heavy_species]) & (self.split_count[heavy_species] > 0)
+        for slot in heavy[broken]:
+            self.emit(SPLIT, self.owners[slot])
+        PhysicWorld.resolve_events(self)
@@ -0,0 +1,441 @@
+"""Headless benchmarks for the simulation modules. Never imports pygame.
+
+Usage:
+    python sbench.py grid [--objects N] [--frames N] [--seed N]
+    python sbench.py scenario [NAME ...] [--frames N] [--seed N] [--backend object|array] [--snapshot FILE] [--profile FILE]
+    python sbench.py save NAME FILE [--seed N]
+    python sbench.py parallel [NAME] [--frames N] [--seed N] [--workers N ...]
+    python sbench.py memory [--particles N] [--backend object|array]
+    python sbench.py index [NAME ...] [--frames N] [--seed N] [--indexes KIND ...]
+    python sbench.py forces [--particles N ...] [--frames N] [--theta X] [--backend object|array]
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional, Any
+from argparse import ArgumentParser
+from math import pi, cos, sin
+from random import Random
+from time import perf_counter
+from itertools import chain
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from svector import SVector2 as Vector
+from sgridspace import World, WObject, UniformGrid
+from scircles import PhysicWorld
+from srandom import SPAWN
+import sparticles
+
+# Canned scenarios, as keyword arguments for build_world
+SCENARIOS : Dict[str, Dict[str, Any]] = {
+    "sparse": {"volume_density": 0.0001},
+    "dense": {"volume_density": 0.001},
+    "reactions": {"volume_density": 0.0006, "species": {"Re": 2, "Gr": 2, "Bl": 2, "Ye": 1, "Ma": 1, "Cy": 1}},
+    "splits": {"volume_density": 0.0003, "species": {"Wh": 1, "Ye": 1, "Ma": 1, "Cy": 1}, "energy_factor": 2.0},
+    "mixed": {"volume_density": 0.0006, "species": {"Re": 3, "Ye": 1, "Wh": 1}},
+    # Mostly at rest, the few moving particles wake the sleeping ones they hit
+    "settled": {"volume_density": 0.0006, "moving": 0.02, "sleep_frames": 10},
+}
+# Spatial indexes compared by bench_index
+INDEXES : List[str] = ["uniform", "auto", "hash", "multi"]
+
+def build_world(width : float = 1920, height : float = 1080, scale : float = 40, volume_density : float = 0.0003,
+                species : Optional[Dict[str, float]] = None, min_vel : float = 50, max_vel : float = 100,
+                energy_factor : float = 0.0, moving : float = 1.0, sleep_frames : int = 0, seed : int = 0,
+                backend : str = "object", rules : Optional[sparticles.RuleSet] = None) -> PhysicWorld:
+    """Builds and populates a world the same way main.py does, without a display.
+
+    Args:
+        width (float): World width
+        height (float): World height
+        scale (float): Grid cell size
+        volume_density (float): Particles per unit of area
+        species (Dict[str, float]): Relative weight of each spawned species. Defaults to Re, Gr and Bl
+        min_vel (float): Minimum spawn speed
+        max_vel (float): Maximum spawn speed
+        energy_factor (float): Spawn internal energy, as a multiple of each species max energy
+        moving (float): Fraction of the particles spawned with a velocity, the others start at rest
+        sleep_frames (int): PhysicWorld.sleep_frames, 0 to never put resting particles to sleep
+        seed (int): Seed for the spawn positions and the simulation random draws
+        backend (str): "object" for PhysicWorld, "array" for sarrays.ArrayParticleWorld
+        rules (sparticles.RuleSet): Rules of the world, defaults to sparticles.default_rules
+
+    Returns:
+        PhysicWorld: The populated world
+    """
+    if backend == "array":
+        from sarrays import ArrayParticleWorld
+        world = ArrayParticleWorld(width, height, scale, seed, rules=rules)
+    else:
+        world = PhysicWorld(width, height, scale, seed, rules=rules)
+    world.sleep_frames = sleep_frames
+    populate(world, world.rng.stream(SPAWN), Vector(0, 0), width, height, volume_density, species,
+             min_vel, max_vel, energy_factor, moving)
+    return world
+
+def populate(world : PhysicWorld, rng : Random, origin : Vector, width : float, height : float, volume_density : float = 0.0003,
+             species : Optional[Dict[str, float]] = None, min_vel : float = 50, max_vel : float = 100,
+             energy_factor : float = 0.0, moving : float = 1.0):
+    """Spawns the particles of build_world into the width x height rectangle starting at origin.
+
+    Args:
+        rng (Random): Source of the spawn positions, velocities and species
+        See build_world for the others
+    """
+    species = species or {"Re": 1, "Gr": 1, "Bl": 1}
+    symbols = list(species.keys())
+    weights = list(species.values())
+    particle_dict = sparticles.rules_of(world).particle_dict
+    picked : List[str] = []
+    positions : List[Vector] = []
+    velocities : List[Vector] = []
+    energies : List[float] = []
+    for i in range(int(width * height * volume_density)):
+        angle = rng.random() * pi * 2.0
+        speed = min_vel + rng.random() * (max_vel - min_vel)
+        symbol = rng.choices(symbols, weights)[0]
+        picked.append(symbol)
+        positions.append(origin + Vector(rng.random() * width, rng.random() * height))
+        if moving < 1.0 and rng.random() >= moving:
+            speed = 0.0
+        velocities.append(Vector(cos(angle), sin(angle)) * speed)
+        energies.append(particle_dict[symbol].max_energy * energy_factor)
+    sparticles.spawn_many(world, picked, positions, velocities, energies)
+
+def peak_memory_mb() -> Optional[float]:
+    """Returns the peak resident memory of this process in MB, when the platform reports it."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def run_world(world : PhysicWorld, frames : int = 200, delta : float = 0.01) -> Dict[str, float]:
+    """Steps a world and measures its throughput.
+
+    Returns:
+        Dict[str, float]: Steps per second, particle updates per second, collision pairs per frame...
+    """
+    updates = 0
+    pairs = 0
+    start = perf_counter()
+    for f in range(frames):
+        world.simulate(delta)
+        updates += len(world.objects)
+        pairs += world.collision_pairs
+    total = perf_counter() - start
+    return {
+        "particles": len(world.objects) + len(world.new_objects),
+        "frames": frames,
+        "seconds": total,
+        "steps_per_second": frames / total,
+        "updates_per_second": updates / total,
+        "pairs_per_frame": pairs / frames,
+        "peak_memory_mb": peak_memory_mb(),
+    }
+
+def bench_scenario(name : str, frames : int = 200, seed : int = 0, backend : str = "object", snapshot : Optional[str] = None,
+                   profile : Optional[str] = None, **overrides) -> Dict[str, float]:
+    """Builds one of the canned SCENARIOS, or restores a snapshot, and runs it.
+
+    With profile, the run is profiled with sprofile, every frame is appended to that file
+    and the mean time of each phase is reported."""
+    if snapshot:
+        import ssnapshot
+        if backend == "array":
+            from sarrays import ArrayParticleWorld
+            world = ssnapshot.load(snapshot, ArrayParticleWorld, seed=seed)
+        else:
+            world = ssnapshot.load(snapshot, seed=seed)
+        name = snapshot
+    else:
+        params = dict(SCENARIOS[name])
+        params.update(overrides)
+        world = build_world(seed=seed, backend=backend, **params)
+    results : Dict[str, Any] = {"scenario": name, "backend": backend}
+    if profile:
+        from sprofile import Profiler, PHASES
+        profiler = Profiler(capacity=frames, dump_path=profile, dump_every=100)
+        profiler.attach(world)
+    results.update(run_world(world, frames))
+    if profile:
+        profiler.detach(world)
+        summary = profiler.summary()
+        for field in PHASES + ("grid_time", "broad_time"):
+            results[f"{field}_ms"] = summary[field]["mean"] * 1000.0
+        for field in ("pair_tests", "hits", "reactions", "splits"):
+            results[f"{field}_per_frame"] = summary[field]["mean"]
+    return results
+
+def bench_grid(n_objects : int = 5000, frames : int = 100, width : float = 1920, height : float = 1080,
+               scale : float = 40, radius : float = 10, speed : float = 100, delta : float = 0.01,
+               seed : int = 0) -> Dict[str, float]:
+    """Measures the per frame cost of keeping the spatial grid up to date.
+
+    Every object takes a straight step each frame, bouncing back into the world at the edges.
+    Only the grid maintenance (set_position) is timed.
+
+    Returns:
+        Dict[str, float]: Timings in seconds and moves per second
+    """
+    rng = Random(seed)
+    world = World(width, height, scale)
+    objects : List[WObject] = []
+    steps : List[List[float]] = []
+    for i in range(n_objects):
+        objects.append(WObject(world, Vector(rng.random() * width, rng.random() * height), radius))
+        steps.append(Vector.angled(rng.random() * 2.0 * pi, speed * delta).as_list())
+    world.add_objects()
+    total = 0.0
+    for f in range(frames):
+        targets : List[Vector] = []
+        for obj, step in zip(objects, steps):
+            x = obj.position.x + step[0]
+            y = obj.position.y + step[1]
+            if not 0 <= x <= width:
+                step[0] = -step[0]
+            if not 0 <= y <= height:
+                step[1] = -step[1]
+            targets.append(Vector(x, y))
+        start = perf_counter()
+        for obj, target in zip(objects, targets):
+            obj.set_position(target)
+        total += perf_counter() - start
+    return {
+        "objects": n_objects,
+        "frames": frames,
+        "seconds": total,
+        "ms_per_frame": total * 1000.0 / frames,
+        "moves_per_second": n_objects * frames / total,
+    }
+
+def make_index(kind : str, world : PhysicWorld) -> Any:
+    """Builds one of the INDEXES for a populated world."""
+    import sspatial
+    if kind == "uniform":
+        return UniformGrid(world.W, world.H, world.scale)
+    if kind == "auto":
+        return sspatial.auto_grid(world)
+    if kind == "hash":
+        return sspatial.HashGrid(world.scale)
+    if kind == "multi":
+        return sspatial.MultiGrid(2.0 * min(o.radius for o in chain(world.objects, world.new_objects)))
+    raise ValueError(f"unknown index {kind}")
+
+def bench_index(name : str, frames : int = 100, seed : int = 0, indexes : List[str] = INDEXES, queries : int = 200) -> List[Dict[str, Any]]:
+    """Compares the spatial indexes of sspatial on a scenario.
+
+    Every index runs the same world from the same seed. On top of the full steps, each
+    frame times one extra broad phase (candidate_pairs) and overlap_circle queries of
+    twice the radius around some particles.
+
+    Returns:
+        List[Dict[str, Any]]: One result per index
+    """
+    results : List[Dict[str, Any]] = []
+    for kind in indexes:
+        world = build_world(seed=seed, **SCENARIOS[name])
+        world.add_objects()
+        world.set_index(make_index(kind, world))
+        rng = Random(seed)
+        candidates = 0
+        pairs_time = 0.0
+        query_time = 0.0
+        query_count = 0
+        start = perf_counter()
+        for f in range(frames):
+            world.simulate(0.01)
+            t = perf_counter()
+            candidates += len(world.candidate_pairs())
+            pairs_time += perf_counter() - t
+            objs = list(world.objects)
+            sample = [objs[rng.randrange(len(objs))] for i in range(min(queries, len(objs)))]
+            t = perf_counter()
+            for obj in sample:
+                if not obj.dead:
+                    world.overlap_circle(obj.position, 2.0 * obj.radius)
+            query_time += perf_counter() - t
+            query_count += len(sample)
+        total = perf_counter() - start - pairs_time - query_time
+        results.append({
+            "scenario": name,
+            "index": kind,
+            "scale": world.scale,
+            "steps_per_second": frames / total,
+            "candidates_per_frame": candidates / frames,
+            "pairs_ms": pairs_time * 1000.0 / frames,
+            "query_us": query_time * 1e6 / max(query_count, 1),
+        })
+    return results
+
+def bench_memory(n_particles : int = 100000, backend : str = "object", seed : int = 0) -> Dict[str, Any]:
+    """Measures the memory held per particle by a freshly populated world, grid included.
+
+    The world keeps a 16:9 shape and the default volume density, so the grid grows with it.
+    """
+    density = 0.0003
+    area = n_particles / density
+    width = (area * 16 / 9) ** 0.5
+    height = area / width
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    world = build_world(width=width, height=height, volume_density=density, seed=seed, backend=backend)
+    world.add_objects()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    count = len(world.objects)
+    return {
+        "backend": backend,
+        "particles": count,
+        "megabytes": used / 1024.0 / 1024.0,
+        "bytes_per_particle": used / count,
+    }
+
+def bench_parallel(name : str = "dense", frames : int = 200, seed : int = 0, workers : List[int] = [1, 2, 4]) -> List[Dict[str, Any]]:
+    """Compares sparallel.ParallelWorld against the single process world on a scenario.
+
+    Returns:
+        List[Dict[str, Any]]: One result per worker count, plus the single process reference first
+    """
+    from sparallel import ParallelWorld
+    single = bench_scenario(name, frames, seed)
+    results : List[Dict[str, Any]] = [{"scenario": name, "workers": "single", "seconds": single["seconds"],
+                                       "steps_per_second": single["steps_per_second"], "speedup": 1.0}]
+    for count in workers:
+        world = ParallelWorld.from_world(build_world(seed=seed, **SCENARIOS[name]), count, seed)
+        try:
+            start = perf_counter()
+            for f in range(frames):
+                world.simulate(0.01)
+            total = perf_counter() - start
+        finally:
+            world.close()
+        results.append({"scenario": name, "workers": count, "seconds": total,
+                        "steps_per_second": frames / total, "speedup": single["seconds"] / total})
+    return results
+
+def bench_forces(counts : List[int] = [1000, 2000, 4000, 8000], frames : int = 10, theta : float = 0.5, seed : int = 0,
+                 backend : str = "object", exact_limit : int = 4000) -> List[Dict[str, Any]]:
+    """Measures the cost of the force stage (sforces, forces.csv) against the particle count.
+
+    Worlds keep the default density, so the short range neighbours stay the same while the
+    long range sources grow. The exact sum (theta = 0) is timed too, up to exact_limit
+    particles, with the mean error of the approximation against it.
+
+    Returns:
+        List[Dict[str, Any]]: One result per particle count
+    """
+    import sforces
+    import numpy as np
+    results : List[Dict[str, Any]] = []
+    density = 0.0003
+    for n in counts:
+        area = n / density
+        width = (area * 16 / 9) ** 0.5
+        world = build_world(width=width, height=area / width, volume_density=density, seed=seed, backend=backend)
+        world.add_objects()
+        field = sforces.ForceField.load(rules=world.rules, theta=theta)
+        world.forces = field
+        start = perf_counter()
+        for f in range(frames):
+            world.sim_forces(0.0)
+        total = perf_counter() - start
+        result : Dict[str, Any] = {"particles": len(world.objects), "theta": theta, "ms_per_frame": total * 1000.0 / frames}
+        if n <= exact_limit:
+            parts = [o for o in world.objects if o.solid]
+            pos = np.array([(o.position.x, o.position.y) for o in parts])
+            mass = np.array([o.mass for o in parts])
+            species = np.array([o.blueprint.id for o in parts])
+            approx = field.accelerations(pos, mass, species)
+            exact_field = sforces.ForceField.load(rules=world.rules, theta=0.0)
+            start = perf_counter()
+            exact = exact_field.accelerations(pos, mass, species)
+            result["exact_ms"] = (perf_counter() - start) * 1000.0
+            result["mean_error"] = float(np.linalg.norm(approx - exact, axis=1).mean() / max(np.linalg.norm(exact, axis=1).mean(), 1e-12))
+        results.append(result)
+    return results
+
+def report(results : Dict[str, Any]):
+    for key, value in results.items():
+        if isinstance(value, float):
+            print(f"{key:>20}: {value:.3f}")
+        else:
+            print(f"{key:>20}: {value}")
+
+def main():
+    parser = ArgumentParser(description="Headless SParticles benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    grid = commands.add_parser("grid", help="spatial grid maintenance cost")
+    grid.add_argument("--objects", type=int, default=5000)
+    grid.add_argument("--frames", type=int, default=100)
+    grid.add_argument("--seed", type=int, default=0)
+    scenario = commands.add_parser("scenario", help="full simulation throughput")
+    scenario.add_argument("names", nargs="*", metavar="NAME", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    scenario.add_argument("--frames", type=int, default=200)
+    scenario.add_argument("--seed", type=int, default=0)
+    scenario.add_argument("--backend", choices=["object", "array"], default="object")
+    scenario.add_argument("--snapshot", help="run the world saved in this snapshot instead of a scenario")
+    scenario.add_argument("--profile", metavar="FILE", help="profile the phases of each step, appending them to FILE (.csv or JSON lines)")
+    save = commands.add_parser("save", help="save the initial world of a scenario to a snapshot")
+    save.add_argument("name", choices=list(SCENARIOS.keys()))
+    save.add_argument("file")
+    save.add_argument("--seed", type=int, default=0)
+    parallel = commands.add_parser("parallel", help="multi-process scaling against the single process world")
+    parallel.add_argument("name", nargs="?", default="dense", choices=list(SCENARIOS.keys()))
+    parallel.add_argument("--frames", type=int, default=200)
+    parallel.add_argument("--seed", type=int, default=0)
+    parallel.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    memory = commands.add_parser("memory", help="bytes held per particle")
+    memory.add_argument("--particles", type=int, default=100000)
+    memory.add_argument("--backend", choices=["object", "array"], default="object")
+    index = commands.add_parser("index", help="broad phase and query cost of the spatial indexes")
+    index.add_argument("names", nargs="*", metavar="NAME", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    index.add_argument("--frames", type=int, default=100)
+    index.add_argument("--seed", type=int, default=0)
+    index.add_argument("--indexes", nargs="+", metavar="KIND", default=INDEXES, help=f"any of {', '.join(INDEXES)}")
+    forces = commands.add_parser("forces", help="force stage cost against the particle count")
+    forces.add_argument("--particles", type=int, nargs="+", default=[1000, 2000, 4000, 8000])
+    forces.add_argument("--frames", type=int, default=10)
+    forces.add_argument("--theta", type=float, default=0.5)
+    forces.add_argument("--seed", type=int, default=0)
+    forces.add_argument("--backend", choices=["object", "array"], default="object")
+    args = parser.parse_args()
+    if args.command == "grid":
+        report(bench_grid(args.objects, args.frames, seed=args.seed))
+    elif args.command == "scenario":
+        for name in args.names:
+            if name not in SCENARIOS:
+                parser.error(f"unknown scenario {name}")
+        if args.snapshot:
+            report(bench_scenario("", args.frames, args.seed, args.backend, args.snapshot, args.profile))
+        for name in args.names or ([] if args.snapshot else SCENARIOS):
+            report(bench_scenario(name, args.frames, args.seed, args.backend, profile=args.profile))
+            print()
+    elif args.command == "save":
+        import ssnapshot
+        ssnapshot.save(build_world(seed=args.seed, **SCENARIOS[args.name]), args.file)
+    elif args.command == "index":
+        for name in args.names:
+            if name not in SCENARIOS:
+                parser.error(f"unknown scenario {name}")
+        for kind in args.indexes:
+            if kind not in INDEXES:
+                parser.error(f"unknown index {kind}")
+        for name in args.names or SCENARIOS:
+            for results in bench_index(name, args.frames, args.seed, args.indexes):
+                report(results)
+                print()
+    elif args.command == "memory":
+        report(bench_memory(args.particles, args.backend))
+    elif args.command == "parallel":
+        for results in bench_parallel(args.name, args.frames, args.seed, args.workers):
+            report(results)
+            print()
+    elif args.command == "forces":
+        for results in bench_forces(args.particles, args.frames, args.theta, args.seed, args.backend):
+            report(results)
+            print()
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,237 @@
 from __future__ import annotations
 from svector import SVector2 as Vector
 from sgridspace import World, WObject
-from typing import Set, List
+from srandom import WorldRandom
+from typing import Dict, List, Tuple, Optional, Any
+from itertools import chain
+from math import ceil, sqrt
+
+# Kinds of the events queued by the collision search, see PhysicWorld.resolve_events
+BOUNCE = 0
+REACTION = 1
+SPLIT = 2
+
+# (kind, first object, second object or None, argument)
+Event = Tuple[int, "SCircle", Optional["SCircle"], Any]
+
+def time_of_impact(position : Vector, velocity : Vector, radius : float, other : Vector, other_radius : float, delta : float) -> Optional[float]:
+    """Swept circle test of a moving circle against a still one.
+
+    Args:
+        position (Vector): Start position of the moving circle
+        velocity (Vector): Velocity of the moving circle
+        radius (float): Radius of the moving circle
+        other (Vector): Position of the still circle
+        other_radius (float): Radius of the still circle
+        delta (float): Length of the sweep
+
+    Returns:
+        Optional[float]: Time in ]0, delta] at which the circles start touching, or None if
+        they don't touch during the sweep or were already overlapping at its start
+    """
+    dx = position.x - other.x
+    dy = position.y - other.y
+    reach = radius + other_radius
+    c = dx * dx + dy * dy - reach * reach
+    if c <= 0:
+        return None
+    b = dx * velocity.x + dy * velocity.y
+    if b >= 0:
+        # Moving away
+        return None
+    a = velocity.x * velocity.x + velocity.y * velocity.y
+    disc = b * b - a * c
+    if disc < 0:
+        return None
+    t = (-b - sqrt(disc)) / a
+    if t > delta:
+        return None
+    return t
 
 class PhysicWorld(World):
-    def __init__(self, width: float, height: float, scale: float):
-        World.__init__(self, width, height, scale)
-        self.objects : Set[SCircle] = set()
+    def __init__(self, width: float, height: float, scale: float, seed : Optional[int] = None, index : Optional[Any] = None,
+                 rules : Optional[Any] = None):
+        World.__init__(self, width, height, scale, index)
+        self.objects : Dict[SCircle, None] = {}
+        # sparticles.RuleSet of the particles, the default one is set by the first particle when None
+        self.rules : Optional[Any] = rules
+        # Source of every random draw of the simulation, see srandom
+        self.rng : WorldRandom = WorldRandom(seed)
+        self.collision_pairs : int = 0
+        # Number of finished steps and simulated time
+        self.frame : int = 0
+        self.time : float = 0.0
+        # Objects moving further than max_travel times min(radius, scale) in a step are
+        # moved in substeps, each swept against the objects in their way
+        self.max_travel : float = 0.5
+        self.max_substeps : int = 16
+        # Candidate pairs tested by the last sim_collisions
+        self.pair_tests : int = 0
+        # sprofile.Profiler timing the phases of simulate, None when profiling is off
+        self.profiler : Optional[Any] = None
+        # Objects that moved no faster than sleep_speed and touched nothing for sleep_frames
+        # frames in a row fall asleep: they are neither moved nor bounced off the walls, and
+        # the broad phase only searches around awake objects once sleepers are the majority.
+        # A contact wakes them up. 0 frames disables sleeping, a speed above 0 stops slow
+        # objects, losing their kinetic energy
+        self.sleep_frames : int = 0
+        self.sleep_speed : float = 0.0
+        # objects split between the awake and the sleeping ones
+        self.awake : Dict[SCircle, None] = {}
+        self.sleeping : Dict[SCircle, None] = {}
+        # Frames spent at rest so far by the awake objects currently at rest
+        self.resting : Dict[SCircle, int] = {}
+        # Events found by the collision search, applied in order by resolve_events
+        self.events : List[Event] = []
+        # sforces.ForceField accelerating the objects every step, None for contacts only
+        self.forces : Optional[Any] = None
+    
+    def substeps(self, obj : SCircle, delta : float) -> int:
+        """Returns the number of substeps obj needs to move by delta."""
+        velocity = obj.velocity
+        travel = sqrt(velocity.x * velocity.x + velocity.y * velocity.y) * delta
+        limit = self.max_travel * min(obj.radius, self.scale)
+        if travel <= limit or not obj.solid:
+            return 1
+        return min(ceil(travel / limit), self.max_substeps)
+    
+    def sweep(self, obj : SCircle, delta : float):
+        """Moves obj by its velocity for delta, colliding with the first object on its way.
+
+        Other objects are taken as still, they have either already moved this step or are
+        about to. Objects obj already overlaps are left to sim_collisions."""
+        velocity = obj.velocity
+        travel = velocity * delta
+        reach = travel.magnitude() / 2.0
+        first : Optional[SCircle] = None
+        t_hit = delta
+        for other in self.overlap_circle(obj.position + travel / 2.0, obj.radius + reach):
+            if other is obj or other.dead:
+                continue
+            t = time_of_impact(obj.position, velocity, obj.radius, other.position, other.radius, t_hit)
+            if t is not None and t < t_hit:
+                first = other
+                t_hit = t
+        if first is None:
+            obj.move(travel)
+            return
+        obj.move(velocity * t_hit)
+        if first in self.sleeping:
+            self.wake(first)
+        obj.collide(first)
+        if not obj.dead:
+            obj.move(obj.velocity * (delta - t_hit))
+    
+    def awake_pairs(self) -> List[Tuple[SCircle, SCircle]]:
+        """Returns the overlapping pairs with at least one awake or new object, searched
+        around those objects only, so that the cost does not depend on the sleepers."""
+        pairs : List[Tuple[SCircle, SCircle]] = []
+        visited : Dict[SCircle, None] = {}
+        for obj in chain(self.awake, self.new_objects):
+            if obj.dead or not obj.solid:
+                continue
+            visited[obj] = None
+            # Objects spanning several cells may be found more than once
+            for other in dict.fromkeys(self.overlap_circle(obj.position, obj.radius)):
+                # Pairs of two searched objects are kept from the second one only
+                if other is not obj and (other in visited or other in self.sleeping):
+                    pairs.append((other, obj))
+        return pairs
+    
+    def wake(self, obj : SCircle):
+        """Puts a sleeping object back into the simulation. Call it after moving a sleeper
+        or changing its velocity from outside of the simulation."""
+        del self.sleeping[obj]
+        self.awake[obj] = None
+    
+    def sleep(self, obj : SCircle):
+        del self.awake[obj]
+        del self.resting[obj]
+        self.sleeping[obj] = None
+        obj.velocity = Vector(0, 0)
+    
+    def settle(self, touching : Dict[SCircle, None]):
+        """Counts the frames awake objects spend at rest and puts to sleep the ones that
+        reach sleep_frames.
+
+        Args:
+            touching (Dict[SCircle, None]): Objects that were in contact during this step
+        """
+        resting = self.resting
+        limit = self.sleep_speed * self.sleep_speed
+        sleepy : List[SCircle] = []
+        for obj in self.awake:
+            v = obj.velocity
+            if v.x * v.x + v.y * v.y > limit or obj in touching or not obj.can_sleep():
+                if obj in resting:
+                    del resting[obj]
+                continue
+            frames = resting.get(obj, 0) + 1
+            resting[obj] = frames
+            if frames >= self.sleep_frames:
+                sleepy.append(obj)
+        for obj in sleepy:
+            self.sleep(obj)
+    
+    def emit(self, kind : int, first : SCircle, second : Optional[SCircle] = None, arg : Any = None):
+        """Queues an event for resolve_events."""
+        self.events.append((kind, first, second, arg))
+    
+    def resolve_events(self):
+        """Applies the queued events in the order they were emitted.
+
+        Events of objects killed by an earlier event are dropped, so the outcome is the one of
+        applying each of them as soon as it is found, whatever searched for them. The objects
+        created along the way are built together once every event is applied."""
+        events = self.events
+        if not events:
+            return
+        self.events = []
+        births : Dict[Any, List[Any]] = {}
+        for kind, first, second, arg in events:
+            if first.dead or (second is not None and second.dead):
+                continue
+            made = first.resolve(kind, second, arg)
+            if made:
+                births.setdefault(type(first).bear, []).extend(made)
+        for bear, made in births.items():
+            bear(self, made)
+    
+    def adopt(self, parents : List[SCircle], children : List[SCircle]):
+        """Called by bear with the objects it created and the one each of them comes from,
+        before they join the simulation."""
+        pass
     
     def sim_collisions(self):
-        for obj in self.objects:
-            others : List[SCircle] = self.overlap_circle(obj.position, obj.radius)
-            for other in others:
-                if other == obj:
-                    continue
-                obj.collide(other)
+        sleeping = self.sleeping
+        if sleeping and len(sleeping) > len(self.awake):
+            pairs : List[Tuple[SCircle, SCircle]] = self.awake_pairs()
+        else:
+            pairs = self.candidate_pairs()
+        self.pair_tests = len(pairs)
+        contacts : List[Tuple[SCircle, SCircle]] = []
+        for obj, other in pairs:
+            reach = obj.radius + other.radius
+            if (obj.position - other.position).sqr_magnitude() < reach * reach:
+                contacts.append((obj, other) if obj.uid < other.uid else (other, obj))
+        # Applied by uid, the order of the pairs depends on the history of the index cells
+        contacts.sort(key=lambda pair: (pair[0].uid, pair[1].uid))
+        touching : Dict[SCircle, None] = {}
+        for obj, other in contacts:
+            touching[obj] = None
+            touching[other] = None
+            if sleeping:
+                if obj in sleeping:
+                    self.wake(obj)
+                if other in sleeping:
+                    self.wake(other)
+            obj.contact(other)
+        self.collision_pairs = len(contacts)
+        if self.sleep_frames:
+            self.settle(touching)
     
     def sim_wall_bounce(self):
-        for obj in self.objects:
+        for obj in self.awake:
             if obj.position.x + obj.radius > self.W:
                 if obj.velocity.x > 0:
                     obj.velocity.x *= -1
@@ -31,28 +245,92 @@ class PhysicWorld(World):
                 if obj.velocity.y < 0:
                     obj.velocity.y *= -1
     
+    def add_objects(self):
+        self.awake.update(self.new_objects)
+        World.add_objects(self)
+    
+    def discard(self, obj : SCircle):
+        """Forgets an object right away, instead of at the next clear_objects."""
+        self.objects.pop(obj, None)
+        self.new_objects.pop(obj, None)
+        self.awake.pop(obj, None)
+        self.sleeping.pop(obj, None)
+        self.resting.pop(obj, None)
+    
     def clear_objects(self):
-        objs = list(self.objects)
-        for o in objs:
-            if o.dead:
-                self.objects.remove(o)
+        for o in self.dying:
+            self.discard(o)
+        self.dying.clear()
     
-    def simulate(self, delta : float):
-        self.add_objects()
-        for obj in self.objects:
+    def sim_forces(self, delta : float):
+        if self.forces is not None:
+            self.forces.apply(self, delta)
+    
+    def sim_move(self, delta : float):
+        # Sweeps may wake sleepers up, which changes awake
+        for obj in list(self.awake) if self.sleeping else self.awake:
             obj.sim_move(delta)
-        self.sim_wall_bounce()
-        self.sim_collisions()
-        self.clear_objects()
+    
+    def simulate(self, delta : float):
+        profiler = self.profiler
+        if profiler is None:
+            self.add_objects()
+            self.sim_forces(delta)
+            self.sim_move(delta)
+            self.sim_wall_bounce()
+            self.sim_collisions()
+            self.resolve_events()
+            self.clear_objects()
+        else:
+            clock = profiler.clock
+            t0 = clock()
+            self.add_objects()
+            t1 = clock()
+            self.sim_forces(delta)
+            t2 = clock()
+            self.sim_move(delta)
+            t3 = clock()
+            self.sim_wall_bounce()
+            t4 = clock()
+            self.sim_collisions()
+            t5 = clock()
+            self.resolve_events()
+            t6 = clock()
+            self.clear_objects()
+            t7 = clock()
+            profiler.record(self, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4, t6 - t5, t7 - t6))
+        self.frame += 1
+        self.time += delta
+        for observer in self.observers:
+            observer.on_frame(self)
                 
 
 class SCircle(WObject):
+    __slots__ = ("velocity", "mass")
+    
     def __init__(self, world : World, position: Vector, radius : float, mass : float):
         WObject.__init__(self, world, position, radius)
         self.velocity : Vector = Vector(0, 0)
         self.mass = mass
         
+    def contact(self, other : SCircle):
+        """Called by sim_collisions for every pair in contact. Only queues the events the
+        contact leads to, see PhysicWorld.resolve_events."""
+        self.world.emit(BOUNCE, self, other)
+    
+    def resolve(self, kind : int, other : Optional[SCircle], arg : Any) -> Optional[List[Any]]:
+        """Applies one queued event, returns what bear has to create for it."""
+        if kind == BOUNCE:
+            self.collide(other)
+        return None
+    
+    @staticmethod
+    def bear(world : PhysicWorld, births : List[Any]):
+        """Creates in bulk the objects returned by resolve during a resolve_events."""
+        pass
+    
     def collide(self, other : SCircle):
+        """Elastic response, applied right away."""
         # 1- Check if closing in
         direction = other.position - self.position
         velocity = self.velocity - other.velocity
@@ -73,7 +351,19 @@ class SCircle(WObject):
         
         self.velocity += v1c
         other.velocity += v2c
+    
+    def can_sleep(self) -> bool:
+        """Returns False while the object may change on its own, without being touched."""
+        return True
         
     def sim_move(self, delta : float):
-        self.move(self.velocity * delta)
+        steps = self.world.substeps(self, delta)
+        if steps == 1:
+            self.move(self.velocity * delta)
+            return
+        delta /= steps
+        for i in range(steps):
+            if self.dead:
+                return
+            self.world.sweep(self, delta)
     
\ No newline at end of file
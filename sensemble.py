@@ -0,0 +1,326 @@
+"""Ensembles of independent headless simulations, for parameter sweeps.
+
+Every Run is a world built like sbench.build_world from its own seed, parameters and rules.
+Runs are spread over a pool of worker processes, which stream a Sample of observables back
+to the parent every few frames, as soon as it is computed:
+
+    runs = [Run(seed, {"volume_density": d, "width": 400, "height": 300}) for d in densities for seed in range(8)]
+    for sample in ensemble(runs, workers=4, every=10):
+        print(sample.run, sample.frame, sample.counts, sample.total_energy)
+
+Small runs can be packed, up to pack of them per world: each gets its own walled tile of
+a PackedWorld, a single array backed world, and all of them are stepped by one batch of
+array operations. Packed runs start from the same particles as when run alone, but their
+random draws are shared with the other tiles, so they are equivalent to lone runs only
+statistically.
+
+Usage:
+    python sensemble.py [--densities D ...] [--seeds N] [--frames N] [--every N] [--workers N] [--pack N] [--out FILE]
+"""
+from __future__ import annotations
+from typing import List, Dict, Tuple, Iterator, Optional, Any, NamedTuple
+from argparse import ArgumentParser
+from itertools import chain
+from multiprocessing import Process, Queue
+import csv
+import os
+import sys
+import traceback
+
+import numpy as np
+
+from svector import SVector2 as Vector
+from sarrays import ArrayParticleWorld
+from scircles import PhysicWorld
+from srandom import WorldRandom, SPAWN
+import sparticles
+import sbench
+
+# build_world arguments that only shape the spawned population, see sbench.populate
+POPULATION : Tuple[str, ...] = ("volume_density", "species", "min_vel", "max_vel", "energy_factor", "moving")
+
+class Run(NamedTuple):
+    """One simulation of an ensemble.
+
+    params are sbench.build_world arguments (width, height, volume_density, min_vel...).
+    Vary stabilities or reactions by giving runs their own rules."""
+    seed : int = 0
+    params : Dict[str, Any] = {}
+    rules : Optional[sparticles.RuleSet] = None
+    frames : int = 200
+    delta : float = 0.01
+
+class Sample(NamedTuple):
+    """Observables of a run after a step. Event counts are the ones since the previous sample."""
+    # Index of the run in the ensemble
+    run : int
+    frame : int
+    time : float
+    # Live particles of every species
+    counts : Dict[str, int]
+    # Sums over the live particles, like the IE and TE of main.py
+    internal_energy : float
+    total_energy : float
+    reactions : int
+    splits : int
+    deaths : int
+
+class Tally:
+    """World observer counting events, per tile of a PackedWorld or for a whole world."""
+    def __init__(self, tiles : int = 1):
+        self.counts : Dict[str, np.ndarray] = {event: np.zeros(tiles, np.int64) for event in ("reaction", "split", "death")}
+
+    def on_event(self, world : PhysicWorld, event : str, *args):
+        counts = self.counts.get(event)
+        if counts is not None:
+            counts[world.tile_of(args[0]) if isinstance(world, PackedWorld) else 0] += 1
+
+    def on_frame(self, world : PhysicWorld):
+        pass
+
+    def take(self, tile : int = 0) -> Tuple[int, int, int]:
+        """Returns and resets the reactions, splits and deaths counted for a tile."""
+        counts = self.counts
+        taken = (int(counts["reaction"][tile]), int(counts["split"][tile]), int(counts["death"][tile]))
+        for values in counts.values():
+            values[tile] = 0
+        return taken
+
+class PackedWorld(ArrayParticleWorld):
+    """ArrayParticleWorld holding several small worlds side by side, one per tile.
+
+    Each tile has its own walls, and tiles are separated by gaps wider than any particle,
+    so particles of different tiles never meet.
+
+    Args:
+        sizes (List[Tuple[float, float]]): Width and height of every tile
+        scale (float): Grid cell size
+        gap (float): Space between two tiles. Defaults to twice the scale
+        See ArrayParticleWorld for the others
+    """
+    columns = ArrayParticleWorld.columns + [("tile", (), np.int32)]
+
+    def __init__(self, sizes : List[Tuple[float, float]], scale : float, seed : Optional[int] = None,
+                 rules : Optional[sparticles.RuleSet] = None, gap : Optional[float] = None):
+        gap = 2.0 * scale if gap is None else gap
+        starts = np.concatenate(([0.0], np.cumsum([w + gap for w, h in sizes])[:-1]))
+        ArrayParticleWorld.__init__(self, float(starts[-1] + sizes[-1][0]), max(h for w, h in sizes), scale, seed, rules=rules)
+        self.starts : np.ndarray = starts
+        # x0, x1, y0, y1 of every tile
+        self.bounds : np.ndarray = np.array([(x, x + w, 0.0, h) for x, (w, h) in zip(starts, sizes)], np.float64)
+
+    def origin(self, tile : int) -> Vector:
+        return Vector(float(self.starts[tile]), 0.0)
+
+    def tile_at(self, x : float) -> int:
+        return max(int(np.searchsorted(self.starts, x, "right")) - 1, 0)
+
+    def tile_of(self, obj : sparticles.Particle) -> int:
+        """Returns the tile of an object, found from its position until it has one."""
+        tile = int(self.tile[obj.slot])
+        return tile if tile >= 0 else self.tile_at(obj.position.x)
+
+    def register(self, obj : sparticles.Particle):
+        ArrayParticleWorld.register(self, obj)
+        self.tile[obj.slot] = -1
+
+    def bind(self, obj : sparticles.Particle):
+        ArrayParticleWorld.bind(self, obj)
+        self.tile[obj.slot] = self.tile_of(obj)
+
+    def adopt(self, parents : List[sparticles.Particle], children : List[sparticles.Particle]):
+        """Puts reaction and split products in the tile of their parent, moving the ones
+        spawned past its walls back inside, so they never reach a neighbour tile."""
+        for parent, child in zip(parents, children):
+            tile = self.tile_of(parent)
+            self.tile[child.slot] = tile
+            x0, x1, y0, y1 = self.bounds[tile].tolist()
+            x, y = self.pos[child.slot].tolist()
+            inside = (min(max(x, x0), x1), min(max(y, y0), y1))
+            if inside != (x, y):
+                child.position = Vector(*inside)
+                child.update_grid()
+
+    def sim_wall_bounce(self):
+        n = self.size
+        act = self.active[:n]
+        pos = self.pos[:n]
+        vel = self.vel[:n]
+        rad = self.radius[:n]
+        bounds = self.bounds[self.tile[:n]]
+        over_x = pos[:, 0] + rad > bounds[:, 1]
+        flip_x = act & ((over_x & (vel[:, 0] > 0)) | (~over_x & (pos[:, 0] - rad < bounds[:, 0]) & (vel[:, 0] < 0)))
+        over_y = pos[:, 1] + rad > bounds[:, 3]
+        flip_y = act & ((over_y & (vel[:, 1] > 0)) | (~over_y & (pos[:, 1] - rad < bounds[:, 2]) & (vel[:, 1] < 0)))
+        vel[flip_x, 0] *= -1
+        vel[flip_y, 1] *= -1
+
+def observe(world : PhysicWorld, tally : Tally, runs : List[int]) -> List[Sample]:
+    """Returns a Sample for every run of a world, the runs being its tiles when packed."""
+    species = sparticles.rules_of(world).species
+    symbols = [b.symbol for b in species]
+    tiles = len(runs)
+    counts = np.zeros((tiles, len(species)), np.int64)
+    ie = np.zeros(tiles)
+    te = np.zeros(tiles)
+    if isinstance(world, PackedWorld):
+        # Particles born during the last step are only bound on the next one
+        for o in world.new_objects:
+            if not o.dead:
+                world.bind(o)
+        slots = np.flatnonzero(world.live[:world.size])
+        tile = world.tile[slots]
+        vel = world.vel[slots]
+        energy = world.energy[slots]
+        counts += np.bincount(tile * len(species) + world.species[slots], minlength=tiles * len(species)).reshape(tiles, -1)
+        ie += np.bincount(tile, energy, tiles)
+        te += ie + np.bincount(tile, 0.5 * world.mass[slots] * (vel * vel).sum(axis=1), tiles)
+    else:
+        for part in chain(world.objects, world.new_objects):
+            if part.dead:
+                continue
+            counts[0, part.blueprint.id] += 1
+            ie[0] += part.internal_energy
+            te[0] += part.total_energy()
+    samples : List[Sample] = []
+    for t, run in enumerate(runs):
+        reactions, splits, deaths = tally.take(t)
+        samples.append(Sample(run, world.frame, world.time, dict(zip(symbols, counts[t].tolist())),
+                              float(ie[t]), float(te[t]), reactions, splits, deaths))
+    return samples
+
+def build(job : List[Tuple[int, Run]], packed : bool) -> PhysicWorld:
+    """Builds the world of a job, packing its runs into the tiles of a PackedWorld if asked."""
+    if not packed:
+        index, run = job[0]
+        return sbench.build_world(seed=run.seed, rules=run.rules, **run.params)
+    first = job[0][1]
+    sizes = [(run.params.get("width", 1920), run.params.get("height", 1080)) for index, run in job]
+    world = PackedWorld(sizes, first.params.get("scale", 40), first.seed, first.rules)
+    world.sleep_frames = first.params.get("sleep_frames", 0)
+    for tile, (index, run) in enumerate(job):
+        population = {key: value for key, value in run.params.items() if key in POPULATION}
+        # The stream of sbench.build_world, so tiles start like their run alone
+        rng = WorldRandom(run.seed).stream(SPAWN)
+        sbench.populate(world, rng, world.origin(tile), sizes[tile][0], sizes[tile][1], **population)
+    return world
+
+def run_job(job : List[Tuple[int, Run]], packed : bool, every : int = 1) -> Iterator[List[Sample]]:
+    """Simulates the runs of a job, yielding their samples every every frames and after the last one."""
+    world = build(job, packed)
+    tally = Tally(len(job))
+    world.observers.append(tally)
+    runs = [index for index, run in job]
+    frames = job[0][1].frames
+    delta = job[0][1].delta
+    for f in range(1, frames + 1):
+        world.simulate(delta)
+        if f % every == 0 or f == frames:
+            yield observe(world, tally, runs)
+
+def plan(runs : List[Run], pack : int = 1) -> List[Tuple[List[Tuple[int, Run]], bool]]:
+    """Splits runs into jobs of (index, run) lists, with a flag telling whether they are packed.
+
+    Only runs sharing their rules, frames, delta, scale and sleep_frames are packed together."""
+    if pack <= 1:
+        return [([(i, run)], False) for i, run in enumerate(runs)]
+    groups : Dict[Tuple, List[Tuple[int, Run]]] = {}
+    for i, run in enumerate(runs):
+        key = (id(run.rules), run.frames, run.delta, run.params.get("scale", 40), run.params.get("sleep_frames", 0))
+        groups.setdefault(key, []).append((i, run))
+    jobs : List[Tuple[List[Tuple[int, Run]], bool]] = []
+    for group in groups.values():
+        for start in range(0, len(group), pack):
+            jobs.append((group[start:start + pack], True))
+    return jobs
+
+def worker_main(jobs : Queue, results : Queue, every : int):
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        try:
+            for samples in run_job(job[0], job[1], every):
+                results.put(samples)
+        except Exception:
+            results.put(("error", traceback.format_exc()))
+            break
+        results.put(("done", len(job[0])))
+
+def ensemble(runs : List[Run], workers : Optional[int] = None, every : int = 1, pack : int = 1) -> Iterator[Sample]:
+    """Runs every run and yields their samples as they arrive, in no particular order across runs.
+
+    Args:
+        runs (List[Run]): Simulations to run
+        workers (int): Worker processes, defaults to one per core. 0 runs everything in this process
+        every (int): Frames between two samples of a run, its last frame is always sampled
+        pack (int): Runs packed per world, 1 to give every run its own world
+
+    Raises:
+        RuntimeError: If a run failed in a worker, with its traceback
+    """
+    jobs = plan(runs, pack)
+    if workers == 0:
+        for job, packed in jobs:
+            for samples in run_job(job, packed, every):
+                yield from samples
+        return
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    queue : Queue = Queue()
+    results : Queue = Queue()
+    for job in jobs:
+        queue.put(job)
+    processes : List[Process] = []
+    for i in range(workers):
+        queue.put(None)
+        process = Process(target=worker_main, args=(queue, results, every), daemon=True)
+        process.start()
+        processes.append(process)
+    pending = len(jobs)
+    try:
+        while pending:
+            message = results.get()
+            if isinstance(message, list):
+                yield from message
+            elif message[0] == "done":
+                pending -= 1
+            else:
+                raise RuntimeError(f"ensemble run failed:\n{message[1]}")
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+def main():
+    parser = ArgumentParser(description="Headless SParticles ensembles, one CSV row per sample")
+    parser.add_argument("--densities", type=float, nargs="+", default=[0.0003, 0.0006, 0.001])
+    parser.add_argument("--seeds", type=int, default=8, help="runs per density")
+    parser.add_argument("--width", type=float, default=400)
+    parser.add_argument("--height", type=float, default=300)
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--every", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--pack", type=int, default=1)
+    parser.add_argument("--out", help="CSV file, defaults to the standard output")
+    args = parser.parse_args()
+    species = {"Re": 2, "Gr": 2, "Bl": 2, "Ye": 1, "Ma": 1, "Cy": 1}
+    runs = [Run(seed, {"width": args.width, "height": args.height, "volume_density": density, "species": species}, frames=args.frames)
+            for density in args.densities for seed in range(args.seeds)]
+    symbols = [b.symbol for b in sparticles.default_rules().species]
+    file = open(args.out, "w", newline="") if args.out else sys.stdout
+    try:
+        writer = csv.writer(file)
+        writer.writerow(["run", "seed", "volume_density", "frame", "time", "internal_energy", "total_energy",
+                         "reactions", "splits", "deaths"] + symbols)
+        for s in ensemble(runs, args.workers, args.every, args.pack):
+            run = runs[s.run]
+            writer.writerow([s.run, run.seed, run.params["volume_density"], s.frame, f"{s.time:.6g}",
+                             f"{s.internal_energy:.6g}", f"{s.total_energy:.6g}", s.reactions, s.splits, s.deaths]
+                            + [s.counts[symbol] for symbol in symbols])
+    finally:
+        if args.out:
+            file.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Attraction and repulsion between species, applied by PhysicWorld.sim_forces.
+
+forces.csv gives, for pairs of species, the strength of an inverse square force between
+them, charge like: positive strengths push apart, negative ones pull together, and the
+pair feels it both ways. Pairs with a range only interact closer than it (short range),
+the others at any distance (long range):
+
+    first;second;strength;range
+    Re;Re;40000;60
+    Re;Bl;-2000;
+
+Short range forces are searched with the cell list of sarrays.grid_pairs, with cells as
+large as the longest range, so their cost grows with the neighbours and not with N^2.
+Long range forces use one Barnes-Hut quadtree per source species: seen from far enough
+(cell size over distance below theta), a whole cell acts as its particle count gathered
+at its centroid. theta = 0 computes every pair exactly.
+
+    field = ForceField.load(rules=world.rules)
+    world.forces = field
+
+Every step, the accelerations of all particles are computed in batch and added to the
+velocities of the awake ones. Sleeping particles feel nothing until a contact wakes them.
+The forces add kinetic energy without tracking a potential, so worlds with forces don't
+conserve the total energy of sverify.
+"""
+from __future__ import annotations
+from typing import List, Tuple, Iterable, Optional
+from csv import DictReader
+import os
+
+import numpy as np
+
+from svector import SVector2 as Vector
+from scircles import PhysicWorld
+from sarrays import grid_pairs
+import sparticles
+
+forces_csv = os.path.join(sparticles.here, "forces.csv")
+
+class QuadTree:
+    """Barnes-Hut quadtree over a set of points, each of weight 1.
+
+    Nodes are numbered breadth first, so the children of a node are consecutive.
+
+    Args:
+        pos (np.ndarray): (n, 2) points
+        leaf_size (int): Points a node holds at most before it is split
+    """
+    def __init__(self, pos : np.ndarray, leaf_size : int = 8):
+        self.pos : np.ndarray = pos
+        lo = pos.min(axis=0)
+        side = max(float((pos.max(axis=0) - lo).max()), 1e-9) * (1.0 + 1e-9)
+        members : List[np.ndarray] = [np.arange(len(pos))]
+        boxes : List[Tuple[float, float, float]] = [(float(lo[0]), float(lo[1]), side)]
+        centers : List[np.ndarray] = []
+        counts : List[int] = []
+        sides : List[float] = []
+        first_child : List[int] = []
+        child_count : List[int] = []
+        starts : List[int] = []
+        order : List[np.ndarray] = []
+        filled = 0
+        k = 0
+        while k < len(members):
+            idx = members[k]
+            x0, y0, s = boxes[k]
+            p = pos[idx]
+            centers.append(p.mean(axis=0))
+            counts.append(len(idx))
+            sides.append(s)
+            # Points too close to tell apart stay together in a leaf
+            if len(idx) <= leaf_size or s < side * 1e-12:
+                first_child.append(-1)
+                child_count.append(0)
+                starts.append(filled)
+                order.append(idx)
+                filled += len(idx)
+            else:
+                h = s / 2.0
+                quadrant = (p[:, 0] >= x0 + h).astype(np.int64) + 2 * (p[:, 1] >= y0 + h)
+                first_child.append(len(members))
+                children = 0
+                for q in range(4):
+                    sub = idx[quadrant == q]
+                    if len(sub):
+                        members.append(sub)
+                        boxes.append((x0 + h * (q & 1), y0 + h * (q >> 1), h))
+                        children += 1
+                child_count.append(children)
+                starts.append(0)
+            k += 1
+        self.center : np.ndarray = np.array(centers, np.float64).reshape(-1, 2)
+        self.count : np.ndarray = np.array(counts, np.float64)
+        self.side : np.ndarray = np.array(sides, np.float64)
+        self.first_child : np.ndarray = np.array(first_child, np.int64)
+        self.child_count : np.ndarray = np.array(child_count, np.int64)
+        # Points of leaf k are order[start[k]:start[k] + count[k]]
+        self.start : np.ndarray = np.array(starts, np.int64)
+        self.order : np.ndarray = np.concatenate(order) if order else np.zeros(0, np.int64)
+
+    def field(self, targets : np.ndarray, theta : float = 0.5, softening : float = 0.0) -> np.ndarray:
+        """Returns, for every target point t, the sum over the points p of the tree of
+        (p - t) / (|p - t|^2 + softening^2)^(3/2).
+
+        All the targets walk down the tree together, one level per iteration."""
+        m = len(targets)
+        fx = np.zeros(m)
+        fy = np.zeros(m)
+        soft2 = softening * softening
+        theta2 = theta * theta
+        t = np.arange(m)
+        node = np.zeros(m, np.int64)
+        while len(t):
+            d = self.center[node] - targets[t]
+            r2 = (d * d).sum(axis=1)
+            side = self.side[node]
+            far = side * side < theta2 * r2
+            # 1- Distant nodes act as their centroid
+            w = self.count[node[far]] / (r2[far] + soft2) ** 1.5
+            fx += np.bincount(t[far], d[far, 0] * w, m)
+            fy += np.bincount(t[far], d[far, 1] * w, m)
+            near = ~far
+            leaf = near & (self.first_child[node] < 0)
+            # 2- Close leaves are summed point by point
+            if leaf.any():
+                lt = t[leaf]
+                counts = self.count[node[leaf]].astype(np.int64)
+                tt = np.repeat(lt, counts)
+                offsets = np.arange(len(tt)) - np.repeat(np.cumsum(counts) - counts, counts)
+                p = self.order[np.repeat(self.start[node[leaf]], counts) + offsets]
+                dd = self.pos[p] - targets[tt]
+                w = 1.0 / ((dd * dd).sum(axis=1) + soft2) ** 1.5
+                # The target itself, when it belongs to the tree, is at distance 0
+                w[(dd[:, 0] == 0) & (dd[:, 1] == 0)] = 0.0
+                fx += np.bincount(tt, dd[:, 0] * w, m)
+                fy += np.bincount(tt, dd[:, 1] * w, m)
+            # 3- Close inner nodes are opened
+            inner = near & ~leaf
+            counts = self.child_count[node[inner]]
+            t = np.repeat(t[inner], counts)
+            offsets = np.arange(len(t)) - np.repeat(np.cumsum(counts) - counts, counts)
+            node = np.repeat(self.first_child[node[inner]], counts) + offsets
+        return np.stack((fx, fy), axis=1)
+
+class ForceField:
+    """Pair forces between species, compiled into (species, species) tables.
+
+    Args:
+        rules (sparticles.RuleSet): Species the forces refer to
+        pairs (Iterable[Tuple[str, str, float, float]]): (first, second, strength, range)
+            symbols and values, a range of 0 for long range forces
+        theta (float): Accuracy of the long range forces, smaller is more accurate and slower
+        softening (float): Added to distances, so close particles don't get huge kicks
+        leaf_size (int): Particles per quadtree leaf
+
+    Raises:
+        sparticles.RuleError: For unknown species or negative ranges
+    """
+    def __init__(self, rules : sparticles.RuleSet, pairs : Iterable[Tuple[str, str, float, float]] = (),
+                 theta : float = 0.5, softening : float = 5.0, leaf_size : int = 8):
+        self.rules : sparticles.RuleSet = rules
+        self.theta : float = theta
+        self.softening : float = softening
+        self.leaf_size : int = leaf_size
+        n = len(rules.species)
+        self.short : np.ndarray = np.zeros((n, n), np.float64)
+        self.cutoff : np.ndarray = np.zeros((n, n), np.float64)
+        self.long : np.ndarray = np.zeros((n, n), np.float64)
+        known = rules.particle_dict
+        problems : List[str] = []
+        for first, second, strength, reach in pairs:
+            name = f"force {first}-{second}"
+            if first not in known or second not in known:
+                problems.append(f"{name} uses unknown species")
+                continue
+            if not (known[first].solid and known[second].solid):
+                problems.append(f"{name} can never act, {sparticles.Particle.energy} is not simulated")
+            if reach < 0:
+                problems.append(f"{name} has a negative range {reach}")
+            a, b = known[first].id, known[second].id
+            table = self.short if reach > 0 else self.long
+            table[a, b] = table[b, a] = strength
+            self.cutoff[a, b] = self.cutoff[b, a] = reach
+        if problems:
+            raise sparticles.RuleError(problems)
+
+    @staticmethod
+    def load(path : str = forces_csv, rules : Optional[sparticles.RuleSet] = None, **kwargs) -> ForceField:
+        """Loads the forces of a CSV file, for the given rules or the default ones."""
+        rules = rules or sparticles.default_rules()
+        with open(path, newline="") as file:
+            rows = [(row['first'], row['second'], float(row['strength']), float(row['range'] or 0))
+                    for row in DictReader(file, delimiter=';')]
+        return ForceField(rules, rows, **kwargs)
+
+    def accelerations(self, pos : np.ndarray, mass : np.ndarray, species : np.ndarray) -> np.ndarray:
+        """Returns the (n, 2) accelerations of particles of the given positions, masses and
+        species ids, under the forces of each other."""
+        n = len(pos)
+        force = np.zeros((n, 2))
+        soft2 = self.softening * self.softening
+        # 1- Short range, over the neighbours found by a cell list
+        reach = float(self.cutoff[self.short != 0].max(initial=0.0))
+        if reach > 0 and n > 1:
+            a, b = grid_pairs(pos, reach)
+            sa, sb = species[a], species[b]
+            d = pos[b] - pos[a]
+            r2 = (d * d).sum(axis=1)
+            strength = self.short[sa, sb]
+            cut = self.cutoff[sa, sb]
+            keep = (strength != 0) & (r2 < cut * cut)
+            a, b, d = a[keep], b[keep], d[keep]
+            f = d * (strength[keep] / (r2[keep] + soft2) ** 1.5)[:, None]
+            # Positive strengths push b away from a, and a away from b
+            for k in range(2):
+                force[:, k] += np.bincount(b, f[:, k], n) - np.bincount(a, f[:, k], n)
+        # 2- Long range, one tree per source species
+        for s in np.flatnonzero((self.long != 0).any(axis=0)):
+            sources = species == s
+            targets = np.flatnonzero(self.long[species, s] != 0)
+            if not sources.any() or not len(targets):
+                continue
+            tree = QuadTree(pos[sources], self.leaf_size)
+            field = tree.field(pos[targets], self.theta, self.softening)
+            force[targets] -= field * self.long[species[targets], s][:, None]
+        massive = mass > 0
+        force[massive] /= mass[massive][:, None]
+        force[~massive] = 0.0
+        return force
+
+    def apply(self, world : PhysicWorld, delta : float):
+        """Adds the accelerations of delta seconds to the awake particles of a world."""
+        if hasattr(world, "pos"):
+            # Array backed world, straight over its columns
+            slots = world.broad_slots()
+            acc = self.accelerations(world.pos[slots], world.mass[slots], world.species[slots])
+            awake = world.active[slots]
+            world.vel[slots[awake]] += acc[awake] * delta
+            return
+        objs = [o for o in world.objects if not o.dead and o.solid]
+        if not objs:
+            return
+        pos = np.array([(o.position.x, o.position.y) for o in objs], np.float64)
+        mass = np.array([o.mass for o in objs], np.float64)
+        species = np.array([o.blueprint.id for o in objs], np.int64)
+        acc = self.accelerations(pos, mass, species) * delta
+        awake = world.awake
+        for obj, (ax, ay) in zip(objs, acc.tolist()):
+            if obj in awake:
+                v = obj.velocity
+                obj.velocity = Vector(v.x + ax, v.y + ay)
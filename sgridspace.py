@@ -1,16 +1,47 @@
 from __future__ import annotations
 from svector import SVector2 as Vector
-from typing import List, Tuple, Set
+from typing import List, Tuple, Dict, Iterable, Optional, Any
+from itertools import chain
 from math import ceil, floor
 
 class World:
-    def __init__(self, width: float, height: float, scale: float):
+    def __init__(self, width: float, height: float, scale: float, index : Optional[Any] = None):
+        """
+        Args:
+            width (float): World width
+            height (float): World height
+            scale (float): Cell size objects compute their limits with
+            index: Spatial index the objects are registered in. Defaults to a UniformGrid
+                of scale sized cells, see sspatial for the other ones
+        """
         self.W : float = width
         self.H : float = height
-        self.scale : float = scale
-        self.grid : List[List[List[WObject]]]= [[[] for y in range(ceil(height/scale)+1)] for x in range(ceil(width/scale)+1)]
-        self.objects : Set[WObject] = set()
-        self.new_objects : Set[WObject] = set()
+        self.index : Any = index if index is not None else UniformGrid(width, height, scale)
+        self.scale : float = self.index.scale
+        # Insertion ordered dicts used as sets, so that runs iterate objects in a repeatable order
+        self.objects : Dict[WObject, None] = {}
+        self.new_objects : Dict[WObject, None] = {}
+        # Next WObject.uid
+        self.next_uid : int = 0
+        # Objects removed since the last clear_objects, the only ones it has to look at
+        self.dying : List[WObject] = []
+        # Objects notified of world events (on_event) and finished frames (on_frame)
+        self.observers : List[Any] = []
+        # Bumped whenever an object moves or the index changes, cached queries check it
+        self.version : int = 0
+        # squery.WorldQuery shared by the users of squery.of, created on first use
+        self.queries : Optional[Any] = None
+    
+    def notify(self, event : str, *args):
+        """Forwards an event ("death", "reaction", "split"...) to every observer."""
+        for observer in self.observers:
+            observer.on_event(self, event, *args)
+    
+    def set_index(self, index : Any):
+        """Moves every object to another spatial index, which may use another scale."""
+        self.index = index
+        self.scale = index.scale
+        self.rebuild_grid(clear=False)
     
     def overlap_circle(self, pos : Vector, radius : float) -> List[WObject]:
         """Returns a list with all the objects strictly inside a circle.
@@ -22,73 +53,265 @@ class World:
         Returns:
             List[WObject]: List of objects that are at least partly inside the circle (Strictly)
         """
+        return self.index.query(pos, radius)
+    
+    def candidate_pairs(self) -> List[Tuple[WObject, WObject]]:
+        """Returns every pair of objects that share at least one cell of the index, once.
+
+        Returns:
+            List[Tuple[WObject, WObject]]: Candidate pairs for the narrow phase
+        """
+        return self.index.pairs()
+    
+    def get_limits(self, pos : Vector, radius : float) -> WLimits:
+        return WLimits(
+                floor((pos.x-radius)/self.scale),
+                floor((pos.x+radius)/self.scale),
+                floor((pos.y-radius)/self.scale),
+                floor((pos.y+radius)/self.scale)
+            )
+    
+    def update_grid(self, obj : WObject, minX : int, maxX : int, minY : int, maxY : int):
+        """Moves an object from the cells in obj.limits to the cells of the given range,
+        and updates obj.limits. Objects that are not solid only get their limits updated."""
+        self.version += 1
+        if not obj.solid:
+            l = obj.limits
+            if l is None:
+                obj.limits = WLimits(minX, maxX, minY, maxY)
+            else:
+                l.minX, l.maxX, l.minY, l.maxY = minX, maxX, minY, maxY
+            return
+        self.index.update(obj, minX, maxX, minY, maxY)
+    
+    def remove_grid(self, obj : WObject):
+        """Removes an object from every cell it lives in."""
+        self.version += 1
+        if obj.solid:
+            self.index.remove(obj)
+    
+    def rebuild_grid(self, objs : Optional[Iterable[WObject]] = None, limits : Optional[Iterable[Tuple[int, int, int, int]]] = None, clear : bool = True):
+        """Clears the index and registers every live object again in a single pass.
+
+        Args:
+            objs (Iterable[WObject]): Objects to register, in order. Defaults to objects and new_objects
+            limits (Iterable[Tuple[int, int, int, int]]): Precomputed (minX, maxX, minY, maxY) of each object
+            clear (bool): Set to False when the index is known to be empty
+        """
+        self.version += 1
+        objs = list(chain(self.objects, self.new_objects) if objs is None else objs)
+        if limits is None:
+            limits = [self.get_limits(obj.position, obj.radius) for obj in objs]
+        live : List[WObject] = []
+        for obj, limit in zip(objs, limits):
+            if obj.dead:
+                continue
+            if isinstance(limit, WLimits):
+                obj.limits = limit
+            else:
+                minX, maxX, minY, maxY = limit
+                obj.limits = WLimits(minX, maxX, minY, maxY)
+            if obj.solid:
+                live.append(obj)
+        self.index.rebuild(live, clear)
+    
+    def remove_many(self, objs : Iterable[WObject]):
+        """Removes many objects at once, like calling remove on each of them.
+
+        When they are more than a quarter of the population, the index is rebuilt from the
+        survivors in a single pass instead of unregistering the dead one by one."""
+        objs = [o for o in objs if not o.dead]
+        survivors = len(self.objects) + len(self.new_objects) - len(objs)
+        rebuild = len(objs) * 3 > survivors
+        for o in objs:
+            if self.observers:
+                self.notify("death", o)
+            if not rebuild:
+                self.remove_grid(o)
+            o.dead = True
+        self.dying.extend(objs)
+        if rebuild:
+            live = [o for o in chain(self.objects, self.new_objects) if not o.dead]
+            self.rebuild_grid(live, [o.limits for o in live])
+    
+    def register(self, obj : WObject):
+        """Called by an object before it sets any of its attributes.
+
+        Plain worlds keep everything on the objects themselves. Array backed worlds
+        override this to bind the object to its storage slot."""
+        pass
+    
+    def add_objects(self):
+        self.objects.update(self.new_objects)
+        self.new_objects.clear()
+
+class UniformGrid:
+    """Fixed grid of scale sized cells covering a width x height world.
+
+    Objects outside of the world are clamped to its border cells. Every spatial index
+    implements the same methods: query, pairs, update, remove, rebuild and occupancy.
+    """
+    def __init__(self, width: float, height: float, scale: float):
+        self.scale : float = scale
+        # Each cell is an insertion ordered dict used as a set: O(1) insert and remove
+        self.grid : List[List[Dict[WObject, None]]]= [[{} for y in range(ceil(height/scale)+1)] for x in range(ceil(width/scale)+1)]
+    
+    def query(self, pos : Vector, radius : float) -> List[WObject]:
         objSet : List[WObject] = []
         startGX = max(floor((pos.x-radius)/self.scale), 0)
         endGX = min(floor((pos.x+radius)/self.scale), len(self.grid)-1)
         startGY = max(floor((pos.y-radius)/self.scale), 0)
         endGY = min(floor((pos.y+radius)/self.scale), len(self.grid[0])-1)
+        px = pos.x
+        py = pos.y
         for gx in range(startGX, endGX+1):
             for gy in range(startGY, endGY+1):
                 subset = self.grid[gx][gy]
                 for obj in subset:
-                    sqrdist = (obj.position - pos).sqr_magnitude()
-                    if sqrdist < (radius+obj.radius) ** 2:
+                    # Inline distance, without temporary vectors
+                    p = obj.position
+                    dx = p.x - px
+                    dy = p.y - py
+                    if dx * dx + dy * dy < (radius+obj.radius) ** 2:
                         objSet.append(obj)
         return objSet
     
-    def get_limits(self, pos : Vector, radius : float) -> WLimits:
-        return WLimits(
-                floor((pos.x-radius)/self.scale),
-                floor((pos.x+radius)/self.scale),
-                floor((pos.y-radius)/self.scale),
-                floor((pos.y+radius)/self.scale)
-            )
+    def pairs(self) -> List[Tuple[WObject, WObject]]:
+        """Returns every pair of objects that share at least one grid cell.
+
+        A pair spanning several cells is only reported by the lowest cell both objects
+        live in, so each pair shows up exactly once and from one side only.
+        """
+        pairs : List[Tuple[WObject, WObject]] = []
+        for x, column in enumerate(self.grid):
+            for y, cell in enumerate(column):
+                n = len(cell)
+                if n < 2:
+                    continue
+                cell = list(cell)
+                for i in range(n):
+                    a = cell[i]
+                    al = a.limits
+                    for j in range(i + 1, n):
+                        b = cell[j]
+                        bl = b.limits
+                        if max(al.minX, bl.minX, 0) == x and max(al.minY, bl.minY, 0) == y:
+                            pairs.append((a, b))
+        return pairs
     
-    def update_grid(self, obj : WObject, trans : WLTransition):
-        for x, y in trans.grid_remove:
-            if x >= 0 and x < len(self.grid) and y >= 0 and y < len(self.grid[0]):
-                if obj in self.grid[x][y]:
-                    self.grid[x][y].remove(obj)
-        for x, y in trans.grid_add:
-            if x >= 0 and x < len(self.grid) and y >= 0 and y < len(self.grid[0]):
-                if not (obj in self.grid[x][y]):
-                    self.grid[x][y].append(obj)
+    def update(self, obj : WObject, minX : int, maxX : int, minY : int, maxY : int):
+        """Only the cells that differ between both ranges are touched, and obj.limits is
+        updated in place."""
+        grid = self.grid
+        endX = len(grid) - 1
+        endY = len(grid[0]) - 1
+        old = obj.limits
+        if old is None:
+            obj.limits = WLimits(minX, maxX, minY, maxY)
+            oMinX, oMaxX, oMinY, oMaxY = 0, -1, 0, -1
+        else:
+            oMinX, oMaxX, oMinY, oMaxY = old.minX, old.maxX, old.minY, old.maxY
+            for x in range(max(oMinX, 0), min(oMaxX, endX) + 1):
+                column = grid[x]
+                keepX = minX <= x <= maxX
+                for y in range(max(oMinY, 0), min(oMaxY, endY) + 1):
+                    if not (keepX and minY <= y <= maxY):
+                        del column[y][obj]
+            old.minX, old.maxX, old.minY, old.maxY = minX, maxX, minY, maxY
+        for x in range(max(minX, 0), min(maxX, endX) + 1):
+            column = grid[x]
+            hadX = oMinX <= x <= oMaxX
+            for y in range(max(minY, 0), min(maxY, endY) + 1):
+                if not (hadX and oMinY <= y <= oMaxY):
+                    column[y][obj] = None
     
-    def add_objects(self):
-        for o in self.new_objects:
-            self.objects.add(o)
-        self.new_objects.clear()
+    def remove(self, obj : WObject):
+        grid = self.grid
+        l = obj.limits
+        for x in range(max(l.minX, 0), min(l.maxX, len(grid) - 1) + 1):
+            column = grid[x]
+            for y in range(max(l.minY, 0), min(l.maxY, len(column) - 1) + 1):
+                del column[y][obj]
+    
+    def occupancy(self) -> List[int]:
+        """Returns the number of objects in every cell."""
+        return [len(cell) for column in self.grid for cell in column]
+    
+    def rebuild(self, objs : Iterable[WObject], clear : bool = True):
+        """Registers objects whose limits are already set, in order."""
+        grid = self.grid
+        endX = len(grid) - 1
+        endY = len(grid[0]) - 1
+        if clear:
+            for column in grid:
+                for cell in column:
+                    cell.clear()
+        for obj in objs:
+            l = obj.limits
+            for x in range(max(l.minX, 0), min(l.maxX, endX) + 1):
+                column = grid[x]
+                for y in range(max(l.minY, 0), min(l.maxY, endY) + 1):
+                    column[y][obj] = None
    
 class WObject:
     """An object in worldspace."""
+    __slots__ = ("world", "position", "radius", "limits", "dead", "slot", "uid")
+    # Objects that never touch anything are kept out of the spatial index, so they are
+    # neither returned by queries nor part of any candidate pair
+    solid : bool = True
+    
     def __init__(self, world : World, position: Vector, radius : float):
         self.world : World = world
+        # Index of the object in the storage of array backed worlds
+        self.slot : int = -1
+        # Serial number in the world, keys the random draws of the object
+        self.uid : int = world.next_uid
+        world.next_uid += 1
+        world.register(self)
         self.position : Vector = position
         self.radius : float = radius
         self.limits : WLimits = None
         self.dead : bool = False
-        world.new_objects.add(self)
+        world.new_objects[self] = None
         self.update_grid()
     
     def update_grid(self):
-        new_limits = self.world.get_limits(self.position, self.radius)
-        self.world.update_grid(self, WLTransition(self.limits, new_limits))
-        self.limits = new_limits
+        world = self.world
+        scale = world.scale
+        position = self.position
+        x = position.x
+        y = position.y
+        r = self.radius
+        minX = floor((x - r) / scale)
+        maxX = floor((x + r) / scale)
+        minY = floor((y - r) / scale)
+        maxY = floor((y + r) / scale)
+        l = self.limits
+        if l is not None and l.minX == minX and l.maxX == maxX and l.minY == minY and l.maxY == maxY:
+            return
+        world.update_grid(self, minX, maxX, minY, maxY)
     
     def set_position(self, new_position: Vector):
         self.position = new_position
+        self.world.version += 1
         self.update_grid()
         
     def move(self, movement : Vector):
         self.set_position(self.position + movement)
         
     def remove(self):
-        self.world.update_grid(self, WLTransition(self.limits, None))
-        #self.world.objects.remove(self)
+        if self.dead:
+            return
+        if self.world.observers:
+            self.world.notify("death", self)
+        self.world.remove_grid(self)
+        self.world.dying.append(self)
         self.dead = True
         
 class WLimits:
     """Defines the grid limits in which an object lives."""
+    __slots__ = ("minX", "maxX", "minY", "maxY")
+    
     def __init__(self, minX, maxX, minY, maxY):
         self.minX = minX
         self.maxX = maxX
@@ -97,29 +320,3 @@ class WLimits:
         
     def contains(self, x : int, y : int) -> bool:
         return (self.minX <= x <= self.maxX) and self.minY <= y <= self.maxY
-    
-class WLTransition:
-    """Defines what parts of the grid must an object be added to or removed from."""
-    def __init__(self, sLimit : WLimits, eLimit : WLimits):
-        self.grid_remove : List[Tuple[int, int]] = []
-        self.grid_add : List[Tuple[int, int]] = []
-        self.calculate(sLimit, eLimit)
-        
-    def calculate(self, sLimit : WLimits, eLimit : WLimits):
-        if not eLimit:
-            for x in range(sLimit.minX, sLimit.maxX + 1):
-                for y in range(sLimit.minY, sLimit.maxY + 1):
-                    self.grid_remove.append((x, y))
-        elif not sLimit:
-            for x in range(eLimit.minX, eLimit.maxX + 1):
-                for y in range(eLimit.minY, eLimit.maxY + 1):
-                    self.grid_add.append((x, y))
-        else:
-            for x in range(sLimit.minX, sLimit.maxX + 1):
-                for y in range(sLimit.minY, sLimit.maxY + 1):
-                    if not eLimit.contains(x, y):
-                        self.grid_remove.append((x, y))
-            for x in range(eLimit.minX, eLimit.maxX + 1):
-                for y in range(eLimit.minY, eLimit.maxY + 1):
-                    if not sLimit.contains(x, y):
-                        self.grid_add.append((x, y))
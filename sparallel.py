@@ -0,0 +1,323 @@
+"""Multi-core simulation through spatial domain decomposition.
+
+The world is cut into vertical strips of grid columns. Every strip is simulated by its own
+worker process, which owns the particles whose center lies inside the strip. Owned particles
+close to a border are sent to the neighbouring strips as ghosts, so contacts across borders
+are seen from both sides. Particles that leave a strip, as well as reaction and split products,
+migrate to their new owner after every step.
+
+Rules that keep the decomposition consistent:
+    - Pairs made of two ghosts are ignored, they belong to another strip.
+    - Ghosts never split. Only the owner of a particle draws its split chances.
+    - A reaction with a ghost is not resolved by the strips. They report it, and the
+      coordinator applies it after the step from the states sent by the owners of both
+      reactants: if both are still alive and not taken by an earlier such reaction, they are
+      removed and the product joins the strip that owns its position on the next step.
+      Otherwise nothing happens, so a reactant used by its owner is never used twice.
+"""
+from __future__ import annotations
+from typing import List, Dict, Tuple, Optional
+from multiprocessing import Pipe, Process
+from math import floor
+
+from svector import SVector2 as Vector
+from scircles import PhysicWorld
+from sparticles import Particle
+import sparticles
+
+# (pid, symbol, x, y, vx, vy, internal_energy)
+State = Tuple[int, str, float, float, float, float, float]
+
+class GhostParticle(Particle):
+    """Copy of a particle owned by a neighbour strip. It never splits here, its owner decides."""
+    __slots__ = ()
+    
+    def split_births(self) -> List[sparticles.Birth]:
+        return []
+
+class StripWorld(PhysicWorld):
+    """The part of a PhysicWorld simulated by one worker."""
+    def __init__(self, width: float, height: float, scale: float, index : int, bounds : List[float], halo : float, seed : Optional[int] = None,
+                 rules : Optional[sparticles.RuleSet] = None):
+        PhysicWorld.__init__(self, width, height, scale, seed, rules=rules)
+        self.strip : int = index
+        self.bounds : List[float] = bounds
+        self.x0 : float = bounds[index]
+        self.x1 : float = bounds[index + 1]
+        self.halo : float = halo
+        self.pids : Dict[Particle, int] = {}
+        self.ghosts : List[Particle] = []
+        # Pid pairs of the reactions with a ghost seen during the last step
+        self.crossings : List[Tuple[int, int]] = []
+        # Swept substeps would collide with ghosts outside of sim_collisions and react
+        # with them, so strips keep single step moves
+        self.max_substeps = 1
+
+    def owns(self, x : float) -> bool:
+        return strip_of(self.bounds, x) == self.strip
+
+    def make(self, state : State, ghost : bool = False) -> Particle:
+        pid, symbol, x, y, vx, vy, ie = state
+        part = sparticles.create_particle(symbol, self, Vector(x, y))
+        part.velocity = Vector(vx, vy)
+        part.internal_energy = ie
+        # Draws are keyed by the global pid, so strips agree with each other
+        part.uid = pid
+        if ghost:
+            part.__class__ = GhostParticle
+        self.pids[part] = pid
+        return part
+
+    def drop(self, part : Particle):
+        part.remove()
+        self.discard(part)
+        del self.pids[part]
+
+    def sim_move(self, delta : float):
+        for obj in sorted(self.objects, key=self.pids.__getitem__):
+            obj.sim_move(delta)
+
+    def sim_collisions(self):
+        contacts = 0
+        pairs = self.candidate_pairs()
+        self.pair_tests = len(pairs)
+        for obj, other in pairs:
+            ghost = isinstance(obj, GhostParticle)
+            other_ghost = isinstance(other, GhostParticle)
+            if ghost and other_ghost:
+                continue
+            reach = obj.radius + other.radius
+            if (obj.position - other.position).sqr_magnitude() >= reach * reach:
+                continue
+            contacts += 1
+            if ghost or other_ghost:
+                a = obj.blueprint.id
+                b = other.blueprint.id
+                rules = self.rules
+                if rules.reaction_table[a][b] >= 0 and a != rules.energy_id and b != rules.energy_id:
+                    # Left to the coordinator, which knows whether both reactants survive the step
+                    first, second = sorted((self.pids[obj], self.pids[other]))
+                    self.crossings.append((first, second))
+                    continue
+            obj.contact(other)
+        self.collision_pairs = contacts
+
+    def step(self, immigrants : List[State], ghosts : List[State], removed : List[int], delta : float, pid_base : int,
+             pid_stride : int) -> Tuple[List[State], List[State], List[State], List[Tuple[int, int]], int, int]:
+        """Runs one step of the strip, after removing the owned particles used by reactions with ghosts.
+
+        Returns:
+            Tuple[List[State], List[State], List[State], List[Tuple[int, int]], int, int]: Emigrants,
+            border particles for the neighbours, surviving owned reactants of reactions with ghosts,
+            pid pairs of those reactions, number of owned particles and number of contacts.
+        """
+        for ghost in self.ghosts:
+            self.drop(ghost)
+        if removed:
+            gone = set(removed)
+            for part in [o for o, pid in self.pids.items() if pid in gone]:
+                self.drop(part)
+        self.crossings = []
+        for state in sorted(immigrants):
+            self.make(state)
+        self.ghosts = [self.make(state, True) for state in sorted(ghosts)]
+        self.simulate(delta)
+        # Name the products of this step in a reproducible order
+        products = [o for o in self.new_objects if o not in self.pids]
+        products.sort(key=lambda o: (o.position.x, o.position.y, o.symbol))
+        for n, part in enumerate(products):
+            self.pids[part] = part.uid = pid_base + n * pid_stride
+        emigrants : List[State] = []
+        border : List[State] = []
+        reactants : List[State] = []
+        crossing = {pid for pair in self.crossings for pid in pair}
+        owned = 0
+        for part in [o for o in self.pids if not isinstance(o, GhostParticle)]:
+            if part.dead:
+                self.discard(part)
+                del self.pids[part]
+                continue
+            if self.pids[part] in crossing:
+                reactants.append(self.state(part))
+            x = part.position.x
+            if not self.owns(x):
+                emigrants.append(self.state(part))
+                self.drop(part)
+                continue
+            owned += 1
+            if x < self.x0 + self.halo or x >= self.x1 - self.halo:
+                border.append(self.state(part))
+        return emigrants, border, reactants, self.crossings, owned, self.collision_pairs
+
+    def state(self, part : Particle) -> State:
+        p = part.position
+        v = part.velocity
+        return (self.pids[part], part.symbol, p.x, p.y, v.x, v.y, part.internal_energy)
+
+    def states(self) -> List[State]:
+        return sorted(self.state(o) for o in self.pids if not isinstance(o, GhostParticle) and not o.dead)
+
+def strip_of(bounds : List[float], x : float) -> int:
+    """Returns the index of the strip that owns a given x coordinate."""
+    last = len(bounds) - 2
+    for i in range(1, last + 1):
+        if x < bounds[i]:
+            return i - 1
+    return last
+
+def reaction_product(first_mass : float, first : State, second_mass : float, second : State) -> Tuple[float, float, float, float, float]:
+    """Returns the position, velocity and internal energy of the product of two reactants,
+    conserving mass, momentum and energy like Particle.reaction_births."""
+    mass = first_mass + second_mass
+    vx = (first_mass * first[4] + second_mass * second[4]) / mass
+    vy = (first_mass * first[5] + second_mass * second[5]) / mass
+    x = (first_mass * first[2] + second_mass * second[2]) / mass
+    y = (first_mass * first[3] + second_mass * second[3]) / mass
+    energy = (first_mass * (first[4] ** 2 + first[5] ** 2) + second_mass * (second[4] ** 2 + second[5] ** 2)) / 2.0 + first[6] + second[6]
+    return x, y, vx, vy, energy - mass * (vx * vx + vy * vy) / 2.0
+
+def worker_main(conn, width : float, height : float, scale : float, index : int, bounds : List[float], halo : float, seed : int,
+                rules : sparticles.RuleSet):
+    strip = StripWorld(width, height, scale, index, bounds, halo, seed, rules)
+    workers = len(bounds) - 1
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        command = message[0]
+        if command == "step":
+            immigrants, ghosts, removed, delta, start_pid = message[1:]
+            conn.send(strip.step(immigrants, ghosts, removed, delta, start_pid + index, workers))
+        elif command == "states":
+            conn.send(strip.states())
+    conn.close()
+
+class ParallelWorld:
+    """Simulates a world over several worker processes, one per strip of grid columns.
+
+    Results are reproducible for a given seed and number of workers. The rules are sent
+    compiled to the workers, which never parse the CSV files."""
+    def __init__(self, width: float, height: float, scale: float, workers : int = 2, seed : int = 0, halo : Optional[float] = None,
+                 rules : Optional[sparticles.RuleSet] = None):
+        self.W : float = width
+        self.H : float = height
+        self.scale : float = scale
+        self.workers : int = workers
+        self.halo : float = halo if halo is not None else 2 * scale
+        self.rules : sparticles.RuleSet = rules or sparticles.default_rules()
+        columns = max(1, floor(width / scale))
+        self.bounds : List[float] = [round(columns * i / workers) * scale for i in range(workers)] + [float("inf")]
+        self.bounds[0] = float("-inf")
+        self.inbox : List[List[State]] = [[] for i in range(workers)]
+        self.border : List[List[State]] = [[] for i in range(workers)]
+        # Owned particles consumed by reactions with ghosts, removed by their strip on the next step
+        self.removed : List[List[int]] = [[] for i in range(workers)]
+        self.particles : int = 0
+        self.collision_pairs : int = 0
+        self.next_pid : int = 0
+        self.connections = []
+        self.processes : List[Process] = []
+        for i in range(workers):
+            parent, child = Pipe()
+            process = Process(target=worker_main, args=(child, width, height, scale, i, self.bounds, self.halo, seed, self.rules), daemon=True)
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    @staticmethod
+    def from_world(world : PhysicWorld, workers : int = 2, seed : int = 0, halo : Optional[float] = None) -> ParallelWorld:
+        """Builds a ParallelWorld holding a copy of every particle in a PhysicWorld."""
+        parallel = ParallelWorld(world.W, world.H, world.scale, workers, seed, halo, sparticles.rules_of(world))
+        parts = [o for o in list(world.objects) + list(world.new_objects) if not o.dead]
+        parts.sort(key=lambda o: (o.position.x, o.position.y, o.symbol))
+        for part in parts:
+            p = part.position
+            v = part.velocity
+            parallel.add(part.symbol, p.x, p.y, v.x, v.y, part.internal_energy)
+        return parallel
+
+    def add(self, symbol : str, x : float, y : float, vx : float, vy : float, internal_energy : float = 0.0):
+        """Queues a new particle. It joins its strip on the next step."""
+        state = (self.next_pid, symbol, x, y, vx, vy, internal_energy)
+        self.next_pid += 1
+        self.inbox[strip_of(self.bounds, x)].append(state)
+        self.particles += 1
+
+    def ghosts_for(self, index : int) -> List[State]:
+        low = self.bounds[index] - self.halo
+        high = self.bounds[index + 1] + self.halo
+        ghosts : List[State] = []
+        for neighbour in (index - 1, index + 1):
+            if 0 <= neighbour < self.workers:
+                ghosts.extend(s for s in self.border[neighbour] if low <= s[2] < high)
+        return ghosts
+
+    def simulate(self, delta : float):
+        # Products of this step get ids interleaved by strip, from a block reserved for this step.
+        # Each particle, owned or ghost, yields at most two products per step.
+        start_pid = self.next_pid
+        self.next_pid += self.workers * 4 * (self.particles + 1)
+        for i, conn in enumerate(self.connections):
+            conn.send(("step", self.inbox[i], self.ghosts_for(i), self.removed[i], delta, start_pid))
+        results = [conn.recv() for conn in self.connections]
+        self.inbox = [[] for i in range(self.workers)]
+        self.particles = 0
+        self.collision_pairs = 0
+        reactants : Dict[int, Tuple[int, State]] = {}
+        crossings = set()
+        for i, (emigrants, border, survivors, pairs, owned, contacts) in enumerate(results):
+            self.border[i] = border
+            self.particles += owned + len(emigrants)
+            self.collision_pairs += contacts
+            for state in emigrants:
+                self.inbox[strip_of(self.bounds, state[2])].append(state)
+            for state in survivors:
+                reactants[state[0]] = (i, state)
+            crossings.update(pairs)
+        self.react(reactants, sorted(crossings))
+
+    def react(self, reactants : Dict[int, Tuple[int, State]], crossings : List[Tuple[int, int]]):
+        """Applies the reactions with ghosts of the last step, in pid order. A reaction happens
+        only if its owners reported both reactants alive and no earlier one used them."""
+        used : Dict[int, int] = {}
+        rules = self.rules
+        for first, second in crossings:
+            if first in used or second in used or first not in reactants or second not in reactants:
+                continue
+            a = rules.particle_dict[reactants[first][1][1]]
+            b = rules.particle_dict[reactants[second][1][1]]
+            product = rules.reaction_table[a.id][b.id]
+            if product < 0:
+                continue
+            used[first] = reactants[first][0]
+            used[second] = reactants[second][0]
+            self.add(rules.species[product].symbol, *reaction_product(a.mass, reactants[first][1], b.mass, reactants[second][1]))
+        self.removed = [[] for i in range(self.workers)]
+        if not used:
+            return
+        for pid, owner in used.items():
+            self.removed[owner].append(pid)
+        self.particles -= len(used)
+        # Reactants that just changed strip are still queued, not owned yet
+        self.inbox = [[s for s in inbox if s[0] not in used] for inbox in self.inbox]
+        self.border = [[s for s in border if s[0] not in used] for border in self.border]
+
+    def states(self) -> List[State]:
+        """Returns the state of every particle, sorted by particle id."""
+        for conn in self.connections:
+            conn.send(("states",))
+        states : List[State] = []
+        for conn in self.connections:
+            states.extend(conn.recv())
+        for inbox in self.inbox:
+            states.extend(inbox)
+        removed = {pid for pids in self.removed for pid in pids}
+        return sorted(s for s in states if s[0] not in removed)
+
+    def close(self):
+        for conn in self.connections:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
@@ -1,122 +1,484 @@
 from __future__ import annotations
-from typing import List, Dict, Tuple
-from random import randint, random
+from typing import List, Dict, Tuple, Iterable, Optional, Union, Any
+from random import Random
+import random
 from math import pi
 from csv import DictReader
+import hashlib
+import os
+import pickle
+import sys
 
-from scircles import SCircle as WObject, PhysicWorld as World
+import numpy as np
+
+from scircles import SCircle as WObject, PhysicWorld as World, REACTION, SPLIT
 from svector import SVector2 as Vector
+from srandom import STABILITY, COLLISION, SPLIT_CHOICE, SPLIT_ANGLE
+
+here = os.path.dirname(os.path.abspath(__file__))
+part_csv = os.path.join(here, "particles.csv")
+reac_csv = os.path.join(here, "reactions.csv")
+spli_csv = os.path.join(here, "splits.csv")
 
-part_csv = "particles.csv"
-reac_csv = "reactions.csv"
-spli_csv = "splits.csv"
+# Bumped whenever the pickled form of RuleSet changes, to ignore older caches
+CACHE_VERSION = 1
 
-particle_dict: Dict[str, ParticleBlueprint] = {}
-reaction_dict: Dict[str, str] = {}
-split_dict: Dict[str, List[Tuple[str, str]]] = {}
+# Rule set of worlds created without one, loaded by default_rules on first use
+default : Optional[RuleSet] = None
 
 class Particle(WObject):
     energy = "E"
-    def __init__(self, world : World, position : Vector, radius : float, mass : float, name : str, symbol : str, color : List[int], max_energy: float, stability: float, coll_stability: float):
-        WObject.__init__(self, world, position, radius, mass)
-        self.name = name
-        self.color = color
-        self.symbol = symbol
+    __slots__ = ("blueprint", "internal_energy")
+    
+    def __init__(self, world : World, position : Vector, blueprint : ParticleBlueprint):
+        if world.rules is None:
+            world.rules = default_rules()
+        # Set first, the world reads it (solid) while registering the particle
+        self.blueprint : ParticleBlueprint = blueprint
+        WObject.__init__(self, world, position, blueprint.radius, blueprint.mass)
         self.internal_energy = 0.0
-        self.max_energy = max_energy
-        self.stability = stability
-        self.coll_stability = coll_stability
+    
+    # Per species constants are shared through the blueprint instead of copied
+    @property
+    def name(self) -> str:
+        return self.blueprint.name
+    
+    @property
+    def symbol(self) -> str:
+        return self.blueprint.symbol
+    
+    @property
+    def color(self) -> List[int]:
+        return self.blueprint.color
+    
+    @property
+    def max_energy(self) -> float:
+        return self.blueprint.max_energy
+    
+    @property
+    def stability(self) -> float:
+        return self.blueprint.stability
+    
+    @property
+    def coll_stability(self) -> float:
+        return self.blueprint.coll_stability
+    
+    @property
+    def solid(self) -> bool:
+        return self.blueprint.solid
         
     def collide(self, other : Particle):
         if self.dead or other.dead:
             return
-        if self.symbol == Particle.energy or other.symbol == Particle.energy:
+        rules = self.world.rules
+        a = self.blueprint.id
+        b = other.blueprint.id
+        if a == rules.energy_id or b == rules.energy_id:
             return
-        reaction = get_reaction(self.symbol, other.symbol)
-        if reaction:
-            self.react(other, reaction)
+        reaction = rules.reaction_table[a][b]
+        if reaction >= 0:
+            self.react(other, rules.species[reaction])
         else:
             super().collide(other)
-            if other.symbol != Particle.energy and other.mass < self.mass:
-                if random() > self.coll_stability:
-                    self.split()
+            heavy = self.breaker(other)
+            if heavy is not None:
+                heavy.split()
+    
+    def contact(self, other : Particle):
+        # Same outcome as collide, queued
+        rules = self.world.rules
+        a = self.blueprint.id
+        b = other.blueprint.id
+        if a == rules.energy_id or b == rules.energy_id:
+            return
+        reaction = rules.reaction_table[a][b]
+        if reaction >= 0:
+            self.world.emit(REACTION, self, other, rules.species[reaction])
+        else:
+            super().contact(other)
+            heavy = self.breaker(other)
+            if heavy is not None:
+                # Dropped with the bounce if either partner dies first
+                self.world.emit(SPLIT, heavy, other if heavy is self else self)
     
-    def react(self, other: Particle, result: str):
+    def breaker(self, other : Particle) -> Optional[Particle]:
+        """Returns the heavier partner of a bounce if it breaks apart, None otherwise.
+        Species without a split rule never break."""
+        heavy, light = (self, other) if self.mass > other.mass else (other, self)
+        if light.mass < heavy.mass:
+            if self.world.rng.random(heavy.uid, light.uid, self.world.frame, COLLISION) > heavy.coll_stability:
+                if self.world.rules.split_table[heavy.blueprint.id]:
+                    return heavy
+        return None
+    
+    def resolve(self, kind : int, other : Optional[Particle], arg : Any) -> Optional[List[Birth]]:
+        if kind == REACTION:
+            return self.reaction_births(other, arg)
+        if kind == SPLIT:
+            return self.split_births()
+        return super().resolve(kind, other, arg)
+    
+    @staticmethod
+    def bear(world : World, births : List[Birth]):
+        """Creates the products of reactions and splits with a single spawn_many, then
+        reports the events to the observers."""
+        specs = [spec for event, parents, products in births for spec in products]
+        made = spawn_many(world, [spec[0] for spec in specs], [spec[1] for spec in specs],
+                          [spec[2] for spec in specs], [spec[3] for spec in specs])
+        world.adopt([parents[0] for event, parents, products in births for spec in products], made)
+        if world.observers:
+            k = 0
+            for event, parents, products in births:
+                world.notify(event, *parents, *made[k:k + len(products)])
+                k += len(products)
+    
+    def react(self, other: Particle, result: ParticleBlueprint):
+        Particle.bear(self.world, self.reaction_births(other, result))
+    
+    def reaction_births(self, other : Particle, result : ParticleBlueprint) -> List[Birth]:
+        """Removes both reactants and returns the product to create."""
         energy = self.mass * self.velocity.sqr_magnitude() / 2.0 + other.mass * other.velocity.sqr_magnitude() / 2.0 + self.internal_energy + other.internal_energy
         new_vel = (self.mass * self.velocity + other.mass * other.velocity)/(self.mass + other.mass)
         new_pos = (self.mass * self.position + other.mass * other.position)/(self.mass + other.mass)
         new_kenergy = new_vel.sqr_magnitude() * (self.mass + other.mass) / 2.0
         injected_energy = energy - new_kenergy
-        product = create_particle(result, self.world, new_pos)
-        product.velocity = new_vel
-        product.internal_energy = injected_energy
         self.remove()
         other.remove()
+        return [("reaction", (self, other), [(result, new_pos, new_vel, injected_energy)])]
     
     def split(self):
+        Particle.bear(self.world, self.split_births())
+    
+    def split_births(self) -> List[Birth]:
+        """Removes the particle and returns the two products to create. Species without a
+        split rule stay whole and return no product."""
         # Get products
-        possible_products = split_dict[self.symbol]
+        rng = self.world.rng
+        rules = self.world.rules
+        possible_products = rules.split_table[self.blueprint.id]
+        if not possible_products:
+            return []
         if len(possible_products) > 1:
-            products = possible_products[randint(0, len(possible_products)-1)]
+            products = possible_products[rng.randint(0, len(possible_products)-1, self.uid, SPLIT_CHOICE)]
         else:
             products = possible_products[0]
-        p1 = particle_dict[products[0]]
-        p2 = particle_dict[products[1]]
+        p1 = rules.species[products[0]]
+        p2 = rules.species[products[1]]
         
         # Find product spawn position
-        angle = random()*2.0*pi
+        angle = rng.random(self.uid, SPLIT_ANGLE)*2.0*pi
         p1_off = Vector.angled(angle, p1.radius)
         p2_off = Vector.angled(angle + pi, p2.radius)
         p1_pos = self.position + p1_off
         p2_pos = self.position + p2_off
         
         # Find product velocity
-        base_term = (2*self.internal_energy)/(p1.mass + p2.mass)
+        # Rounding in react can leave a tiny negative internal energy
+        base_term = max(2*self.internal_energy, 0.0)/(p1.mass + p2.mass)
         p1_speed = (base_term * p2.mass / p1.mass)**0.5
         p2_speed = (base_term * p1.mass / p2.mass)**0.5
         p1_vel = Vector.angled(angle, p1_speed) + self.velocity
         p2_vel = Vector.angled(angle + pi, p2_speed) + self.velocity
-        wp1 = p1.gen(self.world, p1_pos)
-        wp2 = p2.gen(self.world, p2_pos)
-        wp1.velocity = p1_vel
-        wp2.velocity = p2_vel
         self.remove()
+        return [("split", (self,), [(p1, p1_pos, p1_vel, 0.0), (p2, p2_pos, p2_vel, 0.0)])]
 
     def sim_move(self, delta : float):
-        if self.internal_energy > self.max_energy:
-            if random() > self.stability:
-                self.split()
-        if self.dead:
-            return
+        if self.internal_energy > self.max_energy and self.world.rules.split_table[self.blueprint.id]:
+            if self.world.rng.random(self.uid, self.world.frame, STABILITY) > self.stability:
+                # Breaks apart in resolve_events, once the step moved everything
+                self.world.emit(SPLIT, self)
         super().sim_move(delta)
     
+    def can_sleep(self) -> bool:
+        # Overloaded particles may split at any step
+        return self.internal_energy <= self.max_energy
+    
     def total_energy(self) -> float:
         return self.velocity.sqr_magnitude() * self.mass / 2.0 + self.internal_energy
 
+# (event, particles it involves, products as (blueprint, position, velocity, internal energy))
+Birth = Tuple[str, Tuple[Particle, ...], List[Tuple["ParticleBlueprint", Vector, Vector, float]]]
+
 class ParticleBlueprint:
+    """Constants shared by every particle of a species."""
+    __slots__ = ("id", "name", "symbol", "mass", "radius", "color", "max_energy", "stability", "coll_stability", "solid")
+    
     def __init__(self, name: str, symbol: str, mass: int, radius: int, color: List[int], max_energy: float, stability: float, coll_stability: float):
-        self.name: str = name
-        self.symbol: str  = symbol
+        self.name: str = sys.intern(name)
+        self.symbol: str  = sys.intern(symbol)
         self.mass: int = mass
         self.radius: int = radius
         self.color: List[int] = color
         self.max_energy: float = max_energy
         self.stability: float = stability
         self.coll_stability: float = coll_stability
+        # Species id, assigned by RuleSet.compile
+        self.id: int = -1
+        # False for species that never react nor bounce, set by RuleSet.compile
+        self.solid: bool = True
     
     def gen(self, world: World, position: Vector) -> Particle:
-        return Particle(world, position, self.radius, self.mass, self.name, self.symbol, self.color, self.max_energy, self.stability, self.coll_stability)
+        return Particle(world, position, self)
 
 def create_particle(symbol: str, world: World, position: Vector) -> Particle:
-    return particle_dict[symbol].gen(world, position)
+    return rules_of(world).particle_dict[symbol].gen(world, position)
+
+def as_rows(vectors : Union[np.ndarray, Iterable[Vector]], count : int = -1) -> np.ndarray:
+    """Returns vectors as an (n, 2) float64 array. Vector, arrays and SVector2Array are accepted."""
+    if isinstance(vectors, np.ndarray):
+        return vectors.astype(np.float64, copy=False).reshape(-1, 2)
+    data = getattr(vectors, "data", None)
+    if isinstance(data, np.ndarray):
+        return data.reshape(-1, 2)
+    return np.array([(v.x, v.y) for v in vectors], np.float64).reshape(count if count >= 0 else -1, 2)
+
+def spawn_many(world : World, species : Union[str, ParticleBlueprint, Iterable[Union[str, ParticleBlueprint]]], positions : Union[np.ndarray, Iterable[Vector]],
+               velocities : Optional[Union[np.ndarray, Iterable[Vector]]] = None,
+               internal_energies : Optional[Union[float, Iterable[float]]] = None) -> List[Particle]:
+    """Creates many particles at once, like create_particle does for one.
+
+    The particles are built without going through their constructors, array backed worlds
+    get their columns filled in bulk, and the index registers all of them in a single
+    pass. They join the simulation at the next add_objects, in order.
+
+    Args:
+        world (World): World to spawn in
+        species (str or Iterable[str]): Symbol or blueprint of every particle, or one for all of them
+        positions: (n, 2) array or Vector of every particle
+        velocities: (n, 2) array or Vector of every particle, at rest by default
+        internal_energies (float or Iterable[float]): Internal energy of every particle, or one for all of them
 
-def random_symbol(exclude_energy: bool = True):
-    symbols = list(particle_dict.keys())
-    s = symbols[randint(0, len(symbols) - 1)]
-    while exclude_energy and s == "E":
-        s = symbols[randint(0, len(symbols) - 1)]
+    Returns:
+        List[Particle]: The new particles, in the order of positions
+    """
+    rules = rules_of(world)
+    pos = as_rows(positions)
+    count = len(pos)
+    vel = np.zeros((count, 2)) if velocities is None else as_rows(velocities, count)
+    energy = np.broadcast_to(np.asarray(0.0 if internal_energies is None else internal_energies, np.float64), (count,))
+    if isinstance(species, (str, ParticleBlueprint)):
+        species = [species] * count
+    particle_dict = rules.particle_dict
+    blueprints = [s if isinstance(s, ParticleBlueprint) else particle_dict[s] for s in species]
+    if len(blueprints) != count or len(vel) != count:
+        raise ValueError(f"spawn_many needs as many species and velocities as positions ({count})")
+    radius = np.array([b.radius for b in blueprints], np.float64)
+    backed = hasattr(world, "pos")
+    if not backed:
+        xs, ys = pos[:, 0].tolist(), pos[:, 1].tolist()
+        vxs, vys = vel[:, 0].tolist(), vel[:, 1].tolist()
+        energies = energy.tolist()
+    parts : List[Particle] = []
+    new = Particle.__new__
+    register = world.register
+    for k, bp in enumerate(blueprints):
+        part = new(Particle)
+        part.blueprint = bp
+        part.world = world
+        part.slot = -1
+        part.uid = world.next_uid
+        world.next_uid += 1
+        register(part)
+        part.limits = None
+        part.dead = False
+        if not backed:
+            part.position = Vector(xs[k], ys[k])
+            part.velocity = Vector(vxs[k], vys[k])
+            part.radius = bp.radius
+            part.mass = bp.mass
+            part.internal_energy = energies[k]
+        parts.append(part)
+    if backed:
+        slots = np.fromiter((p.slot for p in parts), np.int64, count)
+        world.pos[slots] = pos
+        world.vel[slots] = vel
+        world.energy[slots] = energy
+        world.radius[slots] = radius
+        world.mass[slots] = np.array([b.mass for b in blueprints], np.float64)
+    limits = np.empty((count, 4), np.int64)
+    limits[:, 0] = np.floor((pos[:, 0] - radius) / world.scale)
+    limits[:, 1] = np.floor((pos[:, 0] + radius) / world.scale)
+    limits[:, 2] = np.floor((pos[:, 1] - radius) / world.scale)
+    limits[:, 3] = np.floor((pos[:, 1] + radius) / world.scale)
+    world.new_objects.update(dict.fromkeys(parts))
+    world.rebuild_grid(parts, limits.tolist(), clear=False)
+    return parts
+
+def random_symbol(exclude_energy: bool = True, rng: Optional[Random] = None, rules: Optional[RuleSet] = None):
+    rng = rng or random
+    symbols = list((rules or default_rules()).particle_dict.keys())
+    s = symbols[rng.randint(0, len(symbols) - 1)]
+    while exclude_energy and s == Particle.energy:
+        s = symbols[rng.randint(0, len(symbols) - 1)]
     return s
 
+class RuleError(ValueError):
+    """Raised for an inconsistent rule set, with one line per problem."""
+    def __init__(self, problems: List[str]):
+        ValueError.__init__(self, "Invalid rules:\n" + "\n".join(problems))
+        self.problems: List[str] = problems
+
+class RuleSet:
+    """Species, reactions and splits of a simulation, compiled into tables indexed by species id.
+
+    Load one from CSV files, or build one from memory, and hand it to the world:
+
+        rules = RuleSet.load("particles.csv", "reactions.csv", "splits.csv")
+        rules = RuleSet(blueprints, [("Re", "Bl", "Ma")], [("Wh", "Cy", "Re")])
+        world = PhysicWorld(W, H, SCALE, rules=rules)
+
+    Worlds created without one use default_rules. The blueprints belong to the rule set,
+    which numbers them, so don't share them between rule sets.
+
+    Args:
+        particles (Iterable[ParticleBlueprint]): Every species
+        reactions (Iterable[Tuple[str, str, str]]): (reactant, reactant, product) symbols
+        splits (Iterable[Tuple[str, str, str]]): (base, product, product) symbols
+
+    Raises:
+        RuleError: If the rules are inconsistent, see validate
+    """
+    def __init__(self, particles: Iterable[ParticleBlueprint], reactions: Iterable[Tuple[str, str, str]] = (),
+                 splits: Iterable[Tuple[str, str, str]] = ()):
+        self.particle_dict: Dict[str, ParticleBlueprint] = {}
+        self.reaction_dict: Dict[str, str] = {}
+        self.split_dict: Dict[str, List[Tuple[str, str]]] = {}
+        problems: List[str] = []
+        for pb in particles:
+            if pb.symbol in self.particle_dict:
+                problems.append(f"species {pb.symbol} defined twice")
+            self.particle_dict[pb.symbol] = pb
+        for re1, re2, product in reactions:
+            self.reaction_dict[re_key(re1, re2)] = product
+        for base, p1, p2 in splits:
+            self.split_dict.setdefault(base, []).append((p1, p2))
+        problems.extend(self.problems())
+        if problems:
+            raise RuleError(problems)
+        # Tables compiled from the dicts above, indexed by ParticleBlueprint.id
+        self.species: List[ParticleBlueprint] = []
+        self.energy_id: int = -1
+        # reaction_table[a][b] is the species id of the product of a and b, or -1
+        self.reaction_table: List[List[int]] = []
+        # split_table[a] lists the (p1, p2) species id pairs species a can split into
+        self.split_table: List[List[Tuple[int, int]]] = []
+        self.compile()
+
+    @staticmethod
+    def load(particles: str = part_csv, reactions: str = reac_csv, splits: str = spli_csv, cache: bool = True) -> RuleSet:
+        """Loads a rule set from CSV files.
+
+        The compiled rule set is pickled into a __pycache__ folder next to the particles
+        file, under the hash of the three files. Later loads of the same files read it back
+        instead of parsing and validating them again.
+
+        Args:
+            particles (str): Species file
+            reactions (str): Reactions file
+            splits (str): Splits file
+            cache (bool): Read and write the cache
+
+        Returns:
+            RuleSet: The rules
+        """
+        sources = [read_bytes(path) for path in (particles, reactions, splits)]
+        path = None
+        if cache:
+            digest = hashlib.sha256(str(CACHE_VERSION).encode("ascii"))
+            for data in sources:
+                digest.update(len(data).to_bytes(8, "little"))
+                digest.update(data)
+            path = os.path.join(os.path.dirname(os.path.abspath(particles)), "__pycache__", f"rules.{digest.hexdigest()[:32]}.pickle")
+            try:
+                with open(path, "rb") as file:
+                    return pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+                pass
+        text = [data.decode("utf-8").splitlines() for data in sources]
+        rules = RuleSet([read_particle(row) for row in DictReader(text[0], delimiter=';')],
+                        [(row['re1'], row['re2'], row['product']) for row in DictReader(text[1], delimiter=';')],
+                        [(row['Base'], row['P1'], row['P2']) for row in DictReader(text[2], delimiter=';')])
+        print(f"Loaded {len(rules.particle_dict)} particles...")
+        print(f"Loaded {len(rules.reaction_dict)} reactions...")
+        if path is not None:
+            # Written aside then renamed, so concurrent loads never read half a file
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp = f"{path}.{os.getpid()}"
+                with open(temp, "wb") as file:
+                    pickle.dump(rules, file, pickle.HIGHEST_PROTOCOL)
+                os.replace(temp, path)
+            except OSError:
+                pass
+        return rules
+
+    def problems(self) -> List[str]:
+        """Returns the problems of the rules, one line each.
+
+        Every symbol must be a species, reactions can't involve energy (it never collides),
+        and split products need a mass, the split velocities are divided by it."""
+        problems: List[str] = []
+        for pb in self.particle_dict.values():
+            if pb.mass < 0 or pb.radius <= 0:
+                problems.append(f"species {pb.symbol} has mass {pb.mass} and radius {pb.radius}")
+            for name in ("stability", "coll_stability"):
+                if not 0.0 <= getattr(pb, name) <= 1.0:
+                    problems.append(f"species {pb.symbol} has {name} {getattr(pb, name)}, out of [0, 1]")
+        known = self.particle_dict
+        for key, product in self.reaction_dict.items():
+            re1, re2 = key.split("-", 1)
+            for symbol in (re1, re2, product):
+                if symbol not in known:
+                    problems.append(f"reaction {re1}+{re2}->{product} uses unknown species {symbol}")
+            if Particle.energy in (re1, re2):
+                problems.append(f"reaction {re1}+{re2}->{product} can never happen, energy does not collide")
+        for base, products in self.split_dict.items():
+            for p1, p2 in products:
+                for symbol in (base, p1, p2):
+                    if symbol not in known:
+                        problems.append(f"split {base}->{p1}+{p2} uses unknown species {symbol}")
+                if p1 in known and p2 in known and (known[p1].mass <= 0 or known[p2].mass <= 0):
+                    problems.append(f"split {base}->{p1}+{p2} has a massless product")
+        return problems
+
+    def validate(self):
+        """Raises a RuleError if the dicts were edited into inconsistent rules. Call it
+        before compile when changing them."""
+        problems = self.problems()
+        if problems:
+            raise RuleError(problems)
+
+    def compile(self):
+        """Compiles the string keyed dicts into tables indexed by species id.
+
+        The collision and split hot paths only do list indexing on the resulting tables.
+        Call it again after changing particle_dict, reaction_dict or split_dict."""
+        species = list(self.particle_dict.values())
+        for i, pb in enumerate(species):
+            pb.id = i
+        self.species = species
+        energy = self.particle_dict.get(Particle.energy)
+        self.energy_id = energy.id if energy is not None else -1
+        # Energy particles pass through everything, see Particle.collide
+        for pb in species:
+            pb.solid = pb.id != self.energy_id
+        self.reaction_table = [[-1] * len(species) for pb in species]
+        for a in species:
+            for b in species:
+                product = self.get_reaction(a.symbol, b.symbol)
+                if product:
+                    self.reaction_table[a.id][b.id] = self.particle_dict[product].id
+        self.split_table = [[] for pb in species]
+        for base, products in self.split_dict.items():
+            self.split_table[self.particle_dict[base].id] = [(self.particle_dict[p1].id, self.particle_dict[p2].id) for p1, p2 in products]
+
+    def get_reaction(self, re1: str, re2: str) -> Optional[str]:
+        return self.reaction_dict.get(re_key(re1, re2), None)
+
+def read_bytes(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
 def read_particle(row: Dict) -> ParticleBlueprint:
     name = row['Name']
     symbol = row['Symbol']
@@ -128,55 +490,34 @@ def read_particle(row: Dict) -> ParticleBlueprint:
     coll_stability = float(row['CollisionStability'])
     return ParticleBlueprint(name, symbol, mass, radius, color, max_e, stability, coll_stability)
 
-def gen_particle_dict(plist: str):
-    global particle_dict
-    with open(plist, 'r') as file:
-        csv_reader = DictReader(file, delimiter=';')
-        data = [row for row in csv_reader]
-        for row in data:
-            pb = read_particle(row)
-            particle_dict[pb.symbol] = pb
-    print(f"Loaded {len(particle_dict)} particles...")
-
 def re_key(re1: str, re2: str) -> str:
     if re1 <= re2:
         return f"{re1}-{re2}"
     return f"{re2}-{re1}"
 
-def get_reaction(re1: str, re2: str)->str:
-    global reaction_dict
-    return reaction_dict.get(re_key(re1, re2), None)
-
-def gen_reaction_dict(rlist: str):
-    global reaction_dict
-    with open(rlist, mode='r') as file:
-        csv_reader = DictReader(file, delimiter=';')
-        data = [row for row in csv_reader]
-        for row in data:
-            re1 = row['re1']
-            re2 = row['re2']
-            product = row['product']
-            reaction_dict[re_key(re1, re2)] = product
-    print(f"Loaded {len(reaction_dict)} reactions...")
-
-def gen_split_dict(slist: str):
-    global split_dict
-    
-    with open(slist, mode='r') as file:
-        csv_reader = DictReader(file, delimiter=';')
-        data = [row for row in csv_reader]
-        for row in data:
-            base = row['Base']
-            p1 = row['P1']
-            p2 = row['P2']
-            if not (base in split_dict):
-                split_dict[base] = []
-            split_dict[base].append((p1, p2))
-
-def init():
-    global part_csv, reac_csv
-    gen_particle_dict(part_csv)
-    gen_reaction_dict(reac_csv)
-    gen_split_dict(spli_csv)
-
-init()
\ No newline at end of file
+def default_rules() -> RuleSet:
+    """Returns the rules of the CSV files next to this module, loaded on first use."""
+    global default
+    if default is None:
+        default = RuleSet.load()
+    return default
+
+def rules_of(world: World) -> RuleSet:
+    """Returns the rules of a world, giving it the default ones if it has none yet."""
+    if world.rules is None:
+        world.rules = default_rules()
+    return world.rules
+
+def init() -> RuleSet:
+    return default_rules()
+
+def compile_rules():
+    default_rules().compile()
+
+# The module level tables of older code are the ones of the default rules
+LEGACY: Tuple[str, ...] = ("particle_dict", "reaction_dict", "split_dict", "species", "energy_id", "reaction_table", "split_table")
+
+def __getattr__(name: str) -> Any:
+    if name in LEGACY:
+        return getattr(default_rules(), name)
+    raise AttributeError(f"module {__name__} has no attribute {name}")
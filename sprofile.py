@@ -0,0 +1,206 @@
+"""Per phase profiling of PhysicWorld.simulate.
+
+A Profiler attached to a world times every phase of simulate (add_objects, sim_forces,
+sim_move, sim_wall_bounce, sim_collisions, resolve_events, clear_objects), the spatial
+index work done inside them, and counts pair tests, contacts, reactions, splits and
+deaths. Each frame becomes a FrameStats kept in a ring buffer, and can be dumped
+periodically to CSV or JSON lines.
+
+    profiler = Profiler(dump_path="profile.csv", dump_every=100)
+    profiler.attach(world)
+    ...
+    print(profiler.summary())
+
+Worlds without a profiler only pay one attribute check per step.
+"""
+from __future__ import annotations
+from typing import List, Dict, Tuple, Any, Optional, NamedTuple
+from collections import deque
+from time import perf_counter
+import csv
+import json
+
+from svector import SVector2 as Vector
+from scircles import PhysicWorld
+
+PHASES : Tuple[str, ...] = ("add_objects", "sim_forces", "sim_move", "sim_wall_bounce", "sim_collisions", "resolve_events", "clear_objects")
+
+class FrameStats(NamedTuple):
+    """Measures of one step. Times are in seconds."""
+    frame : int
+    time : float
+    objects : int
+    sleeping : int
+    add_objects : float
+    sim_forces : float
+    sim_move : float
+    sim_wall_bounce : float
+    sim_collisions : float
+    resolve_events : float
+    clear_objects : float
+    # Spatial index maintenance (update and remove), spread over the phases above
+    grid_updates : int
+    grid_time : float
+    # Broad phase (candidate_pairs), part of sim_collisions
+    broad_time : float
+    pair_tests : int
+    hits : int
+    reactions : int
+    splits : int
+    deaths : int
+    # occupancy[k] is the number of cells holding k objects, the last bin counts the
+    # fuller ones too. Only sampled every histogram_every frames, empty otherwise
+    occupancy : Tuple[int, ...]
+
+class TimedIndex:
+    """Wraps a spatial index to time and count the calls made to it."""
+    def __init__(self, index : Any, clock):
+        self.index : Any = index
+        self.clock = clock
+        self.scale : float = index.scale
+        self.updates : int = 0
+        self.update_time : float = 0.0
+        self.pairs_time : float = 0.0
+
+    def __getattr__(self, name : str) -> Any:
+        # grid, cells, levels... of the wrapped index
+        return getattr(self.index, name)
+
+    def query(self, pos : Vector, radius : float) -> List[Any]:
+        return self.index.query(pos, radius)
+
+    def pairs(self) -> List[Tuple[Any, Any]]:
+        start = self.clock()
+        pairs = self.index.pairs()
+        self.pairs_time += self.clock() - start
+        return pairs
+
+    def update(self, obj : Any, minX : int, maxX : int, minY : int, maxY : int):
+        start = self.clock()
+        self.index.update(obj, minX, maxX, minY, maxY)
+        self.update_time += self.clock() - start
+        self.updates += 1
+
+    def remove(self, obj : Any):
+        start = self.clock()
+        self.index.remove(obj)
+        self.update_time += self.clock() - start
+        self.updates += 1
+
+    def rebuild(self, objs : Any, clear : bool = True):
+        self.index.rebuild(objs, clear)
+
+    def occupancy(self) -> List[int]:
+        return self.index.occupancy()
+
+class Profiler:
+    """Collects FrameStats from the worlds it is attached to.
+
+    Args:
+        capacity (int): Frames kept in the ring buffer
+        histogram_every (int): Frames between two grid occupancy histograms, 0 to never take them
+        histogram_bins (int): Bins of the occupancy histograms
+        dump_path (str): File the new frames are appended to, as CSV if it ends with .csv
+            and as JSON lines otherwise
+        dump_every (int): Frames between two dumps, 0 to only dump on demand
+    """
+    clock = staticmethod(perf_counter)
+
+    def __init__(self, capacity : int = 1000, histogram_every : int = 10, histogram_bins : int = 16,
+                 dump_path : Optional[str] = None, dump_every : int = 0):
+        self.frames : deque = deque(maxlen=capacity)
+        self.histogram_every : int = histogram_every
+        self.histogram_bins : int = histogram_bins
+        self.dump_path : Optional[str] = dump_path
+        self.dump_every : int = dump_every
+        # Frames recorded so far, and how many of them were dumped
+        self.recorded : int = 0
+        self.dumped : int = 0
+        self.index : Optional[TimedIndex] = None
+        self.events : Dict[str, int] = {"reaction": 0, "split": 0, "death": 0}
+
+    def attach(self, world : PhysicWorld):
+        """Starts profiling a world. Its index is wrapped, so call set_index before attaching."""
+        self.index = TimedIndex(world.index, self.clock)
+        world.index = self.index
+        world.profiler = self
+        world.observers.append(self)
+
+    def detach(self, world : PhysicWorld):
+        world.index = self.index.index
+        world.profiler = None
+        world.observers.remove(self)
+        self.index = None
+        if self.dump_path:
+            self.dump()
+
+    def on_event(self, world : PhysicWorld, event : str, *args):
+        if event in self.events:
+            self.events[event] += 1
+
+    def on_frame(self, world : PhysicWorld):
+        pass
+
+    def histogram(self, world : PhysicWorld) -> Tuple[int, ...]:
+        bins = [0] * self.histogram_bins
+        last = self.histogram_bins - 1
+        for n in world.index.occupancy():
+            bins[min(n, last)] += 1
+        return tuple(bins)
+
+    def record(self, world : PhysicWorld, timings : Tuple[float, ...]):
+        """Called by PhysicWorld.simulate with the duration of each of the PHASES."""
+        index = self.index
+        events = self.events
+        occupancy : Tuple[int, ...] = ()
+        if self.histogram_every and world.frame % self.histogram_every == 0:
+            occupancy = self.histogram(world)
+        self.frames.append(FrameStats(world.frame, world.time, len(world.objects), len(world.sleeping), *timings,
+                                      index.updates, index.update_time, index.pairs_time,
+                                      world.pair_tests, world.collision_pairs,
+                                      events["reaction"], events["split"], events["death"], occupancy))
+        index.updates = 0
+        index.update_time = 0.0
+        index.pairs_time = 0.0
+        for key in events:
+            events[key] = 0
+        self.recorded += 1
+        if self.dump_every and self.dump_path and self.recorded - self.dumped >= self.dump_every:
+            self.dump()
+
+    def last(self) -> Optional[FrameStats]:
+        return self.frames[-1] if self.frames else None
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Returns the mean and max of every numeric measure over the ring buffer."""
+        frames = list(self.frames)
+        stats : Dict[str, Dict[str, float]] = {}
+        if not frames:
+            return stats
+        for field in FrameStats._fields[2:-1]:
+            values = [getattr(f, field) for f in frames]
+            stats[field] = {"mean": sum(values) / len(values), "max": max(values)}
+        return stats
+
+    def pending(self) -> List[FrameStats]:
+        """Returns the frames of the ring buffer that were not dumped yet."""
+        count = min(self.recorded - self.dumped, len(self.frames))
+        return list(self.frames)[len(self.frames) - count:]
+
+    def dump(self, path : Optional[str] = None):
+        """Appends the frames recorded since the last dump to path, or to dump_path."""
+        path = path or self.dump_path
+        frames = self.pending()
+        self.dumped = self.recorded
+        if not frames:
+            return
+        with open(path, "a", newline="") as file:
+            if path.endswith(".csv"):
+                writer = csv.writer(file)
+                if file.tell() == 0:
+                    writer.writerow(FrameStats._fields)
+                for f in frames:
+                    writer.writerow(f[:-1] + (" ".join(map(str, f.occupancy)),))
+            else:
+                for f in frames:
+                    file.write(json.dumps(f._asdict()) + "\n")
@@ -0,0 +1,269 @@
+"""Region, radius, nearest neighbour and density queries over the objects of a world.
+
+A WorldQuery copies the live objects of a world into arrays (positions, radii) sorted into
+a cell list, and answers queries in batch with NumPy. Results are indices into
+query.objects, so they can be used straight on the arrays or turned back into objects:
+
+    query = squery.of(world)
+    inside = query.rect(0, 0, 200, 100)
+    near = query.nearest(Vector(500, 300), 8)
+    print([query.objects[i] for i in near])
+    density = query.density()
+
+The copy and every result are cached, and only thrown away once world.version changes,
+that is once an object moves, appears or disappears. Observers, renderers and tools
+asking the same question during a frame, or while the world is paused or asleep, share
+one answer. Cached arrays are read only, copy them before changing them.
+"""
+from __future__ import annotations
+from typing import List, Dict, Tuple, Optional, Union, Any
+from itertools import chain
+from math import ceil
+
+import numpy as np
+
+from svector import SVector2 as Vector
+from sgridspace import World, WObject
+
+Point = Union[Vector, Tuple[float, float]]
+
+def coords(point : Point) -> Tuple[float, float]:
+    if isinstance(point, Vector):
+        return point.x, point.y
+    return float(point[0]), float(point[1])
+
+def as_points(points : Any) -> np.ndarray:
+    """Returns points (an (m, 2) array or Vector) as an (m, 2) float64 array."""
+    if isinstance(points, np.ndarray):
+        return points.astype(np.float64, copy=False).reshape(-1, 2)
+    return np.array([coords(p) for p in points], np.float64).reshape(-1, 2)
+
+def expand(starts : np.ndarray, counts : np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns, for ranges [starts[k], starts[k] + counts[k]), the range of every element
+    and the element itself."""
+    total = int(counts.sum())
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + offsets
+
+def of(world : World) -> WorldQuery:
+    """Returns the WorldQuery shared by every user of a world."""
+    if world.queries is None:
+        world.queries = WorldQuery(world)
+    return world.queries
+
+class WorldQuery:
+    """Cached batched queries over a world.
+
+    Args:
+        world (World): World to query
+        cell (float): Cell size of the cell list, the world scale by default
+    """
+    def __init__(self, world : World, cell : Optional[float] = None):
+        self.world : World = world
+        self.cell : float = cell or world.scale
+        self.version : int = -1
+        self.objects : List[WObject] = []
+        self.positions : np.ndarray = np.zeros((0, 2))
+        self.radii : np.ndarray = np.zeros(0)
+        self.max_radius : float = 0.0
+        # Objects sorted by cell, cell (x, y) holds order[start:end] for the keys x * rows + y
+        self.keys : np.ndarray = np.zeros(0, np.int64)
+        self.order : np.ndarray = np.zeros(0, np.int64)
+        self.origin : np.ndarray = np.zeros(2, np.int64)
+        self.columns : int = 0
+        self.rows : int = 0
+        self.cache : Dict[Tuple[Any, ...], Any] = {}
+        # Snapshots taken and cached answers served, to see whether caching pays
+        self.builds : int = 0
+        self.hits : int = 0
+
+    def refresh(self):
+        """Takes a new copy of the world if it changed since the last one."""
+        world = self.world
+        if world.version == self.version:
+            return
+        self.version = world.version
+        self.cache.clear()
+        self.builds += 1
+        if hasattr(world, "pos"):
+            # Array backed world, read straight from its columns
+            slots = np.flatnonzero(world.live[:world.size])
+            self.objects = [world.owners[s] for s in slots.tolist()]
+            self.positions = world.pos[slots]
+            self.radii = world.radius[slots]
+        else:
+            self.objects = [o for o in chain(world.objects, world.new_objects) if not o.dead]
+            self.positions = np.array([(o.position.x, o.position.y) for o in self.objects], np.float64).reshape(-1, 2)
+            self.radii = np.array([o.radius for o in self.objects], np.float64)
+        n = len(self.objects)
+        self.max_radius = float(self.radii.max()) if n else 0.0
+        if not n:
+            self.keys = self.order = np.zeros(0, np.int64)
+            self.columns = self.rows = 0
+            return
+        cells = np.floor(self.positions / self.cell).astype(np.int64)
+        self.origin = cells.min(axis=0)
+        cells -= self.origin
+        self.columns = int(cells[:, 0].max()) + 1
+        self.rows = int(cells[:, 1].max()) + 1
+        keys = cells[:, 0] * self.rows + cells[:, 1]
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        for array in (self.positions, self.radii, self.keys, self.order):
+            array.flags.writeable = False
+
+    def cached(self, key : Tuple[Any, ...], compute) -> Any:
+        self.refresh()
+        result = self.cache.get(key)
+        if result is None:
+            result = self.cache[key] = compute()
+            if isinstance(result, np.ndarray):
+                result.flags.writeable = False
+        else:
+            self.hits += 1
+        return result
+
+    def candidates(self, lo : np.ndarray, hi : np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (box, object) index pairs of the objects whose center lies in the cells
+        covered by each of the boxes [lo[k], hi[k]]."""
+        empty = np.zeros(0, np.int64)
+        if not len(self.objects) or not len(lo):
+            return empty, empty
+        first = np.floor(lo / self.cell).astype(np.int64) - self.origin
+        last = np.floor(hi / self.cell).astype(np.int64) - self.origin
+        first = np.maximum(first, 0)
+        last[:, 0] = np.minimum(last[:, 0], self.columns - 1)
+        last[:, 1] = np.minimum(last[:, 1], self.rows - 1)
+        boxes : List[np.ndarray] = []
+        found : List[np.ndarray] = []
+        span = int((last[:, 0] - first[:, 0]).max(initial=-1)) + 1
+        # One slice of the sorted keys per column of cells
+        for dx in range(span):
+            x = first[:, 0] + dx
+            ok = (x <= last[:, 0]) & (first[:, 1] <= last[:, 1])
+            if not ok.any():
+                continue
+            box = np.flatnonzero(ok)
+            start = np.searchsorted(self.keys, x[box] * self.rows + first[box, 1], "left")
+            end = np.searchsorted(self.keys, x[box] * self.rows + last[box, 1], "right")
+            owner, index = expand(start, end - start)
+            boxes.append(box[owner])
+            found.append(self.order[index])
+        if not boxes:
+            return empty, empty
+        return np.concatenate(boxes), np.concatenate(found)
+
+    def circles(self, points : Any, radius : Union[float, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Batched circle query, like World.overlap_circle for every point.
+
+        Args:
+            points: (m, 2) array or Vector of the centers
+            radius (float or np.ndarray): Radius of all the circles, or of each
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (point, object) index pairs of the objects strictly
+            overlapping each circle, sorted by point then object
+        """
+        self.refresh()
+        pts = as_points(points)
+        r = np.broadcast_to(np.asarray(radius, np.float64), (len(pts),))
+        reach = (r + self.max_radius)[:, None]
+        p, o = self.candidates(pts - reach, pts + reach)
+        d = self.positions[o] - pts[p]
+        hit = (d * d).sum(axis=1) < (r[p] + self.radii[o]) ** 2
+        p, o = p[hit], o[hit]
+        order = np.lexsort((o, p))
+        return p[order], o[order]
+
+    def circle(self, center : Point, radius : float) -> np.ndarray:
+        """Returns the sorted indices of the objects strictly overlapping a circle."""
+        x, y = coords(center)
+        return self.cached(("circle", x, y, radius), lambda: self.circles(np.array([[x, y]]), radius)[1])
+
+    def rect(self, x0 : float, y0 : float, x1 : float, y1 : float) -> np.ndarray:
+        """Returns the sorted indices of the objects overlapping the rectangle [x0, x1] x [y0, y1]."""
+        def compute() -> np.ndarray:
+            self.refresh()
+            reach = self.max_radius
+            b, o = self.candidates(np.array([[x0 - reach, y0 - reach]]), np.array([[x1 + reach, y1 + reach]]))
+            pos = self.positions[o]
+            # Distance from each center to the closest point of the rectangle
+            d = np.clip(pos, (x0, y0), (x1, y1)) - pos
+            dist = (d * d).sum(axis=1)
+            return np.sort(o[(dist == 0) | (dist < self.radii[o] ** 2)])
+        return self.cached(("rect", x0, y0, x1, y1), compute)
+
+    def nearest_many(self, points : Any, k : int) -> np.ndarray:
+        """Batched k nearest neighbours, by distance between centers.
+
+        Returns:
+            np.ndarray: (m, k) object indices, nearest first, -1 where the world holds
+            fewer than k objects
+        """
+        pts = as_points(points)
+        m = len(pts)
+        self.refresh()
+        n = len(self.objects)
+        result = np.full((m, k), -1, np.int64)
+        if not n or not k or not m:
+            return result
+        want = min(k, n)
+        todo = np.arange(m)
+        radius = self.cell
+        # Squared distance from each point to the farthest corner of the box of the centers
+        span = np.maximum(np.abs(pts - self.positions.min(axis=0)), np.abs(pts - self.positions.max(axis=0)))
+        farthest = (span * span).sum(axis=1)
+        while len(todo):
+            # Every object closer than radius is found, so the want closest of them are
+            # the nearest ones as soon as there are enough
+            reach = np.full((len(todo), 1), radius)
+            p, o = self.candidates(pts[todo] - reach, pts[todo] + reach)
+            d = self.positions[o] - pts[todo][p]
+            dist = (d * d).sum(axis=1)
+            inside = dist < radius * radius
+            p, o, dist = p[inside], o[inside], dist[inside]
+            counts = np.bincount(p, minlength=len(todo))
+            done = (counts >= want) | (farthest[todo] < radius * radius)
+            keep = done[p]
+            p, o, dist = p[keep], o[keep], dist[keep]
+            order = np.lexsort((o, dist, p))
+            p, o = p[order], o[order]
+            rank = np.arange(len(p)) - np.repeat(np.cumsum(counts[done]) - counts[done], counts[done])
+            first = rank < want
+            result[todo[p[first]], rank[first]] = o[first]
+            todo = todo[~done]
+            radius *= 2.0
+        return result
+
+    def nearest(self, point : Point, k : int = 1) -> np.ndarray:
+        """Returns the indices of the k objects whose centers are nearest to a point, nearest first."""
+        x, y = coords(point)
+        def compute() -> np.ndarray:
+            found = self.nearest_many(np.array([[x, y]]), k)[0]
+            return found[found >= 0]
+        return self.cached(("nearest", x, y, k), compute)
+
+    def density(self, cell : Optional[float] = None) -> np.ndarray:
+        """Returns the number of object centers in every cell of a grid covering the world.
+
+        Args:
+            cell (float): Cell size, the world scale by default
+
+        Returns:
+            np.ndarray: (columns, rows) counts, centers outside of the world go to the border cells
+        """
+        cell = cell or self.world.scale
+        def compute() -> np.ndarray:
+            self.refresh()
+            world = self.world
+            columns = ceil(world.W / cell)
+            rows = ceil(world.H / cell)
+            counts = np.zeros((columns, rows), np.int64)
+            if self.objects:
+                cells = np.floor(self.positions / cell).astype(np.int64)
+                x = np.clip(cells[:, 0], 0, columns - 1)
+                y = np.clip(cells[:, 1], 0, rows - 1)
+                np.add.at(counts, (x, y), 1)
+            return counts
+        return self.cached(("density", cell), compute)
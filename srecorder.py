@@ -0,0 +1,208 @@
+"""Streaming recorder of simulation runs.
+
+A Recorder observes a PhysicWorld and streams, for every frame, the position, velocity,
+species and internal energy of each particle, plus the reaction, split and death events.
+Frames are grouped in chunks that a background thread compresses and appends to a file,
+so stepping only waits on the disk when the bounded in-memory buffer is full.
+
+File layout, a sequence of records:
+    1 byte      record kind, b"F" for a chunk of frames or b"E" for a chunk of events
+    4 bytes     little endian length of the compressed payload
+    payload     zlib compressed record
+
+Use read_frames and read_events to go through a run one chunk at a time.
+
+Frames are numbered by world.frame once their step is done, the state the world is in when
+attached being the first one. Events carry the number of the frame that ends the step they
+happen in, so the particles they involve are in the frames before it and their products
+from that frame on. Every particle keeps a single id until it leaves the simulation.
+"""
+from __future__ import annotations
+from typing import List, Dict, Tuple, Iterator, Optional
+from itertools import chain
+from queue import Queue, Full
+from threading import Thread
+import json
+import struct
+import warnings
+import zlib
+
+import numpy as np
+
+from scircles import PhysicWorld
+from sparticles import Particle
+
+FRAMES = b"F"
+EVENTS = b"E"
+COLUMNS : List[Tuple[str, str]] = [
+    ("id", "<i8"),
+    ("species", "<i2"),
+    ("x", "<f8"),
+    ("y", "<f8"),
+    ("vx", "<f8"),
+    ("vy", "<f8"),
+    ("energy", "<f8"),
+]
+
+class Recorder:
+    """Records a PhysicWorld run to a chunked, compressed, append-only file.
+
+    Args:
+        path (str): Output file
+        chunk_frames (int): Frames per compressed chunk
+        max_chunks (int): Chunks that may wait for the writer thread. When the buffer is full
+            stepping waits for the writer, unless block is False
+        block (bool): Wait for the writer. When False, chunks that don't fit in the buffer
+            are dropped, counted in dropped_chunks, and close warns about them
+        level (int): zlib compression level
+    """
+    def __init__(self, path : str, chunk_frames : int = 64, max_chunks : int = 8, block : bool = True, level : int = 6):
+        self.path : str = path
+        self.chunk_frames : int = chunk_frames
+        self.block : bool = block
+        self.level : int = level
+        self.ids : Dict[Particle, int] = {}
+        self.next_id : int = 0
+        # Particles that died during the step, they keep their id until the frame is recorded
+        # since their reaction or split is reported after their death
+        self.dead : List[Particle] = []
+        self.frames : List[int] = []
+        self.times : List[float] = []
+        self.counts : List[int] = []
+        self.columns : Dict[str, List[np.ndarray]] = {name: [] for name, dtype in COLUMNS}
+        self.events : List[Tuple] = []
+        self.dropped_chunks : int = 0
+        self.queue : Queue = Queue(max_chunks)
+        self.file = open(path, "ab")
+        self.thread : Thread = Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def attach(self, world : PhysicWorld):
+        """Starts recording a world, with its current state as the first frame."""
+        world.observers.append(self)
+        self.on_frame(world)
+
+    def detach(self, world : PhysicWorld):
+        world.observers.remove(self)
+
+    def id_of(self, part : Particle) -> int:
+        pid = self.ids.get(part)
+        if pid is None:
+            pid = self.next_id
+            self.next_id += 1
+            self.ids[part] = pid
+        return pid
+
+    def on_event(self, world : PhysicWorld, event : str, *args):
+        if event == "death":
+            self.dead.append(args[0])
+        # world.frame is only increased once the step is done
+        self.events.append((world.frame + 1, event) + tuple(self.id_of(p) for p in args))
+
+    def on_frame(self, world : PhysicWorld):
+        parts = [o for o in chain(world.objects, world.new_objects) if not o.dead]
+        n = len(parts)
+        ids = np.fromiter((self.id_of(p) for p in parts), np.int64, n)
+        species = np.fromiter((p.blueprint.id for p in parts), np.int16, n)
+        if hasattr(world, "pos"):
+            # Array backed world, copy straight from its storage
+            slots = np.fromiter((p.slot for p in parts), np.int64, n)
+            pos = world.pos[slots]
+            vel = world.vel[slots]
+            energy = world.energy[slots]
+        else:
+            pos = np.array([p.position.as_list() for p in parts], np.float64).reshape(n, 2)
+            vel = np.array([p.velocity.as_list() for p in parts], np.float64).reshape(n, 2)
+            energy = np.fromiter((p.internal_energy for p in parts), np.float64, n)
+        for name, column in (("id", ids), ("species", species), ("x", pos[:, 0]), ("y", pos[:, 1]),
+                             ("vx", vel[:, 0]), ("vy", vel[:, 1]), ("energy", energy)):
+            self.columns[name].append(column)
+        self.frames.append(world.frame)
+        self.times.append(world.time)
+        self.counts.append(n)
+        for part in self.dead:
+            self.ids.pop(part, None)
+        self.dead = []
+        if len(self.frames) >= self.chunk_frames:
+            self.flush()
+
+    def flush(self):
+        """Hands the buffered frames and events to the writer thread."""
+        if self.frames:
+            header = {"frames": self.frames, "times": self.times, "counts": self.counts, "columns": COLUMNS}
+            data = [np.concatenate(self.columns[name]).astype(dtype) for name, dtype in COLUMNS]
+            self.put((FRAMES, header, data))
+            self.frames, self.times, self.counts = [], [], []
+            self.columns = {name: [] for name, dtype in COLUMNS}
+        if self.events:
+            self.put((EVENTS, self.events, None))
+            self.events = []
+
+    def put(self, record : Tuple):
+        try:
+            self.queue.put(record, self.block)
+        except Full:
+            self.dropped_chunks += 1
+
+    def write_loop(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            kind, header, data = record
+            if kind == FRAMES:
+                meta = json.dumps(header).encode("utf-8")
+                payload = struct.pack("<I", len(meta)) + meta + b"".join(column.tobytes() for column in data)
+            else:
+                payload = json.dumps(header).encode("utf-8")
+            payload = zlib.compress(payload, self.level)
+            self.file.write(kind + struct.pack("<I", len(payload)) + payload)
+
+    def close(self):
+        """Flushes everything left, waits for the writer thread and closes the file."""
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        if self.dropped_chunks:
+            warnings.warn(f"{self.path} misses {self.dropped_chunks} chunks, the writer could not keep up", RuntimeWarning)
+
+def read_records(path : str) -> Iterator[Tuple[bytes, bytes]]:
+    with open(path, "rb") as file:
+        while True:
+            head = file.read(5)
+            if len(head) < 5:
+                return
+            kind = head[:1]
+            size, = struct.unpack("<I", head[1:])
+            yield kind, zlib.decompress(file.read(size))
+
+def read_frames(path : str) -> Iterator[Tuple[int, float, Dict[str, np.ndarray]]]:
+    """Yields (frame, time, columns) for every recorded frame, one chunk in memory at a time."""
+    for kind, payload in read_records(path):
+        if kind != FRAMES:
+            continue
+        size, = struct.unpack("<I", payload[:4])
+        header = json.loads(payload[4:4 + size].decode("utf-8"))
+        total = sum(header["counts"])
+        offset = 4 + size
+        columns : Dict[str, np.ndarray] = {}
+        for name, dtype in header["columns"]:
+            columns[name] = np.frombuffer(payload, dtype, total, offset)
+            offset += total * np.dtype(dtype).itemsize
+        start = 0
+        for frame, time, count in zip(header["frames"], header["times"], header["counts"]):
+            yield frame, time, {name: column[start:start + count] for name, column in columns.items()}
+            start += count
+
+def read_events(path : str, kinds : Optional[List[str]] = None) -> Iterator[Tuple]:
+    """Yields every recorded event as (frame, kind, ids...), optionally only of some kinds.
+
+    A "reaction" lists the two reactants and the product, a "split" the parent and both
+    products, and a "death" the particle that left the simulation."""
+    for kind, payload in read_records(path):
+        if kind != EVENTS:
+            continue
+        for event in json.loads(payload.decode("utf-8")):
+            if kinds is None or event[1] in kinds:
+                yield tuple(event)
@@ -0,0 +1,89 @@
+"""Batched pygame renderer for worlds of particles.
+
+Every species is pre-rendered once into a sprite (circle plus symbol label) and all
+particles are drawn with a single Surface.blits call per frame.
+"""
+from __future__ import annotations
+from typing import List, Dict, Tuple, Sequence
+from colorsys import rgb_to_hsv, hsv_to_rgb
+from itertools import chain
+from time import perf_counter
+
+import pygame
+
+from scircles import PhysicWorld
+from sparticles import ParticleBlueprint
+
+class Renderer:
+    """Draws the particles of a world onto a surface.
+
+    Args:
+        screen (pygame.Surface): Target surface
+        font (pygame.font.Font): Font of the species labels
+        labels (bool): Draw the species labels
+        label_limit (int): Above this many particles labels are skipped
+        frame_budget (float): Seconds a frame may take to draw. Slower frames make the
+            renderer skip drawing the following ones, up to max_skip in a row
+        max_skip (int): Maximum number of frames skipped in a row
+    """
+    def __init__(self, screen : pygame.Surface, font : pygame.font.Font, labels : bool = True, label_limit : int = 5000,
+                 frame_budget : float = 1.0 / 30.0, max_skip : int = 4):
+        self.screen : pygame.Surface = screen
+        self.font : pygame.font.Font = font
+        self.labels : bool = labels
+        self.label_limit : int = label_limit
+        self.frame_budget : float = frame_budget
+        self.max_skip : int = max_skip
+        self.sprites : Dict[Tuple[int, bool], Tuple[pygame.Surface, int]] = {}
+        self.skip : int = 0
+        self.skipped : int = 0
+        # Seconds spent drawing the last frame that was drawn
+        self.draw_time : float = 0.0
+
+    def sprite(self, blueprint : ParticleBlueprint, label : bool) -> Tuple[pygame.Surface, int]:
+        """Returns the cached sprite of a species and its radius."""
+        key = (blueprint.id, label)
+        cached = self.sprites.get(key)
+        if cached is None:
+            r = blueprint.radius
+            surface = pygame.Surface((2 * r, 2 * r), pygame.SRCALPHA)
+            pygame.draw.circle(surface, blueprint.color, (r, r), r)
+            if label:
+                h, s, v = rgb_to_hsv(blueprint.color[0], blueprint.color[1], blueprint.color[2])
+                text = self.font.render(blueprint.symbol, True, hsv_to_rgb((h + 0.5) % 1, s, 100))
+                surface.blit(text, text.get_rect(center=(r, r)))
+            cached = (surface, r)
+            self.sprites[key] = cached
+        return cached
+
+    def should_draw(self) -> bool:
+        """Tells whether the next frame should be drawn, skipping frames while drawing is too slow."""
+        if self.skip > 0:
+            self.skip -= 1
+            self.skipped += 1
+            return False
+        return True
+
+    def draw(self, world : PhysicWorld):
+        """Draws every live particle of the world. Returns nothing, see draw_time."""
+        parts = [o for o in chain(world.objects, world.new_objects) if not o.dead]
+        self.draw_particles([(o.blueprint, o.position.x, o.position.y) for o in parts])
+
+    def draw_particles(self, particles : Sequence[Tuple[ParticleBlueprint, float, float]]):
+        """Draws particles given as (blueprint, x, y), like the ones of a sstepper.FrameSnapshot."""
+        start = perf_counter()
+        H = self.screen.get_height()
+        label = self.labels and len(particles) <= self.label_limit
+        sprites : Dict[ParticleBlueprint, Tuple[pygame.Surface, int]] = {}
+        batch : List[Tuple[pygame.Surface, Tuple[float, float]]] = []
+        for blueprint, x, y in particles:
+            cached = sprites.get(blueprint)
+            if cached is None:
+                cached = self.sprite(blueprint, label)
+                sprites[blueprint] = cached
+            surface, r = cached
+            batch.append((surface, (x - r, H - y - r)))
+        self.screen.blits(batch, False)
+        self.draw_time = perf_counter() - start
+        if self.draw_time > self.frame_budget:
+            self.skip = min(self.max_skip, int(self.draw_time / self.frame_budget))
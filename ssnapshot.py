@@ -0,0 +1,258 @@
+"""Snapshots of a world of particles in a compact columnar binary file.
+
+File layout:
+    8 bytes     magic, b"SPSNAP1\\n"
+    4 bytes     little endian length of the header
+    header      UTF-8 JSON with the world size, seed, sleep settings, species symbols, particle count
+                and column table
+    columns     one little endian array per column, each starting on a 64 byte boundary
+
+Columns can be memory mapped with read_columns without building a world, for analysis
+or to seed benchmark runs from the exact same state.
+"""
+from __future__ import annotations
+from typing import List, Dict, Tuple, Any, Type
+import gc
+import json
+import struct
+
+import numpy as np
+
+from svector import SVector2 as Vector
+from scircles import PhysicWorld
+from sparticles import Particle
+import sparticles
+
+MAGIC = b"SPSNAP1\n"
+ALIGN = 64
+COLUMNS : List[Tuple[str, str]] = [
+    ("species", "<i2"),
+    ("x", "<f8"),
+    ("y", "<f8"),
+    ("vx", "<f8"),
+    ("vy", "<f8"),
+    ("energy", "<f8"),
+    ("flags", "u1"),
+    ("uid", "<i8"),
+    # Frames spent at rest, see PhysicWorld.sleep_frames
+    ("rest", "<i4"),
+    # Rank among the awake objects, that move in this order, -1 for the others
+    ("awake", "<i8"),
+]
+FLAG_DEAD = 1
+# The particle sits in new_objects and joins the simulation on the next step
+FLAG_PENDING = 2
+FLAG_ASLEEP = 4
+
+def padding(offset : int) -> int:
+    return -offset % ALIGN
+
+def world_columns(world : PhysicWorld) -> Dict[str, np.ndarray]:
+    """Gathers the state of every particle of a world into columns."""
+    parts : List[Particle] = list(world.objects) + list(world.new_objects)
+    pending = len(world.objects)
+    n = len(parts)
+    columns = {name: np.empty(n, dtype) for name, dtype in COLUMNS}
+    if hasattr(world, "pos"):
+        # Array backed world, copy straight from its storage
+        slots = np.fromiter((o.slot for o in parts), np.int64, n)
+        columns["x"][:] = world.pos[slots, 0]
+        columns["y"][:] = world.pos[slots, 1]
+        columns["vx"][:] = world.vel[slots, 0]
+        columns["vy"][:] = world.vel[slots, 1]
+        columns["energy"][:] = world.energy[slots]
+        columns["rest"][:] = world.idle[slots]
+    else:
+        columns["x"][:] = [o.position.x for o in parts]
+        columns["y"][:] = [o.position.y for o in parts]
+        columns["vx"][:] = [o.velocity.x for o in parts]
+        columns["vy"][:] = [o.velocity.y for o in parts]
+        columns["energy"][:] = [o.internal_energy for o in parts]
+        resting = world.resting
+        columns["rest"][:] = [resting.get(o, 0) for o in parts]
+    columns["species"][:] = [o.blueprint.id for o in parts]
+    columns["uid"][:] = [o.uid for o in parts]
+    rank = {o: k for k, o in enumerate(world.awake)}
+    columns["awake"][:] = [rank.get(o, -1) for o in parts]
+    flags = np.fromiter((o.dead for o in parts), np.uint8, n) * FLAG_DEAD
+    flags[pending:] |= FLAG_PENDING
+    sleeping = world.sleeping
+    flags |= np.fromiter((o in sleeping for o in parts), np.uint8, n) * FLAG_ASLEEP
+    columns["flags"][:] = flags
+    return columns
+
+def save(world : PhysicWorld, path : str):
+    """Writes the full state of a world of particles to path."""
+    columns = world_columns(world)
+    count = len(columns["x"])
+    table : List[Dict[str, Any]] = []
+    offset = 0
+    for name, dtype in COLUMNS:
+        table.append({"name": name, "dtype": dtype, "offset": offset})
+        offset += count * np.dtype(dtype).itemsize
+        offset += padding(offset)
+    header = json.dumps({
+        "width": world.W,
+        "height": world.H,
+        "scale": world.scale,
+        "seed": world.rng.seed,
+        "frame": world.frame,
+        "time": world.time,
+        "next_uid": world.next_uid,
+        "sleep_frames": world.sleep_frames,
+        "sleep_speed": world.sleep_speed,
+        "count": count,
+        "species": [b.symbol for b in sparticles.rules_of(world).species],
+        "columns": table,
+    }).encode("utf-8")
+    with open(path, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<I", len(header)))
+        file.write(header)
+        file.write(b"\0" * padding(len(MAGIC) + 4 + len(header)))
+        for name, dtype in COLUMNS:
+            data = columns[name].tobytes()
+            file.write(data)
+            file.write(b"\0" * padding(len(data)))
+
+def read_columns(path : str, mmap : bool = True) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """Reads the header and columns of a snapshot.
+
+    Args:
+        path (str): Snapshot file
+        mmap (bool): Memory map the columns instead of reading them
+
+    Returns:
+        Tuple[Dict[str, Any], Dict[str, np.ndarray]]: Header and columns by name
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a SParticles snapshot")
+        size, = struct.unpack("<I", file.read(4))
+        header = json.loads(file.read(size).decode("utf-8"))
+        start = len(MAGIC) + 4 + size
+        start += padding(start)
+        count = header["count"]
+        columns : Dict[str, np.ndarray] = {}
+        for column in header["columns"]:
+            if mmap:
+                columns[column["name"]] = np.memmap(path, column["dtype"], "r", start + column["offset"], (count,))
+            else:
+                file.seek(start + column["offset"])
+                columns[column["name"]] = np.fromfile(file, column["dtype"], count)
+    return header, columns
+
+def load(path : str, world_type : Type[PhysicWorld] = PhysicWorld, **kwargs) -> PhysicWorld:
+    """Restores a world saved with save.
+
+    Particles are restored in bulk, without going through WObject.__init__, and the grid
+    is rebuilt in a single pass.
+
+    The world reuses the saved seed unless seed is given. Restored with the backend, rules
+    and forces of the saved world, it then goes on bit for bit like the saved run would
+    have; other backends or a new seed only continue it statistically.
+
+    Args:
+        path (str): Snapshot file
+        world_type (Type[PhysicWorld]): Class of the restored world
+        kwargs: Extra arguments for the world constructor
+
+    Returns:
+        PhysicWorld: The restored world
+    """
+    # Creating millions of objects would trigger many useless full collections
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return restore(path, world_type, **kwargs)
+    finally:
+        if collecting:
+            gc.enable()
+
+def restore(path : str, world_type : Type[PhysicWorld], **kwargs) -> PhysicWorld:
+    header, columns = read_columns(path)
+    # Snapshots written before seeds were saved restore with a random one
+    kwargs.setdefault("seed", header.get("seed"))
+    world = world_type(header["width"], header["height"], header["scale"], **kwargs)
+    count = header["count"]
+    blueprints = [sparticles.rules_of(world).particle_dict[s] for s in header["species"]]
+    species = columns["species"].tolist()
+    flags = columns["flags"].tolist()
+    # Snapshots written before uids were saved number their particles in order
+    uids = columns["uid"].tolist() if "uid" in columns else range(count)
+    world.frame = header.get("frame", 0)
+    world.time = header.get("time", 0.0)
+    world.next_uid = header.get("next_uid", count)
+    world.sleep_frames = header.get("sleep_frames", world.sleep_frames)
+    world.sleep_speed = header.get("sleep_speed", world.sleep_speed)
+    backed = hasattr(world, "pos")
+    if not backed:
+        xs = columns["x"].tolist()
+        ys = columns["y"].tolist()
+        vxs = columns["vx"].tolist()
+        vys = columns["vy"].tolist()
+        energies = columns["energy"].tolist()
+    parts : List[Particle] = []
+    live : List[Particle] = []
+    pending : List[Particle] = []
+    new = Particle.__new__
+    register = world.register
+    for k in range(count):
+        bp = blueprints[species[k]]
+        part = new(Particle)
+        part.blueprint = bp
+        part.world = world
+        part.slot = -1
+        part.uid = uids[k]
+        part.limits = None
+        part.dead = bool(flags[k] & FLAG_DEAD)
+        register(part)
+        if not backed:
+            part.position = Vector(xs[k], ys[k])
+            part.velocity = Vector(vxs[k], vys[k])
+            part.radius = bp.radius
+            part.mass = bp.mass
+            part.internal_energy = energies[k]
+        parts.append(part)
+        if part.dead:
+            world.dying.append(part)
+        if flags[k] & FLAG_PENDING:
+            pending.append(part)
+        else:
+            live.append(part)
+    radius = np.array([b.radius for b in blueprints], np.float64)[columns["species"]]
+    if backed:
+        # Array backed world, fill its storage in bulk
+        slots = np.fromiter((p.slot for p in parts), np.int64, count)
+        world.pos[slots, 0] = columns["x"]
+        world.pos[slots, 1] = columns["y"]
+        world.vel[slots, 0] = columns["vx"]
+        world.vel[slots, 1] = columns["vy"]
+        world.energy[slots] = columns["energy"]
+        world.live[slots] = (columns["flags"] & FLAG_DEAD) == 0
+        world.radius[slots] = radius
+        world.mass[slots] = np.array([b.mass for b in blueprints], np.float64)[columns["species"]]
+    limits = np.empty((count, 4), np.int64)
+    limits[:, 0] = np.floor((columns["x"] - radius) / world.scale)
+    limits[:, 1] = np.floor((columns["x"] + radius) / world.scale)
+    limits[:, 2] = np.floor((columns["y"] - radius) / world.scale)
+    limits[:, 3] = np.floor((columns["y"] + radius) / world.scale)
+    world.new_objects.update(dict.fromkeys(live))
+    world.add_objects()
+    if "awake" in columns:
+        # Sleepers, and the order the awake objects move in, which sweeps depend on
+        asleep = np.flatnonzero(columns["flags"] & FLAG_ASLEEP)
+        awake = np.flatnonzero(columns["awake"] >= 0)
+        awake = awake[np.argsort(columns["awake"][awake])]
+        world.awake.clear()
+        world.awake.update(dict.fromkeys(parts[k] for k in awake.tolist()))
+        world.sleeping.update(dict.fromkeys(parts[k] for k in asleep.tolist()))
+        rest = columns["rest"]
+        if backed:
+            world.active[slots[asleep]] = False
+            world.idle[slots] = rest
+        else:
+            world.resting = {parts[k]: r for k, r in zip(awake.tolist(), rest[awake].tolist()) if r > 0}
+    world.new_objects.update(dict.fromkeys(pending))
+    world.rebuild_grid(parts, limits.tolist(), clear=False)
+    return world
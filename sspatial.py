@@ -0,0 +1,248 @@
+"""Alternative spatial indexes for sgridspace.World, and automatic cell sizing.
+
+Every index implements the methods of sgridspace.UniformGrid (query, pairs, update,
+remove, rebuild and occupancy) and has a scale, the cell size objects compute their
+limits with. Pass one to the world constructor, or move a populated world to it with
+World.set_index:
+
+    world = PhysicWorld(W, H, SCALE, index=MultiGrid(5))
+    world.set_index(auto_grid(world))
+
+UniformGrid: fixed array of cells over the world, the default. Cheapest when its cell
+    size matches the objects, see auto_scale.
+HashGrid: only stores the cells in use, in a dict. For very large, sparse or unbounded worlds.
+MultiGrid: stack of hashed grids with doubling cell sizes, each object lives in the level
+    that fits its size. For worlds mixing very small and very large radii.
+"""
+from __future__ import annotations
+from typing import List, Tuple, Dict, Iterable, Sequence
+from itertools import chain
+from math import ceil, floor, log2
+
+from svector import SVector2 as Vector
+from sgridspace import World, WObject, WLimits, UniformGrid
+
+Cell = Dict[WObject, None]
+
+def auto_scale(radii : Sequence[float], width : float, height : float, steps : int = 32) -> float:
+    """Picks the cell size of a uniform grid for a population of objects.
+
+    Small cells register every object in many cells, large cells test many far apart
+    pairs. For each candidate size s, with c(s) the mean number of cells an object spans:
+        registrations ~ N * c(s)
+        pair tests    ~ N^2 * c(s)^2 * s^2 / (2 * width * height)
+    A pair test (limits check, narrow phase) costs about twice a registration, and the
+    size with the lowest weighted sum is returned.
+
+    Args:
+        radii (Sequence[float]): Radius of every object
+        width (float): World width
+        height (float): World height
+        steps (int): Number of candidate sizes, from the smallest diameter to four times the largest
+
+    Returns:
+        float: Cell size
+    """
+    if not radii:
+        return max(width, height)
+    n = len(radii)
+    counts : Dict[float, int] = {}
+    for r in radii:
+        counts[r] = counts.get(r, 0) + 1
+    low = max(2.0 * min(radii), 1e-9)
+    high = 8.0 * max(radii)
+    area = width * height
+    best = high
+    best_cost = float("inf")
+    for i in range(steps + 1):
+        s = low * (high / low) ** (i / steps)
+        cells = sum(k * (1.0 + 2.0 * r / s) ** 2 for r, k in counts.items()) / n
+        cost = n * cells + n * n * cells * cells * s * s / area
+        if cost < best_cost:
+            best = s
+            best_cost = cost
+    return best
+
+def auto_grid(world : World) -> UniformGrid:
+    """Returns a uniform grid sized by auto_scale for the current objects of a world."""
+    radii = [o.radius for o in chain(world.objects, world.new_objects) if not o.dead]
+    return UniformGrid(world.W, world.H, auto_scale(radii, world.W, world.H))
+
+class HashGrid:
+    """Sparse grid that only stores its non empty cells, keyed by (x, y).
+
+    It has no bounds, objects far outside of the world are indexed like any other.
+
+    Args:
+        scale (float): Cell size objects compute their limits with
+        shift (int): Cells are 2**shift times larger than scale. Used by MultiGrid levels
+    """
+    def __init__(self, scale : float, shift : int = 0):
+        self.scale : float = scale
+        self.shift : int = shift
+        self.size : float = scale * (1 << shift)
+        self.cells : Dict[Tuple[int, int], Cell] = {}
+
+    def cell_range(self, l : WLimits) -> Tuple[int, int, int, int]:
+        s = self.shift
+        return l.minX >> s, l.maxX >> s, l.minY >> s, l.maxY >> s
+
+    def insert(self, obj : WObject, minX : int, maxX : int, minY : int, maxY : int):
+        cells = self.cells
+        for x in range(minX, maxX + 1):
+            for y in range(minY, maxY + 1):
+                cell = cells.get((x, y))
+                if cell is None:
+                    cell = cells[(x, y)] = {}
+                cell[obj] = None
+
+    def discard(self, obj : WObject, minX : int, maxX : int, minY : int, maxY : int):
+        cells = self.cells
+        for x in range(minX, maxX + 1):
+            for y in range(minY, maxY + 1):
+                cell = cells[(x, y)]
+                del cell[obj]
+                if not cell:
+                    del cells[(x, y)]
+
+    def query(self, pos : Vector, radius : float) -> List[WObject]:
+        found : List[WObject] = []
+        cells = self.cells
+        size = self.size
+        px = pos.x
+        py = pos.y
+        startX = floor((pos.x - radius) / size)
+        startY = floor((pos.y - radius) / size)
+        for x in range(startX, floor((pos.x + radius) / size) + 1):
+            for y in range(startY, floor((pos.y + radius) / size) + 1):
+                cell = cells.get((x, y))
+                if cell is None:
+                    continue
+                for obj in cell:
+                    # Objects spanning several cells are only reported by the first one
+                    minX, maxX, minY, maxY = self.cell_range(obj.limits)
+                    if max(minX, startX) != x or max(minY, startY) != y:
+                        continue
+                    p = obj.position
+                    dx = p.x - px
+                    dy = p.y - py
+                    if dx * dx + dy * dy < (radius + obj.radius) ** 2:
+                        found.append(obj)
+        return found
+
+    def pairs(self) -> List[Tuple[WObject, WObject]]:
+        pairs : List[Tuple[WObject, WObject]] = []
+        s = self.shift
+        for (x, y), cell in self.cells.items():
+            n = len(cell)
+            if n < 2:
+                continue
+            cell = list(cell)
+            for i in range(n):
+                a = cell[i]
+                al = a.limits
+                for j in range(i + 1, n):
+                    bl = cell[j].limits
+                    if max(al.minX, bl.minX) >> s == x and max(al.minY, bl.minY) >> s == y:
+                        pairs.append((a, cell[j]))
+        return pairs
+
+    def update(self, obj : WObject, minX : int, maxX : int, minY : int, maxY : int):
+        old = obj.limits
+        s = self.shift
+        if old is None:
+            obj.limits = WLimits(minX, maxX, minY, maxY)
+        else:
+            previous = self.cell_range(old)
+            old.minX, old.maxX, old.minY, old.maxY = minX, maxX, minY, maxY
+            if previous == (minX >> s, maxX >> s, minY >> s, maxY >> s):
+                return
+            self.discard(obj, *previous)
+        self.insert(obj, minX >> s, maxX >> s, minY >> s, maxY >> s)
+
+    def remove(self, obj : WObject):
+        self.discard(obj, *self.cell_range(obj.limits))
+
+    def occupancy(self) -> List[int]:
+        """Returns the number of objects in every stored, non empty, cell."""
+        return [len(cell) for cell in self.cells.values()]
+
+    def rebuild(self, objs : Iterable[WObject], clear : bool = True):
+        if clear:
+            self.cells.clear()
+        for obj in objs:
+            self.insert(obj, *self.cell_range(obj.limits))
+
+class MultiGrid:
+    """Hierarchy of hashed grids, level k has cells 2**k times larger than scale.
+
+    Each object is indexed once, in the finest level whose cells are at least as large as
+    its diameter, so it never spans more than 2x2 cells. Pairs are searched inside each
+    level, then from every object up into the coarser levels.
+
+    Args:
+        scale (float): Cell size of the finest level, about the smallest diameter
+        levels (int): Number of levels. Larger objects all go to the last one
+    """
+    def __init__(self, scale : float, levels : int = 4):
+        self.scale : float = scale
+        self.levels : List[HashGrid] = [HashGrid(scale, k) for k in range(levels)]
+
+    def level_of(self, obj : WObject) -> HashGrid:
+        ratio = 2.0 * obj.radius / self.scale
+        k = ceil(log2(ratio)) if ratio > 1.0 else 0
+        return self.levels[min(k, len(self.levels) - 1)]
+
+    def query(self, pos : Vector, radius : float) -> List[WObject]:
+        found : List[WObject] = []
+        for level in self.levels:
+            if level.cells:
+                found.extend(level.query(pos, radius))
+        return found
+
+    def pairs(self) -> List[Tuple[WObject, WObject]]:
+        pairs : List[Tuple[WObject, WObject]] = []
+        levels = [level for level in self.levels if level.cells]
+        for k, fine in enumerate(levels):
+            pairs.extend(fine.pairs())
+            coarser = levels[k + 1:]
+            if not coarser:
+                continue
+            s = fine.shift
+            for (x, y), cell in fine.cells.items():
+                for b in cell:
+                    bl = b.limits
+                    # Visit each object once, from its first cell
+                    if bl.minX >> s != x or bl.minY >> s != y:
+                        continue
+                    for level in coarser:
+                        cells = level.cells
+                        c = level.shift
+                        minX, maxX, minY, maxY = level.cell_range(bl)
+                        for cx in range(minX, maxX + 1):
+                            for cy in range(minY, maxY + 1):
+                                other = cells.get((cx, cy))
+                                if other is None:
+                                    continue
+                                for a in other:
+                                    al = a.limits
+                                    if max(al.minX >> c, minX) == cx and max(al.minY >> c, minY) == cy:
+                                        pairs.append((a, b))
+        return pairs
+
+    def update(self, obj : WObject, minX : int, maxX : int, minY : int, maxY : int):
+        self.level_of(obj).update(obj, minX, maxX, minY, maxY)
+
+    def remove(self, obj : WObject):
+        self.level_of(obj).remove(obj)
+
+    def occupancy(self) -> List[int]:
+        return [n for level in self.levels for n in level.occupancy()]
+
+    def rebuild(self, objs : Iterable[WObject], clear : bool = True):
+        if clear:
+            for level in self.levels:
+                level.cells.clear()
+        for obj in objs:
+            level = self.level_of(obj)
+            level.insert(obj, *level.cell_range(obj.limits))
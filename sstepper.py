@@ -0,0 +1,123 @@
+"""Runs the simulation in its own thread with a fixed timestep.
+
+The stepper advances the world by fixed delta steps to keep up with the wall clock, and
+after each batch of steps publishes an immutable FrameSnapshot. The front end draws the
+latest snapshot whenever it is ready, so slow rendering drops frames instead of slowing
+the physics down.
+"""
+from __future__ import annotations
+from typing import List, Tuple, NamedTuple
+from threading import Thread, Lock, Event
+from itertools import chain
+from time import perf_counter, sleep
+
+from scircles import PhysicWorld
+from sparticles import ParticleBlueprint
+
+class FrameSnapshot(NamedTuple):
+    """Immutable picture of the world after a step."""
+    frame : int
+    time : float
+    # (blueprint, x, y) of every live particle
+    particles : Tuple[Tuple[ParticleBlueprint, float, float], ...]
+    internal_energy : float
+    total_energy : float
+    # Seconds spent in PhysicWorld.simulate by the last step
+    step_time : float
+
+def take_snapshot(world : PhysicWorld, step_time : float = 0.0) -> FrameSnapshot:
+    particles : List[Tuple[ParticleBlueprint, float, float]] = []
+    ie = 0.0
+    te = 0.0
+    for part in chain(world.objects, world.new_objects):
+        if part.dead:
+            continue
+        position = part.position
+        particles.append((part.blueprint, position.x, position.y))
+        ie += part.internal_energy
+        te += part.total_energy()
+    return FrameSnapshot(world.frame, world.time, tuple(particles), ie, te, step_time)
+
+class Stepper:
+    """Steps a world in a background thread.
+
+    Args:
+        world (PhysicWorld): World to simulate. Only the stepper thread may touch it once started
+        delta (float): Fixed timestep
+        speed (float): Simulated seconds per wall clock second
+        max_steps (int): Steps taken at most per batch, so the thread can't fall into a
+            spiral of ever growing catch up work
+    """
+    def __init__(self, world : PhysicWorld, delta : float = 0.01, speed : float = 1.0, max_steps : int = 10):
+        self.world : PhysicWorld = world
+        self.delta : float = delta
+        self.speed : float = speed
+        self.max_steps : int = max_steps
+        self.paused : bool = False
+        # Run while paused, for as long as it is set
+        self.hold : bool = False
+        # Step as fast as possible, ignoring the wall clock
+        self.fast_forward : bool = False
+        self.pending_steps : int = 0
+        self.lock : Lock = Lock()
+        self.stopped : Event = Event()
+        self.front : FrameSnapshot = take_snapshot(world)
+        self.thread : Thread = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def step(self, count : int = 1):
+        """Requests single steps, taken even while paused."""
+        with self.lock:
+            self.pending_steps += count
+
+    def snapshot(self) -> FrameSnapshot:
+        """Returns the latest published snapshot."""
+        with self.lock:
+            return self.front
+
+    def publish(self, step_time : float):
+        back = take_snapshot(self.world, step_time)
+        with self.lock:
+            self.front = back
+
+    def run(self):
+        accumulator = 0.0
+        last = perf_counter()
+        while not self.stopped.is_set():
+            now = perf_counter()
+            elapsed = now - last
+            last = now
+            with self.lock:
+                steps = self.pending_steps
+                self.pending_steps = 0
+            waiting = self.paused and not self.hold
+            if waiting:
+                accumulator = 0.0
+            elif self.fast_forward:
+                steps = max(steps, 1)
+                accumulator = 0.0
+            else:
+                accumulator += elapsed * self.speed
+                while accumulator >= self.delta and steps < self.max_steps:
+                    accumulator -= self.delta
+                    steps += 1
+                # Drop the time we could not catch up with
+                accumulator = min(accumulator, self.delta)
+            if steps == 0:
+                if waiting:
+                    sleep(self.delta)
+                else:
+                    sleep((self.delta - accumulator) / max(self.speed, 1e-9))
+                continue
+            step_time = 0.0
+            for i in range(steps):
+                start = perf_counter()
+                self.world.simulate(self.delta)
+                step_time = perf_counter() - start
+            self.publish(step_time)
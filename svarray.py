@@ -0,0 +1,184 @@
+"""Batches of 2D vectors over NumPy buffers, with the API of svector.SVector2.
+
+    velocities = SVector2Array(world.vel[:world.size])  # view, no copy
+    velocities.imul(0.5)                                # slows every object down in place
+
+Operations return new arrays, except the in place variants (iadd, isub, imul) which
+write into the wrapped buffer and return the same SVector2Array. Operands may be another
+SVector2Array, a single SVector2 (broadcast to every row), or anything NumPy can turn
+into an (n, 2) array. Scalar operands may also be (n,) arrays, one value per vector.
+"""
+from __future__ import annotations
+from typing import List, Union, Iterator, Iterable
+
+import numpy as np
+
+from svector import SVector2
+
+Operand = Union["SVector2Array", SVector2, np.ndarray]
+Scalar = Union[float, np.ndarray]
+
+def as_rows(other : Operand) -> np.ndarray:
+    if isinstance(other, SVector2Array):
+        return other.data
+    if isinstance(other, SVector2):
+        return np.array((other.x, other.y))
+    return np.asarray(other, np.float64)
+
+def as_column(other : Scalar) -> np.ndarray:
+    value = np.asarray(other, np.float64)
+    return value[:, None] if value.ndim == 1 else value
+
+class SVector2Array:
+    """A batch of 2D vectors stored as the rows of an (n, 2) float64 array.
+
+    Args:
+        data: (n, 2) buffer. A float64 array is wrapped as is, so the batch can be a view
+            over other storage, anything else is converted
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data : Union[np.ndarray, Iterable]):
+        data = np.asarray(data, np.float64)
+        if data.ndim != 2 or data.shape[1] != 2:
+            raise ValueError(f"SVector2Array needs an (n, 2) buffer, not {data.shape}")
+        self.data : np.ndarray = data
+
+    @staticmethod
+    def zeros(n : int) -> SVector2Array:
+        return SVector2Array(np.zeros((n, 2)))
+
+    @staticmethod
+    def from_vectors(vectors : Iterable[SVector2]) -> SVector2Array:
+        """Packs SVector2 objects into a new batch."""
+        return SVector2Array(np.array([(v.x, v.y) for v in vectors], np.float64).reshape(-1, 2))
+
+    def to_vectors(self) -> List[SVector2]:
+        """Unpacks the batch into new SVector2 objects."""
+        return [SVector2(x, y) for x, y in self.data.tolist()]
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.data[:, 0]
+
+    @x.setter
+    def x(self, value : Scalar):
+        self.data[:, 0] = value
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.data[:, 1]
+
+    @y.setter
+    def y(self, value : Scalar):
+        self.data[:, 1] = value
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __iter__(self) -> Iterator[SVector2]:
+        return iter(self.to_vectors())
+
+    def __getitem__(self, item) -> Union[SVector2, SVector2Array]:
+        """An int gives an SVector2 copy, a slice, mask or index array gives an SVector2Array."""
+        if isinstance(item, (int, np.integer)):
+            x, y = self.data[item]
+            return SVector2(float(x), float(y))
+        return SVector2Array(self.data[item])
+
+    def __setitem__(self, item, value : Operand):
+        self.data[item] = as_rows(value)
+
+    def __add__(self, other : Operand) -> SVector2Array:
+        return SVector2Array(self.data + as_rows(other))
+
+    def __radd__(self, other : Operand) -> SVector2Array:
+        return self.__add__(other)
+
+    def __sub__(self, other : Operand) -> SVector2Array:
+        return SVector2Array(self.data - as_rows(other))
+
+    def __rsub__(self, other : Operand) -> SVector2Array:
+        return SVector2Array(as_rows(other) - self.data)
+
+    def __mul__(self, other : Scalar) -> SVector2Array:
+        return SVector2Array(self.data * as_column(other))
+
+    def __rmul__(self, other : Scalar) -> SVector2Array:
+        return self.__mul__(other)
+
+    def __truediv__(self, other : Scalar) -> SVector2Array:
+        return SVector2Array(self.data / as_column(other))
+
+    def __neg__(self) -> SVector2Array:
+        return SVector2Array(-self.data)
+
+    def iadd(self, other : Operand) -> SVector2Array:
+        """Adds to every vector in place and returns this batch."""
+        self.data += as_rows(other)
+        return self
+
+    def isub(self, other : Operand) -> SVector2Array:
+        """Subtracts from every vector in place and returns this batch."""
+        self.data -= as_rows(other)
+        return self
+
+    def imul(self, other : Scalar) -> SVector2Array:
+        """Scales every vector in place and returns this batch."""
+        self.data *= as_column(other)
+        return self
+
+    def sqr_magnitude(self) -> np.ndarray:
+        """Returns the squared magnitude of every vector."""
+        return np.einsum("ij,ij->i", self.data, self.data)
+
+    def __abs__(self) -> np.ndarray:
+        return self.magnitude()
+
+    def magnitude(self) -> np.ndarray:
+        """Returns the magnitude of every vector."""
+        return np.sqrt(self.sqr_magnitude())
+
+    def dot(self, other : Operand) -> np.ndarray:
+        """Returns the dot product of every vector with other."""
+        o = as_rows(other)
+        return self.data[:, 0] * o[..., 0] + self.data[:, 1] * o[..., 1]
+
+    def cross(self, other : Operand) -> np.ndarray:
+        """Returns the magnitude of the cross product of every vector with other."""
+        o = as_rows(other)
+        return self.data[:, 0] * o[..., 1] - self.data[:, 1] * o[..., 0]
+
+    def angle(self, other : Operand) -> np.ndarray:
+        """Returns the angle in radians between every vector and other."""
+        o = as_rows(other)
+        return np.arcsin(self.cross(o) / (self.magnitude() * np.hypot(o[..., 0], o[..., 1])))
+
+    def normalized(self) -> SVector2Array:
+        """Returns vectors of magnitude one in the same directions."""
+        return self / self.magnitude()
+
+    def rotate(self, deg : Scalar) -> SVector2Array:
+        """Rotates every vector by deg radians, one angle for all or one per vector."""
+        c = np.cos(deg)
+        s = np.sin(deg)
+        x = self.data[:, 0]
+        y = self.data[:, 1]
+        return SVector2Array(np.stack((c * x - s * y, s * x + c * y), axis=1))
+
+    def as_list(self) -> List[List[float]]:
+        """Returns a list of [x, y] lists."""
+        return self.data.tolist()
+
+    def __str__(self) -> str:
+        return "[" + ", ".join(f"({x}, {y})" for x, y in self.data.tolist()) + "]"
+
+    @staticmethod
+    def normal(angle : np.ndarray) -> SVector2Array:
+        """Returns unit vectors pointing at the given angles in radians."""
+        return SVector2Array(np.stack((np.cos(angle), np.sin(angle)), axis=1))
+
+    @staticmethod
+    def angled(angle : np.ndarray, magnitude : Scalar) -> SVector2Array:
+        """Returns vectors with the given magnitudes pointing at the given angles in radians."""
+        return SVector2Array(np.stack((np.cos(angle) * magnitude, np.sin(angle) * magnitude), axis=1))
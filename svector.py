@@ -4,6 +4,8 @@ import math
 from math import cos, sin, asin
 
 class SVector2:
+    __slots__ = ("x", "y")
+    
     def __init__(self, x : float, y : float):
         self.x : float = x
         self.y : float = y
@@ -23,6 +25,26 @@ class SVector2:
     def __truediv__(self, other : float) -> SVector2:
         return SVector2(self.x / other, self.y / other)
     
+    # In place variants, for loops that update the same vector many times. The position and
+    # velocity of array backed objects (sarrays.RowVector) write them through to their object.
+    def iadd(self, other : SVector2) -> SVector2:
+        """Adds another vector to this one in place and returns this vector."""
+        self.x += other.x
+        self.y += other.y
+        return self
+    
+    def isub(self, other : SVector2) -> SVector2:
+        """Subtracts another vector from this one in place and returns this vector."""
+        self.x -= other.x
+        self.y -= other.y
+        return self
+    
+    def imul(self, other : float) -> SVector2:
+        """Scales this vector in place and returns it."""
+        self.x *= other
+        self.y *= other
+        return self
+    
     def sqr_magnitude(self) -> float:
         """Return the squared magnitude of the vector"""
         return self.x * self.x + self.y * self.y
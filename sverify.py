@@ -0,0 +1,477 @@
+"""Physics regression checks for the simulation engines. Never imports pygame.
+
+Every check builds seeded worlds and returns a Check telling whether it passed:
+    - momentum and energy are conserved by SCircle.collide, Particle.react and Particle.split
+    - the total energy of whole runs is conserved, on every backend
+    - the parallel strips conserve the total mass across their borders
+    - alternate spatial indexes find exactly the same contacts as the default grid
+    - faster engines (array backend, parallel strips, packed ensembles) are statistically
+      equivalent to the reference object path: same species counts and contacts within noise
+    - runs repeat bit for bit from the same seed, and resume bit for bit from a snapshot
+    - short range forces are pairwise opposite, and Barnes-Hut matches the direct sum
+    - squery answers match brute force searches and the spatial index
+    - recorded events refer to particles of the recorded frames
+
+Usage:
+    python sverify.py [CHECK ...] [--frames N] [--seeds N]
+"""
+from __future__ import annotations
+from typing import List, Dict, Callable, Iterable, NamedTuple
+from argparse import ArgumentParser
+from itertools import chain
+from math import pi
+from random import Random
+from time import perf_counter
+import sys
+
+import numpy as np
+
+from svector import SVector2 as Vector
+from scircles import PhysicWorld, SCircle
+from sparticles import Particle
+import sparticles
+import sbench
+
+class Check(NamedTuple):
+    name : str
+    passed : bool
+    detail : str
+
+def momentum(parts : Iterable[SCircle]) -> Vector:
+    total = Vector(0.0, 0.0)
+    for p in parts:
+        total = total + p.velocity * p.mass
+    return total
+
+def kinetic_energy(parts : Iterable[SCircle]) -> float:
+    return sum(p.velocity.sqr_magnitude() * p.mass / 2.0 for p in parts)
+
+def live(world : PhysicWorld) -> List[Particle]:
+    return [p for p in chain(world.objects, world.new_objects) if not p.dead]
+
+def total_energy(world : PhysicWorld) -> float:
+    return sum(p.total_energy() for p in live(world))
+
+def relative(a : float, b : float) -> float:
+    return abs(a - b) / max(abs(a), abs(b), 1e-12)
+
+def random_velocity(rng : Random, speed : float) -> Vector:
+    return Vector.angled(rng.random() * 2.0 * pi, speed * (0.1 + rng.random()))
+
+def check_rules() -> Check:
+    """The default rules are valid, and every reaction and split keeps the mass, or
+    momentum can't be conserved."""
+    rules = sparticles.default_rules()
+    problems = rules.problems()
+    if problems:
+        return Check("rules", False, "; ".join(problems))
+    errors : List[str] = []
+    species = rules.species
+    for a in species:
+        for b in species:
+            product = rules.reaction_table[a.id][b.id]
+            if product >= 0 and species[product].mass != a.mass + b.mass:
+                errors.append(f"{a.symbol}+{b.symbol}->{species[product].symbol}")
+        for p1, p2 in rules.split_table[a.id]:
+            if species[p1].mass + species[p2].mass != a.mass:
+                errors.append(f"{a.symbol}->{species[p1].symbol}+{species[p2].symbol}")
+    return Check("rules", not errors, "mass not conserved by " + ", ".join(errors) if errors else "masses balanced")
+
+def check_collide(trials : int = 1000, seed : int = 0, tolerance : float = 1e-9) -> Check:
+    """Elastic bounces of random pairs of circles conserve momentum and kinetic energy."""
+    rng = Random(seed)
+    world = PhysicWorld(100, 100, 40)
+    worst = 0.0
+    for t in range(trials):
+        a = SCircle(world, Vector(50, 50), 10, 1 + rng.random() * 3)
+        b = SCircle(world, Vector(50, 50) + Vector.angled(rng.random() * 2.0 * pi, 15), 10, 1 + rng.random() * 3)
+        a.velocity = random_velocity(rng, 100)
+        b.velocity = random_velocity(rng, 100)
+        p0, e0 = momentum((a, b)), kinetic_energy((a, b))
+        a.collide(b)
+        p1, e1 = momentum((a, b)), kinetic_energy((a, b))
+        worst = max(worst, relative(e0, e1), (p0 - p1).magnitude() / max(p0.magnitude(), 1.0))
+        a.remove()
+        b.remove()
+        world.new_objects.clear()
+    return Check("collide", worst <= tolerance, f"worst relative error {worst:.2e} over {trials} bounces")
+
+def check_react(trials : int = 100, seed : int = 0, tolerance : float = 1e-9) -> Check:
+    """Every reaction conserves momentum and total (kinetic plus internal) energy."""
+    rng = Random(seed)
+    world = PhysicWorld(100, 100, 40, rules=sparticles.default_rules())
+    rules = world.rules
+    species = rules.species
+    worst = 0.0
+    count = 0
+    for a in species:
+        for b in species:
+            product = rules.reaction_table[a.id][b.id]
+            if product < 0:
+                continue
+            for t in range(trials):
+                one = a.gen(world, Vector(40, 50))
+                two = b.gen(world, Vector(60, 50))
+                one.velocity = random_velocity(rng, 100)
+                two.velocity = random_velocity(rng, 100)
+                one.internal_energy = rng.random() * one.max_energy
+                two.internal_energy = rng.random() * two.max_energy
+                p0 = momentum((one, two))
+                e0 = one.total_energy() + two.total_energy()
+                before = set(world.new_objects)
+                one.react(two, species[product])
+                made = [p for p in world.new_objects if p not in before]
+                worst = max(worst, relative(e0, sum(p.total_energy() for p in made)),
+                            (p0 - momentum(made)).magnitude() / max(p0.magnitude(), 1.0))
+                for p in made:
+                    p.remove()
+                world.new_objects.clear()
+                count += 1
+    return Check("react", worst <= tolerance, f"worst relative error {worst:.2e} over {count} reactions")
+
+def check_split(trials : int = 100, seed : int = 0, tolerance : float = 1e-9) -> Check:
+    """Every split turns internal energy into kinetic energy and conserves momentum."""
+    rng = Random(seed)
+    world = PhysicWorld(100, 100, 40, rules=sparticles.default_rules())
+    rules = world.rules
+    worst = 0.0
+    count = 0
+    for base in rules.species:
+        if not rules.split_table[base.id]:
+            continue
+        for t in range(trials):
+            part = base.gen(world, Vector(50, 50))
+            part.velocity = random_velocity(rng, 100)
+            part.internal_energy = rng.random() * 2.0 * base.max_energy
+            p0 = momentum((part,))
+            e0 = part.total_energy()
+            before = set(world.new_objects)
+            part.split()
+            made = [p for p in world.new_objects if p not in before]
+            worst = max(worst, relative(e0, sum(p.total_energy() for p in made)),
+                        (p0 - momentum(made)).magnitude() / max(p0.magnitude(), 1.0))
+            for p in made:
+                p.remove()
+            world.new_objects.clear()
+            count += 1
+    return Check("split", worst <= tolerance, f"worst relative error {worst:.2e} over {count} splits")
+
+def check_world_energy(frames : int = 200, seeds : int = 1, tolerance : float = 1e-6) -> List[Check]:
+    """Whole runs of every scenario conserve the total energy, on both backends."""
+    checks : List[Check] = []
+    for backend in ("object", "array"):
+        for name in sbench.SCENARIOS:
+            worst = 0.0
+            for seed in range(seeds):
+                world = sbench.build_world(seed=seed, backend=backend, **sbench.SCENARIOS[name])
+                e0 = total_energy(world)
+                for f in range(frames):
+                    world.simulate(0.01)
+                worst = max(worst, relative(e0, total_energy(world)))
+            checks.append(Check(f"energy {name} {backend}", worst <= tolerance, f"worst relative drift {worst:.2e} after {frames} frames"))
+    return checks
+
+def contacts(world : PhysicWorld) -> set:
+    found = set()
+    for a, b in world.candidate_pairs():
+        reach = a.radius + b.radius
+        if (a.position - b.position).sqr_magnitude() < reach * reach:
+            found.add(frozenset((id(a), id(b))))
+    return found
+
+def check_indexes(frames : int = 50, seed : int = 0) -> List[Check]:
+    """Every spatial index finds exactly the contacts of the default grid, on the same state."""
+    checks : List[Check] = []
+    for name in sbench.SCENARIOS:
+        world = sbench.build_world(seed=seed, **sbench.SCENARIOS[name])
+        for f in range(frames):
+            world.simulate(0.01)
+        reference = contacts(world)
+        default = world.index
+        for kind in sbench.INDEXES[1:]:
+            world.set_index(sbench.make_index(kind, world))
+            found = contacts(world)
+            checks.append(Check(f"index {name} {kind}", found == reference,
+                                f"{len(found)} contacts, {len(reference)} expected"))
+        world.set_index(default)
+    return checks
+
+def observables(world : PhysicWorld, frames : int) -> Dict[str, float]:
+    """Runs a world and returns species counts and mean contacts per frame."""
+    pairs = 0
+    for f in range(frames):
+        world.simulate(0.01)
+        pairs += world.collision_pairs
+    counts = {b.symbol: 0.0 for b in sparticles.rules_of(world).species}
+    for p in live(world):
+        counts[p.blueprint.symbol] += 1
+    counts["contacts"] = pairs / frames
+    return counts
+
+def equivalent(name : str, reference : List[Dict[str, float]], other : List[Dict[str, float]], sigmas : float = 4.0) -> Check:
+    """Compares the means of observables over seeds, within sigmas standard errors."""
+    worst = ""
+    worst_z = 0.0
+    for key in reference[0]:
+        a = np.array([r[key] for r in reference])
+        b = np.array([r[key] for r in other])
+        error = (a.var(ddof=1) / len(a) + b.var(ddof=1) / len(b)) ** 0.5 if len(a) > 1 else 0.0
+        # Allow 2% of the mean on top of the noise, for observables that barely vary
+        error += 0.02 * max(abs(a.mean()), abs(b.mean()), 1.0)
+        z = abs(a.mean() - b.mean()) / error
+        if z > worst_z:
+            worst_z = z
+            worst = f"{key}: {a.mean():.1f} against {b.mean():.1f}"
+    return Check(name, worst_z <= sigmas, f"worst {worst} ({worst_z:.1f} errors)" if worst else "identical")
+
+def check_backends(frames : int = 200, seeds : int = 8) -> List[Check]:
+    """The array backend matches the object path statistically on every scenario."""
+    checks : List[Check] = []
+    for name in sbench.SCENARIOS:
+        params = sbench.SCENARIOS[name]
+        reference = [observables(sbench.build_world(seed=s, **params), frames) for s in range(seeds)]
+        array = [observables(sbench.build_world(seed=s, backend="array", **params), frames) for s in range(seeds)]
+        checks.append(equivalent(f"array {name}", reference, array))
+    return checks
+
+def parallel_observables(name : str, frames : int, seed : int, workers : int) -> Dict[str, float]:
+    from sparallel import ParallelWorld
+    world = ParallelWorld.from_world(sbench.build_world(seed=seed, **sbench.SCENARIOS[name]), workers, seed)
+    try:
+        pairs = 0
+        for f in range(frames):
+            world.simulate(0.01)
+            pairs += world.collision_pairs
+        states = world.states()
+    finally:
+        world.close()
+    counts = {b.symbol: 0.0 for b in world.rules.species}
+    for state in states:
+        counts[state[1]] += 1
+    counts["contacts"] = pairs / frames
+    return counts
+
+def check_parallel(frames : int = 100, seeds : int = 4, workers : int = 2, name : str = "reactions") -> Check:
+    """The parallel strips match the object path statistically."""
+    params = sbench.SCENARIOS[name]
+    reference = [observables(sbench.build_world(seed=s, **params), frames) for s in range(seeds)]
+    parallel = [parallel_observables(name, frames, s, workers) for s in range(seeds)]
+    return equivalent(f"parallel {name}", reference, parallel)
+
+def check_parallel_mass(frames : int = 100, seeds : int = 2, workers : int = 4) -> List[Check]:
+    """Reactions and splits across strip borders conserve the total mass of every scenario."""
+    from sparallel import ParallelWorld
+    checks : List[Check] = []
+    for name in sbench.SCENARIOS:
+        worst = 0.0
+        for seed in range(seeds):
+            world = ParallelWorld.from_world(sbench.build_world(seed=seed, **sbench.SCENARIOS[name]), workers, seed)
+            mass = {b.symbol: b.mass for b in world.rules.species}
+            try:
+                m0 = sum(mass[s[1]] for s in world.states())
+                for f in range(frames):
+                    world.simulate(0.01)
+                m1 = sum(mass[s[1]] for s in world.states())
+            finally:
+                world.close()
+            worst = max(worst, relative(m0, m1))
+        checks.append(Check(f"parallel mass {name}", worst <= 1e-12, f"worst relative drift {worst:.2e} after {frames} frames on {workers} strips"))
+    return checks
+
+def check_packed(frames : int = 200, seeds : int = 16, pack : int = 8) -> Check:
+    """Runs packed into the tiles of a PackedWorld match lone runs statistically."""
+    from sensemble import Run, ensemble
+    params = {"width": 400, "height": 300, "volume_density": 0.001, "species": {"Re": 2, "Gr": 2, "Bl": 2, "Ye": 1, "Ma": 1, "Cy": 1}}
+    runs = [Run(s, params, frames=frames) for s in range(seeds)]
+    results : List[List[Dict[str, float]]] = []
+    for packing in (1, pack):
+        final = [s for s in ensemble(runs, workers=0, every=frames, pack=packing) if s.frame == frames]
+        results.append([dict(s.counts, reactions=s.reactions) for s in sorted(final)])
+    return equivalent("packed", results[0], results[1])
+
+def state_of(world : PhysicWorld) -> np.ndarray:
+    """Returns the state of every live particle as rows sorted by species and position."""
+    rows = np.array([(p.blueprint.id, p.position.x, p.position.y, p.velocity.x, p.velocity.y, p.internal_energy)
+                     for p in live(world)], np.float64).reshape(-1, 6)
+    return rows[np.lexsort(rows.T[::-1])]
+
+def check_repeatable(frames : int = 200, seed : int = 0, name : str = "splits") -> List[Check]:
+    """Two runs from the same seed end bit for bit in the same state."""
+    checks : List[Check] = []
+    for backend in ("object", "array"):
+        states = []
+        for run in range(2):
+            world = sbench.build_world(seed=seed, backend=backend, **sbench.SCENARIOS[name])
+            for f in range(frames):
+                world.simulate(0.01)
+            states.append(state_of(world))
+        same = states[0].shape == states[1].shape and bool((states[0] == states[1]).all())
+        checks.append(Check(f"repeatable {name} {backend}", same,
+                            "identical" if same else f"{len(states[0])} and {len(states[1])} particles, states differ"))
+    return checks
+
+def check_resume(frames : int = 200, seed : int = 0, name : str = "splits") -> List[Check]:
+    """A world restored from a snapshot taken halfway, sleepers included, ends bit for bit
+    like the run that was never interrupted."""
+    import os
+    import tempfile
+    import ssnapshot
+    from sarrays import ArrayParticleWorld
+    checks : List[Check] = []
+    for backend, world_type in (("object", PhysicWorld), ("array", ArrayParticleWorld)):
+        world = sbench.build_world(seed=seed, backend=backend, sleep_frames=5, **sbench.SCENARIOS[name])
+        world.sleep_speed = 20.0
+        for f in range(frames // 2):
+            world.simulate(0.01)
+        handle, path = tempfile.mkstemp(suffix=".snap")
+        os.close(handle)
+        try:
+            ssnapshot.save(world, path)
+            restored = ssnapshot.load(path, world_type)
+        finally:
+            os.remove(path)
+        for f in range(frames - frames // 2):
+            world.simulate(0.01)
+            restored.simulate(0.01)
+        states = state_of(world), state_of(restored)
+        same = states[0].shape == states[1].shape and bool((states[0] == states[1]).all())
+        checks.append(Check(f"resume {name} {backend}", same,
+                            "identical" if same else f"{len(states[0])} and {len(states[1])} particles, states differ"))
+    return checks
+
+def check_forces(particles : int = 2000, seed : int = 0, theta : float = 0.5, tolerance : float = 0.05) -> List[Check]:
+    """Short range forces conserve momentum, the exact tree (theta = 0) gives the direct
+    sum, and the approximate one stays within tolerance of it on average."""
+    import sforces
+    rules = sparticles.default_rules()
+    rng = np.random.default_rng(seed)
+    solid = [pb for pb in rules.species if pb.solid]
+    kinds = rng.integers(0, len(solid), particles)
+    species = np.array([solid[k].id for k in kinds], np.int64)
+    mass = np.array([solid[k].mass for k in kinds], np.float64)
+    pos = rng.random((particles, 2)) * 1000.0
+    symbols = [pb.symbol for pb in solid]
+    short = sforces.ForceField(rules, [(a, b, 1e4, 80.0) for a in symbols for b in symbols])
+    acc = short.accelerations(pos, mass, species)
+    drift = np.abs((acc * mass[:, None]).sum(axis=0)).max() / max(np.abs(acc * mass[:, None]).sum(), 1e-12)
+    checks = [Check("forces momentum", drift <= 1e-9, f"relative momentum drift {drift:.2e}")]
+    pairs = [(symbols[0], b, -1e4, 0.0) for b in symbols]
+    exact = sforces.ForceField(rules, pairs, theta=0.0).accelerations(pos, mass, species)
+    # The first species pulls every species, and is pulled by all of them
+    first = species == solid[0].id
+    d = pos[None, :, :] - pos[:, None, :]
+    r2 = (d * d).sum(axis=2) + 5.0 ** 2
+    w = (first[:, None] | first[None, :]) * 1e4 / r2 ** 1.5
+    np.fill_diagonal(w, 0.0)
+    direct = (d * w[:, :, None]).sum(axis=1) / mass[:, None]
+    error = np.abs(exact - direct).max() / np.abs(direct).max()
+    checks.append(Check("forces exact tree", error <= 1e-9, f"worst relative error {error:.2e}"))
+    approx = sforces.ForceField(rules, pairs, theta=theta).accelerations(pos, mass, species)
+    error = float(np.linalg.norm(approx - exact, axis=1).mean() / np.linalg.norm(exact, axis=1).mean())
+    checks.append(Check("forces barnes-hut", error <= tolerance, f"mean relative error {error:.2e} at theta {theta}"))
+    return checks
+
+def check_queries(frames : int = 10, seed : int = 0, trials : int = 100) -> List[Check]:
+    """The rectangle, circle, nearest and density queries of squery give the answers of
+    brute force searches over every live object, and circles agree with overlap_circle."""
+    import squery
+    checks : List[Check] = []
+    for backend in ("object", "array"):
+        world = sbench.build_world(1200, 800, seed=seed, backend=backend, **sbench.SCENARIOS["dense"])
+        for f in range(frames):
+            world.simulate(0.01)
+        query = squery.of(world)
+        query.refresh()
+        pos, rad = query.positions, query.radii
+        rng = np.random.default_rng(seed)
+        wrong = 0
+        for t in range(trials):
+            x0, y0 = rng.random(2) * (1400, 1000) - 100
+            x1, y1 = x0 + rng.random() * 400, y0 + rng.random() * 300
+            d = np.clip(pos, (x0, y0), (x1, y1)) - pos
+            dist = (d * d).sum(axis=1)
+            wrong += not np.array_equal(query.rect(x0, y0, x1, y1), np.flatnonzero((dist == 0) | (dist < rad ** 2)))
+            center = Vector(*(rng.random(2) * (1400, 1000) - 100))
+            radius = rng.random() * 80
+            found = [query.objects[i] for i in query.circle(center, radius)]
+            wrong += {o for o in found if o.solid} != set(world.overlap_circle(center, radius))
+        points = rng.random((trials, 2)) * (2400, 1600) - (600, 400)
+        dist = ((pos[None, :, :] - points[:, None, :]) ** 2).sum(axis=2)
+        nearest = query.nearest_many(points, 5)
+        best = np.sort(dist, axis=1)[:, :5]
+        wrong += int((np.take_along_axis(dist, nearest, axis=1) != best).any(axis=1).sum())
+        wrong += int(query.density().sum() != len(query.objects))
+        checks.append(Check(f"queries {backend}", not wrong, f"{wrong} wrong answers out of {3 * trials + 1}"))
+    return checks
+
+def check_recorder(frames : int = 100, seed : int = 0, name : str = "splits") -> List[Check]:
+    """Recorded frames follow each other, and every particle an event refers to is in the
+    frame before it, its products in the frame of the event."""
+    import os
+    import tempfile
+    import srecorder
+    # Particles the event consumes, the others are its products
+    consumed = {"reaction": 2, "split": 1, "death": 1}
+    checks : List[Check] = []
+    for backend in ("object", "array"):
+        world = sbench.build_world(seed=seed, backend=backend, **sbench.SCENARIOS[name])
+        handle, path = tempfile.mkstemp(suffix=".rec")
+        os.close(handle)
+        try:
+            recorder = srecorder.Recorder(path)
+            recorder.attach(world)
+            for f in range(frames):
+                world.simulate(0.01)
+            recorder.close()
+            ids = {frame: set(columns["id"].tolist()) for frame, time, columns in srecorder.read_frames(path)}
+            events = list(srecorder.read_events(path))
+        finally:
+            os.remove(path)
+        wrong = int(sorted(ids) != list(range(frames + 1)))
+        for frame, kind, *parts in events:
+            used = consumed[kind]
+            wrong += not set(parts[:used]) <= ids.get(frame - 1, set())
+            wrong += not set(parts[used:]) <= ids.get(frame, set())
+        checks.append(Check(f"recorder {backend}", not wrong and bool(events),
+                            f"{wrong} mismatches in {len(ids)} frames and {len(events)} events"))
+    return checks
+
+CHECKS : Dict[str, Callable[..., object]] = {
+    "rules": lambda frames, seeds: check_rules(),
+    "collide": lambda frames, seeds: check_collide(),
+    "react": lambda frames, seeds: check_react(),
+    "split": lambda frames, seeds: check_split(),
+    "energy": lambda frames, seeds: check_world_energy(frames),
+    "indexes": lambda frames, seeds: check_indexes(),
+    "backends": lambda frames, seeds: check_backends(frames, seeds),
+    "parallel": lambda frames, seeds: check_parallel(frames // 2, max(seeds // 2, 2)),
+    "parallel-mass": lambda frames, seeds: check_parallel_mass(frames, max(seeds // 2, 1)),
+    "repeatable": lambda frames, seeds: check_repeatable(frames),
+    "resume": lambda frames, seeds: check_resume(frames),
+    "packed": lambda frames, seeds: check_packed(frames * 2, max(seeds * 2, 4)),
+    "forces": lambda frames, seeds: check_forces(),
+    "queries": lambda frames, seeds: check_queries(),
+    "recorder": lambda frames, seeds: check_recorder(frames),
+}
+
+def main():
+    parser = ArgumentParser(description="SParticles physics regression checks")
+    parser.add_argument("checks", nargs="*", metavar="CHECK", help=f"any of {', '.join(CHECKS)} (default: all)")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--seeds", type=int, default=6)
+    args = parser.parse_args()
+    for name in args.checks:
+        if name not in CHECKS:
+            parser.error(f"unknown check {name}")
+    failed = 0
+    for name in args.checks or CHECKS:
+        start = perf_counter()
+        results = CHECKS[name](args.frames, args.seeds)
+        seconds = perf_counter() - start
+        for check in results if isinstance(results, list) else [results]:
+            failed += not check.passed
+            print(f"{'PASS' if check.passed else 'FAIL'} {check.name:<28} {check.detail} ({seconds:.1f} s)")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()